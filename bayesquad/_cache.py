@@ -1,18 +1,87 @@
 """Basic caching functionality."""
+import hashlib
+import weakref
+from collections import OrderedDict, namedtuple
 from functools import wraps
+from typing import Callable, Dict, Hashable, Tuple
 
-_cache = {}
+import numpy as np
+from GPy.util.linalg import jitchol
 
+from .maths_helpers import extend_cholesky
 
-def last_value_cache(func):
-    """Cache the result of most recent invocation of this method.
+# The default number of results cached for each method of each instance.
+DEFAULT_CACHE_SIZE = 8
 
-    This decorator may be applied to a method which takes one argument (excluding `self`). If the method is called
-    consecutively with the same argument, the method will immediately return the previous result rather than computing
-    the result again. Note that by "the same argument" we mean the same object - two different but equal objects will
-    not be regarded as the same by this decorator.
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
 
-    The cache is not shared between different instances of the same class.
+# Maps the id of each object which owns a cache to that object's caches. Each entry is removed by a finalizer when the
+# object which owns it is garbage collected, so the lifetime of a cache never exceeds the lifetime of its owner.
+_instance_caches = {}
+
+
+class _LRUCache:
+    """A least-recently-used cache of a fixed size, which counts its hits and misses."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+
+    def get(self, key: Hashable, compute: Callable):
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+
+            return self._entries[key]
+
+        self.misses += 1
+        value = compute()
+
+        self._entries[key] = value
+
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+        return value
+
+    def clear(self):
+        self._entries = OrderedDict()
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+
+def _content_key(x) -> Hashable:
+    """Return a key which identifies an array by its contents, so that equal but distinct arrays have the same key."""
+    x = np.ascontiguousarray(x)
+
+    return x.shape, x.dtype.str, hashlib.blake2b(x.view(np.uint8), digest_size=16).digest()
+
+
+def _get_instance_caches(obj) -> Dict[Callable, _LRUCache]:
+    obj_id = id(obj)
+
+    if obj_id not in _instance_caches:
+        _instance_caches[obj_id] = {}
+        weakref.finalize(obj, _instance_caches.pop, obj_id, None)
+
+    return _instance_caches[obj_id]
+
+
+def last_value_cache(func: Callable = None, *, maxsize: int = DEFAULT_CACHE_SIZE):
+    """Cache the results of the most recent invocations of this method.
+
+    This decorator may be applied to a method which takes one array argument (excluding `self`). If the method is called
+    with an argument which has the same shape, dtype and contents as one of the arguments of its `maxsize` most recent
+    distinct invocations, the method will immediately return the previous result rather than computing the result
+    again. Arrays are compared by a hash of their contents, so two different but equal arrays will be regarded as the
+    same by this decorator. The decorator may be used either bare, or with a `maxsize` keyword argument.
+
+    The cache is not shared between different instances of the same class. Each instance's caches are released when the
+    instance is garbage collected, and may be cleared at any time with :func:`~clear_last_value_caches`.
 
     Examples
     --------
@@ -22,7 +91,7 @@ def last_value_cache(func):
     ...     def __init__(self):
     ...         self._count_invocations = 0
     ...
-    ...     @last_value_cache
+    ...     @last_value_cache(maxsize=2)
     ...     def do_something_expensive(self, array):
     ...         # Do something expensive here.
     ...
@@ -34,6 +103,8 @@ def last_value_cache(func):
     >>> foo = Foo()
     >>> a = np.array(1)
     >>> b = np.array(1)
+    >>> c = np.array(2)
+    >>> d = np.array(3)
 
     `a` and `b` are equal but distinct:
 
@@ -53,17 +124,31 @@ def last_value_cache(func):
     >>> foo.count_expensive_operations()
     1
 
-    We get a cache miss when passing a different object:
+    Since the cache is keyed on the contents of the array, we also get a cache hit when passing `b`:
 
     >>> foo.do_something_expensive(b)
     >>> foo.count_expensive_operations()
+    1
+
+    We get a cache miss when passing an array with different contents:
+
+    >>> foo.do_something_expensive(c)
+    >>> foo.count_expensive_operations()
     2
 
-    Since only a single function call is cached, we get a cache miss when passing the original object again:
+    The two most recent results are cached, so passing `a` again will hit the cache, but once we have passed a third
+    distinct argument, the least recently used result (here, that of `c`) is evicted:
 
     >>> foo.do_something_expensive(a)
+    >>> foo.do_something_expensive(d)
+    >>> foo.do_something_expensive(c)
     >>> foo.count_expensive_operations()
-    3
+    4
+
+    The numbers of hits and misses are recorded for each instance:
+
+    >>> cache_info(foo)
+    {'do_something_expensive': CacheInfo(hits=3, misses=4, maxsize=2, currsize=2)}
 
     The cache is not shared between instances:
 
@@ -74,18 +159,17 @@ def last_value_cache(func):
 
     >>> self = Foo()  # This is a hack to stop PyCharm wrongly warning about unresolved references in this doctest.
     """
+    if func is None:
+        return lambda f: last_value_cache(f, maxsize=maxsize)
+
     @wraps(func)
     def transformed_function(self, x):
-        cache_key = "{}_{}".format(id(self), id(func))
-
-        if cache_key not in _cache or x is not _cache[cache_key][0]:
-            ret = func(self, x)
+        caches = _get_instance_caches(self)
 
-            _cache[cache_key] = [x, ret]
+        if func not in caches:
+            caches[func] = _LRUCache(maxsize)
 
-            return ret
-        else:
-            return _cache[cache_key][1]
+        return caches[func].get(_content_key(x), lambda: func(self, x))
 
     return transformed_function
 
@@ -93,16 +177,192 @@ def last_value_cache(func):
 def clear_last_value_caches(obj):
     """Clear the :func:`~last_value_cache` of every method on the given object.
 
+    The hit and miss counts of the caches are preserved.
+
+    See Also
+    --------
+    :func:`~last_value_cache`"""
+    for cache in _instance_caches.get(id(obj), {}).values():
+        cache.clear()
+
+
+def cache_info(obj) -> Dict[str, CacheInfo]:
+    """Return the hit and miss counts, maximum size and current size of the :func:`~last_value_cache` of every method on
+    the given object which has been called at least once, keyed by method name.
+
     See Also
     --------
     :func:`~last_value_cache`"""
-    obj_id = str(id(obj))
+    return {func.__name__: cache.info() for func, cache in _instance_caches.get(id(obj), {}).items()}
+
+
+class IncrementalDataCache:
+    """Cache a quantity computed from a set of data points, extending it rather than recomputing it from scratch when
+    points are appended to the data.
+
+    The cached quantity is either a vector with one element per data point, or (if `symmetric_matrix` is True) a
+    symmetric matrix with one row and one column per data point. It is recomputed from scratch whenever the parameters
+    on which it depends change, or the previously cached data points are not a prefix of the current data points. If
+    points are removed from the end of the data, the cached quantity is truncated.
+
+    Parameters
+    ----------
+    symmetric_matrix
+        Whether the cached quantity is a symmetric matrix rather than a vector.
+
+    Examples
+    --------
+    >>> import numpy as np
+
+    >>> count_computed_elements = 0
+    >>> def compute_block(rows, columns):
+    ...     global count_computed_elements
+    ...     count_computed_elements += len(rows) * len(columns)
+    ...     return rows @ columns.T
+
+    >>> cache = IncrementalDataCache(symmetric_matrix=True)
+    >>> x = np.arange(6.).reshape(3, 2)
+    >>> parameters = (np.array([1.]),)
+
+    >>> matrix = cache.get(x[:2], parameters, compute_block)
+    >>> count_computed_elements
+    4
+
+    Appending a point only computes the new row, with the new column filled in by symmetry:
+
+    >>> matrix = cache.get(x, parameters, compute_block)
+    >>> count_computed_elements
+    7
+    >>> np.array_equal(matrix, x @ x.T)
+    True
+
+    Changing the parameters invalidates the cache:
+
+    >>> matrix = cache.get(x, (np.array([2.]),), compute_block)
+    >>> count_computed_elements
+    16
+    """
+
+    def __init__(self, symmetric_matrix: bool = False):
+        self.symmetric_matrix = symmetric_matrix
+
+        self._data = None
+        self._parameters = None
+        self._value = None
+
+    def get(self, data: np.ndarray, parameters: Tuple[np.ndarray, ...], compute: Callable) -> np.ndarray:
+        """Return the cached quantity for the given data and parameters, computing only what is not already cached.
+
+        Parameters
+        ----------
+        data
+            A 2D array of shape (num_points, num_dimensions).
+        parameters
+            A tuple of arrays containing every parameter on which the cached quantity depends, other than the data.
+        compute
+            If the cached quantity is a vector, a function taking a 2D array of data points and returning a 1D array of
+            the elements of the quantity for those points. If the cached quantity is a matrix, a function taking two
+            2D arrays of data points, and returning the block of the matrix whose rows correspond to the first set of
+            points and whose columns correspond to the second.
+
+        Returns
+        -------
+        ndarray
+            A 1D array of shape (num_points), or a 2D array of shape (num_points, num_points).
+        """
+        num_cached = self._num_reusable_points(data, parameters)
+        num_points = len(data)
+
+        if num_cached == 0:
+            value = self._compute(data, compute)
+        elif num_cached >= num_points:
+            value = self._value[:num_points, :num_points] if self.symmetric_matrix else self._value[:num_points]
+        else:
+            value = self._extend(data, num_cached, compute)
+
+        self._data = np.array(data)
+        self._parameters = tuple(np.array(parameter) for parameter in parameters)
+        self._value = value
+
+        return value
+
+    def _compute(self, data: np.ndarray, compute: Callable) -> np.ndarray:
+        """Compute the quantity from scratch."""
+        return compute(data, data) if self.symmetric_matrix else compute(data)
+
+    def _extend(self, data: np.ndarray, num_cached: int, compute: Callable) -> np.ndarray:
+        """Extend the cached quantity for the first `num_cached` points of `data` to all of `data`."""
+        if not self.symmetric_matrix:
+            return np.concatenate((self._value[:num_cached], compute(data[num_cached:])))
+
+        num_points = len(data)
+        border = compute(data[num_cached:], data)
+
+        value = np.empty((num_points, num_points), dtype=border.dtype)
+        value[:num_cached, :num_cached] = self._value[:num_cached, :num_cached]
+        value[num_cached:, :] = border
+        value[:num_cached, num_cached:] = border[:, :num_cached].T
+
+        return value
+
+    def clear(self):
+        self._data = None
+        self._parameters = None
+        self._value = None
+
+    def _num_reusable_points(self, data: np.ndarray, parameters: Tuple[np.ndarray, ...]) -> int:
+        """Return the number of leading data points for which the cached quantity is still valid."""
+        if self._value is None or len(parameters) != len(self._parameters):
+            return 0
+
+        if not all(np.array_equal(new, old) for new, old in zip(parameters, self._parameters)):
+            return 0
+
+        num_common = min(len(data), len(self._data))
+
+        if not np.array_equal(data[:num_common], self._data[:num_common]):
+            return 0
+
+        return num_common
+
+
+class IncrementalCholeskyCache(IncrementalDataCache):
+    """Cache the lower Cholesky factor of a covariance matrix of a set of data points, extending the factor rather than
+    recomputing it from scratch when points are appended to the data.
+
+    This behaves as :class:`~IncrementalDataCache`, except that `compute` is a function taking two 2D arrays of data
+    points and returning the block of the covariance matrix (rather than of its Cholesky factor) whose rows correspond
+    to the first set of points and whose columns correspond to the second. Extending the factor by :math:`k` points
+    costs :math:`O(N^2 k)`, rather than the :math:`O(N^3)` cost of factorising the full matrix. Since the leading block
+    of a Cholesky factor is the factor of the leading block of the matrix, removing points from the end of the data
+    just truncates the factor.
+
+    Examples
+    --------
+    >>> import numpy as np
+
+    >>> def compute_covariance(rows, columns):
+    ...     return np.exp(-(rows - columns.T) ** 2)
+
+    >>> cache = IncrementalCholeskyCache()
+    >>> x = np.linspace(0, 3, 4).reshape(4, 1)
+    >>> parameters = (np.array([1.]),)
+
+    >>> _ = cache.get(x[:2], parameters, compute_covariance)
+    >>> cholesky = cache.get(x, parameters, compute_covariance)
+    >>> np.allclose(cholesky @ cholesky.T, compute_covariance(x, x))
+    True
+    """
+
+    def __init__(self):
+        super().__init__(symmetric_matrix=True)
 
-    keys_to_delete = []
+    def _compute(self, data: np.ndarray, compute: Callable) -> np.ndarray:
+        return jitchol(compute(data, data))
 
-    for key in _cache:
-        if key.startswith(obj_id):
-            keys_to_delete.append(key)
+    def _extend(self, data: np.ndarray, num_cached: int, compute: Callable) -> np.ndarray:
+        cached_data, new_data = data[:num_cached], data[num_cached:]
 
-    for key in keys_to_delete:
-        del(_cache[key])
+        return extend_cholesky(cholesky=self._value[:num_cached, :num_cached],
+                               cross_covariance=compute(cached_data, new_data),
+                               new_covariance=compute(new_data, new_data))
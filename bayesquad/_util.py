@@ -20,3 +20,70 @@ def validate_dimensions(x: ndarray, expected_dimensionality: int):
     if actual_dimensionality != expected_dimensionality:
         raise ValueError("Expected data in {} dimensions, but got data in {} dimensions."
                          .format(expected_dimensionality, actual_dimensionality))
+
+
+# The number of rows for which space is initially allocated by a `GrowableArray`, unless more are needed to hold its
+# initial values.
+_DEFAULT_CAPACITY = 64
+
+
+class GrowableArray:
+    """An array to which rows can be appended, at an amortised cost proportional to the number of rows appended.
+
+    The rows are held at the start of a preallocated array, whose capacity is doubled whenever it runs out. `values` is
+    a view of the rows held, so can be handed on (e.g. to GPy) without copying. Appending never modifies the rows
+    already held, so a view taken before an append remains valid, but does not include the new rows.
+
+    Examples
+    --------
+    >>> array = GrowableArray(np.zeros((1, 2)), capacity=2)
+    >>> array.append(np.ones((3, 2)))
+    >>> array.values
+    array([[0., 0.],
+           [1., 1.],
+           [1., 1.],
+           [1., 1.]])
+    """
+
+    def __init__(self, values: ndarray, capacity: int = _DEFAULT_CAPACITY):
+        """
+        Parameters
+        ----------
+        values
+            The initial rows of the array. The shape of each row is fixed by this array, which may have no rows.
+        capacity
+            The number of rows for which space is initially allocated. More will be allocated if needed to hold
+            `values`.
+        """
+        values = np.asarray(values, dtype=float)
+
+        self._num_rows = len(values)
+        self._array = np.empty((max(capacity, self._num_rows, 1),) + values.shape[1:])
+        self._array[:self._num_rows] = values
+
+    def __len__(self) -> int:
+        return self._num_rows
+
+    @property
+    def values(self) -> ndarray:
+        """A view of the rows held by the array."""
+        return self._array[:self._num_rows]
+
+    def append(self, values: ndarray):
+        """Append rows to the array.
+
+        Parameters
+        ----------
+        values
+            An array of rows, or an array which can be reshaped into one.
+        """
+        values = np.reshape(values, (-1,) + self._array.shape[1:])
+        num_rows = self._num_rows + len(values)
+
+        if num_rows > len(self._array):
+            array = np.empty((max(2 * len(self._array), num_rows),) + self._array.shape[1:])
+            array[:self._num_rows] = self.values
+            self._array = array
+
+        self._array[self._num_rows:num_rows] = values
+        self._num_rows = num_rows
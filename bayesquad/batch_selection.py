@@ -1,7 +1,11 @@
 """Methods for selecting a batch of points to evaluate for Bayesian quadrature."""
 
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from math import sqrt
-from typing import List
+from typing import Callable, List, Optional, Sequence, Tuple
 
 import numpy as np
 import numpy.ma as ma
@@ -9,16 +13,21 @@ from numpy import ndarray
 
 from .optimisation import multi_start_maximise_log, multi_start_maximise
 from .plotting import returns_plottable
+from .priors import Prior
 from .quadrature import WarpedIntegrandModel, IntegrandModel
 
 LOCAL_PENALISATION = "Local Penalisation"
 KRIGING_BELIEVER = "Kriging Believer"
 KRIGING_OPTIMIST = "Kriging Optimist"
 
+RANDOM_INITIAL_DESIGN = "Random"
+
 
 def select_batch(integrand_model: IntegrandModel,
                  batch_size: int,
-                 batch_method: str = LOCAL_PENALISATION) -> List[ndarray]:
+                 batch_method: str = LOCAL_PENALISATION,
+                 num_workers: int = None,
+                 initial_design: str = RANDOM_INITIAL_DESIGN) -> List[ndarray]:
     """Select a batch of points at which to evaluate the integrand.
 
     Parameters
@@ -32,6 +41,15 @@ def select_batch(integrand_model: IntegrandModel,
             - "Local Penalisation"
             - "Kriging Believer"
             - "Kriging Optimist"
+    num_workers
+        If given, the multi-start optimisations used to select each point are split across this many worker processes.
+        A snapshot of `integrand_model` is sent to each worker once, when the batch selection begins. If not given, all
+        optimisation is performed in the current process.
+    initial_design
+        How to choose the initial points of the multi-start optimisations. Currently supported designs are:
+            - "Random": independent samples from the prior
+            - "Sobol": a scrambled Sobol sequence mapped through the prior
+            - "Halton": a scrambled Halton sequence mapped through the prior
 
     Returns
     -------
@@ -39,54 +57,94 @@ def select_batch(integrand_model: IntegrandModel,
         A list of arrays. Each array is a point of the new batch.
     """
     if batch_method == LOCAL_PENALISATION:
-        return select_local_penalisation_batch(integrand_model, batch_size)
+        return select_local_penalisation_batch(integrand_model, batch_size, num_workers=num_workers,
+                                               initial_design=initial_design)
     elif batch_method == KRIGING_BELIEVER:
-        return select_kriging_believer_batch(integrand_model, batch_size)
+        return select_kriging_believer_batch(integrand_model, batch_size, num_workers=num_workers,
+                                             initial_design=initial_design)
     elif batch_method == KRIGING_OPTIMIST:
-        return select_kriging_optimist_batch(integrand_model, batch_size)
+        return select_kriging_optimist_batch(integrand_model, batch_size, num_workers=num_workers,
+                                             initial_design=initial_design)
     else:
         raise NotImplementedError("{} is not a supported batch method.".format(batch_method))
 
 
-def select_kriging_believer_batch(integrand_model: IntegrandModel, batch_size: int) -> List[ndarray]:
+def select_kriging_believer_batch(integrand_model: IntegrandModel, batch_size: int,
+                                  num_workers: int = None,
+                                  initial_design: str = RANDOM_INITIAL_DESIGN) -> List[ndarray]:
+    """Select a batch of points by the Kriging Believer method.
+
+    Each point maximises the posterior variance of the integrand, after the GP has been given a fantasy observation,
+    equal to its own posterior mean, at every earlier point of the batch. This leaves the posterior mean unchanged, but
+    removes the variance around the earlier points, so the same point is not selected again. Fantasies do not modify
+    the GP's own posterior (see :func:`~bayesquad.gps.GP.fantasise`), and are removed once the batch is complete.
+
+    See :func:`~select_local_penalisation_batch` for a description of the parameters and return value.
+    """
     batch = []
+    fantasies = []
 
     num_initial_points = 10 * integrand_model.dimensions
 
-    while len(batch) < batch_size:
-        acquisition_function = _model_variance(integrand_model)
-        initial_points = [integrand_model.prior.sample() for _ in range(num_initial_points)]
+    # Fantasies must be removed even if the maximisation fails, or the GP would be left holding them.
+    try:
+        with _worker_pool(integrand_model, num_workers) as executor:
+            while len(batch) < batch_size:
+                initial_points = _get_initial_points(integrand_model.prior, num_initial_points, initial_design)
+
+                batch_point, value = _maximise(integrand_model, _model_variance, initial_points, executor, num_workers,
+                                               fantasies=fantasies, log=True)
+
+                # The fantasy is an observation of the function modelled by the GP, not of its product with the prior.
+                mean_y, _ = integrand_model.gp.posterior_mean_and_variance(batch_point)
 
-        batch_point, value = multi_start_maximise_log(acquisition_function, initial_points)
-        mean_y, _ = integrand_model.posterior_mean_and_variance(batch_point)
+                batch.append(batch_point)
+                integrand_model.fantasise(batch_point, mean_y)
+                fantasies.append((batch_point, mean_y))
+    finally:
+        integrand_model.remove_fantasies()
 
-        batch.append(batch_point)
-        #integrand_model.fantasise(batch_point, mean_y)
     return batch
 
 
-def select_kriging_optimist_batch(integrand_model: IntegrandModel, batch_size: int) -> List[ndarray]:
+def select_kriging_optimist_batch(integrand_model: IntegrandModel, batch_size: int,
+                                  num_workers: int = None,
+                                  initial_design: str = RANDOM_INITIAL_DESIGN) -> List[ndarray]:
+    """Select a batch of points by the Kriging Optimist method.
+
+    This is as :func:`~select_kriging_believer_batch`, except that each fantasy observation is one posterior standard
+    deviation above the GP's posterior mean, rather than equal to it. Fantasies are removed once the batch is complete.
+
+    See :func:`~select_local_penalisation_batch` for a description of the parameters and return value.
+    """
     batch = []
+    fantasies = []
 
     num_initial_points = 10 * integrand_model.dimensions
 
-    while len(batch) < batch_size:
-        acquisition_function = _model_variance(integrand_model)
-        initial_points = [integrand_model.prior.sample() for _ in range(num_initial_points)]
+    try:
+        with _worker_pool(integrand_model, num_workers) as executor:
+            while len(batch) < batch_size:
+                initial_points = _get_initial_points(integrand_model.prior, num_initial_points, initial_design)
 
-        batch_point, value = multi_start_maximise_log(acquisition_function, initial_points)
-        mean_y, var_y = integrand_model.posterior_mean_and_variance(batch_point)
-        optimistic_y = mean_y + np.sqrt(var_y)
+                batch_point, value = _maximise(integrand_model, _model_variance, initial_points, executor, num_workers,
+                                               fantasies=fantasies, log=True)
+                # As for the Kriging Believer, the fantasy is an observation of the function modelled by the GP.
+                mean_y, var_y = integrand_model.gp.posterior_mean_and_variance(batch_point)
+                optimistic_y = mean_y + np.sqrt(var_y)
 
-        batch.append(batch_point)
-        integrand_model.fantasise(batch_point, optimistic_y)
-
-    integrand_model.remove_fantasies()
+                batch.append(batch_point)
+                integrand_model.fantasise(batch_point, optimistic_y)
+                fantasies.append((batch_point, optimistic_y))
+    finally:
+        integrand_model.remove_fantasies()
 
     return batch
 
 
-def select_local_penalisation_batch(integrand_model: IntegrandModel, batch_size: int) -> List[ndarray]:
+def select_local_penalisation_batch(integrand_model: IntegrandModel, batch_size: int,
+                                    num_workers: int = None,
+                                    initial_design: str = RANDOM_INITIAL_DESIGN) -> List[ndarray]:
     """Select a batch of points based on a local penalisation method.
 
     Parameters
@@ -95,6 +153,10 @@ def select_local_penalisation_batch(integrand_model: IntegrandModel, batch_size:
         The model with which we wish to perform Bayesian quadrature.
     batch_size
         The number of points to return in the new batch.
+    num_workers
+        The number of worker processes to use for optimisation. See :func:`~select_batch`.
+    initial_design
+        How to choose the initial points of the optimisations. See :func:`~select_batch`.
 
     Returns
     -------
@@ -114,37 +176,123 @@ def select_local_penalisation_batch(integrand_model: IntegrandModel, batch_size:
     batch = []
     penaliser_gradients = []
 
-    acquisition_function = _model_variance(integrand_model)
     num_initial_points = 10 * integrand_model.dimensions
 
-    while len(batch) < batch_size:
-        softmin_penalised_log_acquisition_function = \
-            _get_soft_penalised_log_acquisition_function(acquisition_function, batch, penaliser_gradients)
+    with _worker_pool(integrand_model, num_workers) as executor:
+        while len(batch) < batch_size:
+            build_objective = partial(_soft_penalised_model_variance,
+                                      penaliser_centres=list(batch), penaliser_gradients=list(penaliser_gradients))
 
-        initial_points = [integrand_model.prior.sample() for _ in range(num_initial_points)]
-        batch_point, value = multi_start_maximise(softmin_penalised_log_acquisition_function,
-                                                  initial_points)
-        #print(batch_point, value)
-        batch.append(batch_point)
+            initial_points = _get_initial_points(integrand_model.prior, num_initial_points, initial_design)
+            batch_point, value = _maximise(integrand_model, build_objective, initial_points, executor, num_workers)
+            #print(batch_point, value)
+            batch.append(batch_point)
 
-        if len(batch) < batch_size:
-            num_local_initial_points = integrand_model.dimensions * 10
-            local_initial_points = _get_local_initial_points(batch_point, num_local_initial_points)
+            if len(batch) < batch_size:
+                num_local_initial_points = integrand_model.dimensions * 10
+                local_initial_points = _get_local_initial_points(batch_point, num_local_initial_points)
 
-            _, max_gradient_squared = multi_start_maximise_log(_variance_gradient_squared_and_jacobian(integrand_model),
-                                                               local_initial_points,
-                                                               gtol=1e-1)
-            max_gradient = sqrt(max_gradient_squared)
+                _, max_gradient_squared = _maximise(integrand_model, _variance_gradient_squared_and_jacobian,
+                                                    local_initial_points, executor, num_workers, log=True, gtol=1e-1)
+                max_gradient = sqrt(max_gradient_squared)
 
-            penaliser_gradients.append(max_gradient / 2)
+                penaliser_gradients.append(max_gradient / 2)
 
     return batch
 
 
+def _maximise(integrand_model: IntegrandModel, build_objective: Callable[[IntegrandModel], Callable],
+              initial_points: ndarray, executor: Optional[ProcessPoolExecutor], num_workers: Optional[int],
+              fantasies: Sequence[Tuple[ndarray, ndarray]] = (), log: bool = False, **kwargs) -> Tuple[ndarray, float]:
+    """Maximise the objective function built from the integrand model by `build_objective`.
+
+    If `executor` is given, the optimisation is split across its workers, each of which builds the objective function
+    from its own snapshot of the integrand model, after applying any fantasies which it has not yet seen."""
+    maximise = multi_start_maximise_log if log else multi_start_maximise
+
+    # We always build the objective function in this process, so that plotting callbacks are notified of it.
+    objective_function = build_objective(integrand_model)
+
+    if executor is None:
+        return maximise(objective_function, initial_points, **kwargs)
+
+    snapshot_objective_function = _SnapshotObjective(build_objective, list(fantasies))
+
+    return maximise(snapshot_objective_function, initial_points, executor=executor, num_shards=num_workers, **kwargs)
+
+
+@contextmanager
+def _worker_pool(integrand_model: IntegrandModel, num_workers: Optional[int]):
+    """Create a pool of worker processes, each holding a snapshot of the integrand model, or yield None if no workers
+    are requested. The model is pickled exactly once, however many objective functions are later evaluated."""
+    if num_workers is None:
+        yield None
+        return
+
+    model_snapshot = pickle.dumps(integrand_model)
+
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_initialise_worker,
+                             initargs=(model_snapshot,)) as executor:
+        yield executor
+
+
+# The integrand model snapshot held by a worker process, and the number of fantasies which have been applied to it.
+_worker_integrand_model = None
+_worker_num_fantasies = 0
+
+
+def _initialise_worker(model_snapshot: bytes):
+    global _worker_integrand_model, _worker_num_fantasies
+
+    _worker_integrand_model = pickle.loads(model_snapshot)
+    _worker_num_fantasies = 0
+
+
+class _SnapshotObjective:
+    """An objective function evaluated on the integrand model snapshot held by the current worker process.
+
+    Only the function which builds the objective from a model, and the fantasies made so far, are pickled - never the
+    model itself."""
+
+    def __init__(self, build_objective: Callable[[IntegrandModel], Callable],
+                 fantasies: List[Tuple[ndarray, ndarray]]):
+        self._build_objective = build_objective
+        self._fantasies = fantasies
+        self._objective_function = None
+
+    def __getstate__(self):
+        return {'_build_objective': self._build_objective, '_fantasies': self._fantasies, '_objective_function': None}
+
+    def __call__(self, x, *args, **kwargs):
+        if self._objective_function is None:
+            self._objective_function = self._build_objective(_synchronised_worker_model(self._fantasies))
+
+        return self._objective_function(x, *args, **kwargs)
+
+
+def _synchronised_worker_model(fantasies: List[Tuple[ndarray, ndarray]]) -> IntegrandModel:
+    """Apply any fantasies which have not yet been applied to this worker's model snapshot, and return the model."""
+    global _worker_num_fantasies
+
+    for x, y in fantasies[_worker_num_fantasies:]:
+        _worker_integrand_model.fantasise(x, y)
+
+    _worker_num_fantasies = len(fantasies)
+
+    return _worker_integrand_model
+
+
+def _get_initial_points(prior: Prior, num_points: int, initial_design: str) -> ndarray:
+    """Get a set of points distributed according to the prior, as a 2D array of shape (num_points, num_dimensions)."""
+    if initial_design == RANDOM_INITIAL_DESIGN:
+        return prior.sample(num_points)
+    else:
+        return prior.sample_low_discrepancy(num_points, sequence=initial_design)
+
+
 def _get_local_initial_points(central_point, num_points):
-    """Get a set of points close to a given point."""
-    perturbations = [0.1 * np.random.randn(*central_point.shape) for _ in range(num_points)]
-    return [central_point + perturbation for perturbation in perturbations]
+    """Get a set of points close to a given point, as a 2D array of shape (num_points, num_dimensions)."""
+    return central_point + 0.1 * np.random.randn(num_points, *central_point.shape)
 
 
 @returns_plottable("Model variance")
@@ -162,11 +310,10 @@ def _model_variance(integrand_model: IntegrandModel):
         If the jacobian is not required (e.g. for plotting), the relevant calculations can be disabled by setting
         `calculate_jacobian=False`.
         """
-        _, variance = integrand_model.posterior_mean_and_variance(x)
-
         if calculate_jacobian:
-            variance_jacobian = integrand_model.posterior_variance_jacobian(x)
+            variance, variance_jacobian = integrand_model.posterior_variance_derivatives(x, order=1)
         else:
+            _, variance = integrand_model.posterior_mean_and_variance(x)
             variance_jacobian = None
 
         return variance, variance_jacobian
@@ -177,8 +324,7 @@ def _model_variance(integrand_model: IntegrandModel):
 @returns_plottable("Grad squared")
 def _variance_gradient_squared_and_jacobian(integrand_model: IntegrandModel):
     def f(x):
-        variance_jacobian = integrand_model.posterior_variance_jacobian(x)
-        variance_hessian = integrand_model.posterior_variance_hessian(x)
+        _, variance_jacobian, variance_hessian = integrand_model.posterior_variance_derivatives(x, order=2)
 
         # Inner product of the jacobian with itself, for each point.
         gradient_squared = np.einsum('...i,...i->...', variance_jacobian, variance_jacobian, optimize=True)
@@ -194,6 +340,12 @@ def _variance_gradient_squared_and_jacobian(integrand_model: IntegrandModel):
     return f
 
 
+def _soft_penalised_model_variance(integrand_model: IntegrandModel, penaliser_centres, penaliser_gradients):
+    """Build the soft penalised log acquisition function used for local penalisation from the integrand model."""
+    return _get_soft_penalised_log_acquisition_function(_model_variance(integrand_model), penaliser_centres,
+                                                        penaliser_gradients)
+
+
 def _get_penalised_acquisition_function(acquisition_function, penaliser_centres, penaliser_gradients):
     """Create a function which will return the minimum of the given acquisition function and the given penalisers at
     any point, or set of points.
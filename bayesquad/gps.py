@@ -6,13 +6,28 @@ from typing import Tuple, Union
 
 import GPy.core.gp
 import numpy as np
+import scipy.linalg
+from GPy.core.parameterization.observable_array import ObsAr
+from GPy.inference.latent_function_inference.exact_gaussian_inference import ExactGaussianInference
+from GPy.inference.latent_function_inference.posterior import Posterior, PosteriorExact
+from GPy.inference.latent_function_inference.var_dtc import VarDTC
+from GPy.likelihoods import Gaussian as GaussianLikelihood
+from GPy.util.linalg import backsub_both_sides, dpotrs, jitchol
 from numpy import ndarray
 
 from . import kernel_gradients
-from ._util import validate_dimensions
+from .kernel_gradients import KernelSnapshot
+from ._util import GrowableArray, validate_dimensions
 from ._cache import last_value_cache, clear_last_value_caches
 from .decorators import flexible_array_dimensions
-from .maths_helpers import jacobian_of_f_squared_times_g, hessian_of_f_squared_times_g
+from .maths_helpers import jacobian_of_f_squared_times_g, hessian_of_f_squared_times_g, extend_cholesky
+
+# GPy's exact inference adds this constant to the diagonal of the covariance matrix, on top of the likelihood variance.
+_EXACT_INFERENCE_JITTER = 1e-8
+
+# GPy's sparse inference adds this constant to the diagonal of the covariance matrix of the inducing points, and uses it
+# as a lower bound on the likelihood variance.
+_SPARSE_INFERENCE_JITTER = VarDTC.const_jitter
 
 
 class GP:
@@ -23,7 +38,8 @@ class GP:
 
     Warnings
     --------
-    The following methods of this class cache their return value for the most recently passed argument:
+    The following methods of this class cache their return values for the most recently passed arguments, which are
+    compared by content rather than identity:
         - :func:`~posterior_mean_and_variance`
         - :func:`~posterior_jacobians`
         - :func:`~posterior_hessians`
@@ -38,13 +54,31 @@ class GP:
 
     Note that the cache is not shared between instances - each instance of this class will have its own separate cache.
 
+    Parameters
+    ----------
+    gpy_gp
+        The GPy GP to wrap.
+    hessian_memory_budget
+        The maximum size, in bytes, of each block of the kernel hessian tensor held in memory while computing posterior
+        hessians. See :func:`~bayesquad.kernel_gradients.hessian_contraction`.
+
     See Also
     --------
     :class:`GPy.core.gp.GP`
     """
-    def __init__(self, gpy_gp: GPy.core.gp.GP):
+    def __init__(self, gpy_gp: GPy.core.gp.GP,
+                 hessian_memory_budget: int = kernel_gradients.DEFAULT_HESSIAN_MEMORY_BUDGET):
         self._gpy_gp = gpy_gp
         self.dimensions = gpy_gp.input_dim
+        self.hessian_memory_budget = hessian_memory_budget
+
+        # The posterior arrays (see `_posterior_arrays`) including any fantasies, followed by whatever else is needed to
+        # add further fantasies to them. This is None when there are no fantasies.
+        self._fantasy = None
+
+        # Growable copies of the data, whose views are handed to the GPy GP by `update`, followed by the arrays which
+        # the GPy GP then held. If the GPy GP's data has since been replaced, these are stale and must be rebuilt.
+        self._data_buffers = None
 
         gpy_gp.add_observer(self, self._clear_cache)
 
@@ -52,8 +86,18 @@ class GP:
         # Given a property foo which is defined on the GPy GP class, but not on this class, this method ensures that
         # accessing self.foo will return self._gpy_gp.foo. Similarly, if some other code has gp = GP(), then gp.foo will
         # return gp._gpy_gp.foo.
+        # While unpickling, this may be called before _gpy_gp has been set, in which case we must not recurse.
+        if item == '_gpy_gp':
+            raise AttributeError(item)
+
         return getattr(self._gpy_gp, item)
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+        # GPy does not pickle observers, so we need to observe the unpickled GPy GP again.
+        self._gpy_gp.add_observer(self, self._clear_cache)
+
     def __del__(self):
         self._clear_cache()
 
@@ -80,9 +124,14 @@ class GP:
         See Also
         --------
         GPy.core.gp.GP.predict : This method wraps GPy.core.gp.GP.predict, and will pass through any further positional
-            or keyword arguments.
+            or keyword arguments. While there are fantasies (see :func:`~fantasise`), GPy is not used, and any further
+            arguments are ignored.
         """
         validate_dimensions(x, self.dimensions)
+
+        if self._fantasy is not None:
+            return self.posterior_derivatives(x, order=0)
+
         mean, variance = self._gpy_gp.predict(x, *args, **kwargs)
 
         return np.squeeze(mean, axis=-1), np.squeeze(variance, axis=-1)
@@ -110,9 +159,15 @@ class GP:
         See Also
         --------
         GPy.core.gp.GP.predictive_gradients : This method wraps GPy.core.gp.GP.predictive_gradients, and will pass
-            through any additional positional or keyword arguments.
+            through any additional positional or keyword arguments. While there are fantasies (see :func:`~fantasise`),
+            GPy is not used, and any further arguments are ignored.
         """
         validate_dimensions(x, self.dimensions)
+
+        if self._fantasy is not None:
+            _, _, mean_jacobian, variance_jacobian = self.posterior_derivatives(x, order=1)
+            return mean_jacobian, variance_jacobian
+
         mean_jacobian, variance_jacobian = self._gpy_gp.predictive_gradients(x, *args, **kwargs)
 
         return np.squeeze(mean_jacobian, axis=-1), variance_jacobian
@@ -141,6 +196,43 @@ class GP:
             (num_dimensions, num_dimensions) if the input was 1D. The :math:`(i,j,k)`-th element is the :math:`(j,k)`-th
             mixed partial derivative of the posterior variance at the :math:`i`-th point of `x`.
 
+        See Also
+        --------
+        :func:`~posterior_derivatives` : This method returns the last two values returned by `posterior_derivatives`
+            with `order=2`. See that method for details of the computation.
+        """
+        _, _, _, _, mean_hessian, variance_hessian = self.posterior_derivatives(x, order=2)
+
+        return mean_hessian, variance_hessian
+
+    @flexible_array_dimensions
+    def posterior_derivatives(self, x: ndarray, order: int = 2) -> Tuple[ndarray, ...]:
+        """Get the posterior mean and variance, along with their jacobians and hessians up to a given order.
+
+        This is equivalent to calling :func:`~posterior_mean_and_variance`, :func:`~posterior_jacobians` and
+        :func:`~posterior_hessians` in turn, but the kernel matrix between `x` and the data, its derivatives and the
+        products of these with the inverse covariance matrix of the data are only computed once.
+
+        Parameters
+        ----------
+        x
+            A 2D array of shape (num_points, num_dimensions), or a 1D array of shape (num_dimensions).
+        order
+            The highest order of derivative to compute. Must be 0, 1 or 2.
+
+        Returns
+        -------
+        tuple[ndarray, ...]
+            A tuple of length `2 * (order + 1)`. The first two elements are the posterior mean and variance, as returned
+            by :func:`~posterior_mean_and_variance`. If `order` is at least 1, the next two elements are the jacobians
+            of the mean and variance, as returned by :func:`~posterior_jacobians`. If `order` is 2, the last two
+            elements are the hessians of the mean and variance, as returned by :func:`~posterior_hessians`.
+
+        Raises
+        ------
+        ValueError
+            If `order` is not 0, 1 or 2.
+
         Notes
         -----
         This code deals with up to 4-dimensional tensors and getting all the dimensions lined up correctly is slightly
@@ -175,8 +267,10 @@ class GP:
             H_{ijkl} & = & \\frac{\\partial^2 (K_*)_{ij}}{\\partial x_k \\partial x_l} \\\\
                      & = & \\frac{\\partial^2 K((X_*)_i, (X_D)_j)}{\\partial x_k \\partial x_l} \\\\
 
-        In the code, :math:`J` is `kernel_jacobian`, and :math:`H` is `kernel_hessian`. These have shape
-        (:math:`n, N, d`) and (:math:`n, N, d, d`) respectively.
+        In the code, :math:`J` is `kernel_jacobian`, which has shape (:math:`n, N, d`). :math:`H` has shape
+        (:math:`n, N, d, d`), which may be too large to hold in memory, so it is never stored in full. Every term below
+        involving :math:`H` is a sum over the data points, and these are accumulated over blocks of data points by
+        :func:`~bayesquad.kernel_gradients.hessian_contraction`.
 
         The hessian of the mean is reasonably straightforward. We have:
 
@@ -202,27 +296,75 @@ class GP:
                            & = & H_{iljk} (K_D^{-1})_{lm} (K_*)_m + J_{ilj} (K_D^{-1})_{lm} J_{imk} \\\\
 
         In the code, :math:`P` and :math:`Q` are `diagonal_hessian` and `data_dependent_hessian`, respectively.
+
+        The mean, variance and jacobians follow similarly, with :math:`K_D^{-1} Y_D` being the woodbury vector held by
+        the GPy posterior. All of these quantities are computed from the same :math:`K_*`, :math:`J` and :math:`H`, and
+        the products with :math:`K_D^{-1}` are computed using the Cholesky factor of :math:`K_D`.
+
+        For a sparse GP (see :class:`~SparseGP`), :math:`X_D` is the set of inducing points, and :math:`K_D^{-1}` is
+        replaced by the difference of two inverse matrices, each of which is applied using its own Cholesky factor.
         """
         validate_dimensions(x, self.dimensions)
-        kernel_jacobian = self._kernel_jacobian(x)
-        kernel_hessian = self._kernel_hessian(x)
 
-        X_D = self.X
-        Y_D = np.atleast_1d(np.squeeze(self.Y))
+        X_D, precision_factors, woodbury_vector, kernel = self._posterior_arrays()
 
-        K_D_inv = self.posterior.woodbury_inv
-        K_star = np.atleast_1d(self.kern.K(x, X_D))
+        # The hessian of the kernel is handled separately below, to avoid storing it in full.
+        kernel_derivatives = kernel_gradients.derivatives(kernel, x, X_D, order=min(order, 1))
+        K_star = kernel_derivatives[0]
 
-        mean_hessian = np.einsum('ijkl,jm,m->ikl', kernel_hessian, K_D_inv, Y_D, optimize=True)
+        # The (i, j)-th element of this is (K_* K_D^{-1})_ij.
+        K_star_K_D_inv = sum(sign * dpotrs(cholesky, K_star.T, lower=1)[0].T for cholesky, sign in precision_factors)
 
-        diagonal_hessian = self._diagonal_hessian(x)
-        data_dependent_hessian_half = np.einsum('iljk,lm,im->ijk', kernel_hessian, K_D_inv, K_star, optimize=True) \
-                                + np.einsum('ilj,lm,imk->ijk', kernel_jacobian, K_D_inv, kernel_jacobian, optimize=True)
-        data_dependent_hessian = data_dependent_hessian_half + np.swapaxes(data_dependent_hessian_half, -1, -2)
+        mean = K_star @ woodbury_vector
+        variance = kernel.Kdiag(x) - np.einsum('ij,ij->i', K_star_K_D_inv, K_star, optimize=True)
 
-        variance_hessian = diagonal_hessian - data_dependent_hessian
+        # Include the likelihood variance, for consistency with `posterior_mean_and_variance`.
+        mean, variance = self._predictive_values(mean[:, np.newaxis], variance[:, np.newaxis])
+        derivatives = [np.squeeze(mean, axis=-1), np.squeeze(variance, axis=-1)]
 
-        return mean_hessian, variance_hessian
+        if order >= 1:
+            kernel_jacobian = kernel_derivatives[1]
+
+            mean_jacobian = np.einsum('ijk,j->ik', kernel_jacobian, woodbury_vector, optimize=True)
+
+            diagonal_jacobian = kernel_gradients.diagonal_jacobian(kernel, x)
+            variance_jacobian = \
+                diagonal_jacobian - 2 * np.einsum('ijk,ij->ik', kernel_jacobian, K_star_K_D_inv, optimize=True)
+
+            derivatives += [mean_jacobian, variance_jacobian]
+
+        if order >= 2:
+            num_points, num_data, num_dimensions = kernel_jacobian.shape
+
+            # Both terms involving H are sums of H over the data points, so we compute them together without ever
+            # storing H in full.
+            hessian_weights = np.stack((np.broadcast_to(woodbury_vector, (num_points, num_data)), K_star_K_D_inv),
+                                       axis=-1)
+            kernel_hessian_contractions = kernel_gradients.hessian_contraction(
+                kernel, x, X_D, hessian_weights, memory_budget=self.hessian_memory_budget)
+
+            mean_hessian = kernel_hessian_contractions[:, 0]
+
+            data_dependent_hessian_half = kernel_hessian_contractions[:, 1]
+
+            for cholesky, sign in precision_factors:
+                # The (i, j, k)-th element of this is (L^{-1} J_{i..k})_j, where L is the Cholesky factor of K_D. The
+                # inner product of this with itself over j is the second term of Q hat.
+                whitened_kernel_jacobian = scipy.linalg.solve_triangular(
+                    cholesky, np.moveaxis(kernel_jacobian, 1, 0).reshape(num_data, -1), lower=True
+                ).reshape(num_data, num_points, num_dimensions)
+
+                data_dependent_hessian_half = data_dependent_hessian_half + sign * np.einsum(
+                    'lij,lik->ijk', whitened_kernel_jacobian, whitened_kernel_jacobian, optimize=True)
+
+            diagonal_hessian = kernel_gradients.diagonal_hessian(kernel, x)
+            data_dependent_hessian = data_dependent_hessian_half + np.swapaxes(data_dependent_hessian_half, -1, -2)
+
+            variance_hessian = diagonal_hessian - data_dependent_hessian
+
+            derivatives += [mean_hessian, variance_hessian]
+
+        return tuple(derivatives)
 
     def update(self, x: ndarray, y: Union[ndarray, float]):
         """Add new data to the GP.
@@ -238,22 +380,241 @@ class GP:
         ------
         ValueError
             If the number of points in `x` does not equal the number of points in `y`.
+
+        Notes
+        -----
+        Where possible, the existing posterior is extended with the new data rather than being recomputed from scratch.
+        The Cholesky factor of the covariance matrix is extended by a block update (see
+        :func:`~bayesquad.maths_helpers.extend_cholesky`), which costs :math:`O(N^2 k)` for :math:`N` existing and
+        :math:`k` new points, rather than the :math:`O((N + k)^3)` cost of a full refactorisation. The GPy model's data,
+        posterior and log likelihood are then replaced directly, without triggering GPy's inference.
+
+        This is only valid if the existing posterior is consistent with the current hyperparameters. GPy recomputes the
+        posterior in full whenever the hyperparameters change, so this holds unless `update_model` has been disabled on
+        the underlying GPy `GP`. In that case, or if the GPy model is not an exact GP with a Gaussian likelihood and no
+        mean function or normaliser, we fall back to calling `set_XY`, which will refactorise in full.
+
+        The gradients of the log likelihood held by the GPy model are not updated by the incremental path. GPy will
+        recompute these as soon as the hyperparameters are next modified (e.g. at the start of `optimize`).
+
+        In either case, the data is appended to growable arrays (see :class:`~bayesquad._util.GrowableArray`), views of
+        which are handed to the GPy model, so the cost of adding the new data to the existing data is proportional to
+        the amount of new data, rather than to the total amount of data.
+        """
+        x, y = _validate_and_transform_for_gpy_update(x, y)
+
+        X, Y = self._append_data(x, y)
+
+        if self._can_extend_posterior():
+            self._extend_posterior(X, Y)
+        else:
+            self.set_XY(X, Y)
+
+        X_buffer, Y_buffer, _, _ = self._data_buffers
+        self._data_buffers = X_buffer, Y_buffer, self._gpy_gp.X, self._gpy_gp.Y
+
+    def _append_data(self, x: ndarray, y: ndarray) -> Tuple[ndarray, ndarray]:
+        """Append new data to the growable copies of the GPy GP's data, and return views of all of the data.
+
+        The copies are first rebuilt from the GPy GP's data if it has been replaced since they were last handed to it.
+        """
+        gpy_gp = self._gpy_gp
+
+        if self._data_buffers is None or self._data_buffers[2] is not gpy_gp.X or self._data_buffers[3] is not gpy_gp.Y:
+            self._data_buffers = GrowableArray(gpy_gp.X), GrowableArray(gpy_gp.Y), None, None
+
+        X_buffer, Y_buffer, _, _ = self._data_buffers
+        X_buffer.append(x)
+        Y_buffer.append(y)
+
+        return X_buffer.values, Y_buffer.values
+
+    def _can_extend_posterior(self) -> bool:
+        """Check whether the posterior of the GPy GP can be extended in place with new data."""
+        gpy_gp = self._gpy_gp
+
+        return (gpy_gp.update_model()
+                and isinstance(gpy_gp.posterior, PosteriorExact)
+                and isinstance(gpy_gp.inference_method, ExactGaussianInference)
+                and isinstance(gpy_gp.likelihood, GaussianLikelihood)
+                and gpy_gp.mean_function is None
+                and gpy_gp.normalizer is None
+                and isinstance(gpy_gp.X, ObsAr))
+
+    def _extend_posterior(self, X: ndarray, Y: ndarray):
+        """Replace the data of the GPy GP with `X` and `Y`, which extend its existing data with new data, by extending
+        the Cholesky factor of its existing posterior.
+
+        See :func:`~update` for details."""
+        gpy_gp = self._gpy_gp
+        posterior = gpy_gp.posterior
+
+        x = X[len(gpy_gp.X):]
+
+        K_cross = self.kern.K(gpy_gp.X, x)
+        K_new = self.kern.K(x)
+
+        K = np.block([[posterior._K, K_cross],
+                      [K_cross.T, K_new]])
+
+        noise_variance = float(gpy_gp.likelihood.gaussian_variance(gpy_gp.Y_metadata)) + _EXACT_INFERENCE_JITTER
+        woodbury_chol = extend_cholesky(cholesky=posterior.woodbury_chol, cross_covariance=K_cross,
+                                        new_covariance=K_new + noise_variance * np.eye(len(x)))
+
+        self._set_posterior(X, Y, K, woodbury_chol)
+
+    def set_Y(self, Y: ndarray):
+        """Replace the values of the existing data, keeping its locations.
+
+        Parameters
+        ----------
+        Y
+            A 2D array of shape (num_points, 1), or a 1D array of shape (num_points), where num_points is the number of
+            points already held by the GP.
+
+        Notes
+        -----
+        The covariance matrix of the data does not depend on its values, so under the same conditions as
+        :func:`~update`, the existing Cholesky factor is kept, and only the woodbury vector and log likelihood are
+        recomputed, at a cost of :math:`O(N^2)`. Otherwise, this falls back to GPy's `set_Y`, which will refactorise in
+        full.
+
+        See Also
+        --------
+        GPy.core.gp.GP.set_Y
+        """
+        Y = np.reshape(Y, (-1, 1))
+
+        if len(Y) != len(self.X):
+            raise ValueError("Expected {} values, but got {}.".format(len(self.X), len(Y)))
+
+        if self._can_extend_posterior():
+            self._replace_values(Y)
+        else:
+            self._gpy_gp.set_Y(Y)
+
+    def _replace_values(self, Y: ndarray):
+        """Replace the values of the data held by the GPy GP, reusing the Cholesky factor of its existing posterior.
+
+        See :func:`~set_Y` for details."""
+        posterior = self._gpy_gp.posterior
+
+        self._set_posterior(self._gpy_gp.X, Y, posterior._K, posterior.woodbury_chol)
+
+    def _set_posterior(self, X: ndarray, Y: ndarray, K: ndarray, woodbury_chol: ndarray):
+        """Replace the data, posterior and log likelihood of the GPy GP directly, given the Cholesky factor of the
+        covariance matrix of the new data, without triggering GPy's inference."""
+        gpy_gp = self._gpy_gp
+
+        woodbury_vector, _ = dpotrs(woodbury_chol, Y, lower=1)
+
+        log_determinant = 2 * np.sum(np.log(np.diag(woodbury_chol)))
+        log_marginal_likelihood = 0.5 * (-Y.size * np.log(2 * np.pi)
+                                         - Y.shape[1] * log_determinant
+                                         - np.sum(woodbury_vector * Y))
+
+        gpy_gp.X = ObsAr(X)
+        gpy_gp.Y = ObsAr(Y)
+        gpy_gp.Y_normalized = gpy_gp.Y
+        gpy_gp.posterior = PosteriorExact(woodbury_chol=woodbury_chol, woodbury_vector=woodbury_vector, K=K)
+        gpy_gp._log_marginal_likelihood = log_marginal_likelihood
+
+        # GPy's observers are not notified since no parameters have changed, so we need to clear the cache manually.
+        self._clear_cache()
+
+    def fantasise(self, x: ndarray, y: Union[ndarray, float]):
+        """Temporarily add data to the GP, e.g. to select a batch of points by assuming values at earlier points of the
+        batch. This may be called repeatedly, and every fantasy is discarded by :func:`~remove_fantasies`.
+
+        Parameters
+        ----------
+        x
+            A 2D array of shape (num_points, num_dimensions), or a 1D array of shape (num_dimensions).
+        y
+            A 1D array of shape (num_points). If X is 1D, this may also be a 0D array or float.
+
+        Raises
+        ------
+        ValueError
+            If the number of points in `x` does not equal the number of points in `y`.
+        NotImplementedError
+            If the GPy model is not an exact GP with a Gaussian likelihood and no mean function or normaliser.
+
+        Notes
+        -----
+        The GPy model, and the Cholesky factor of its posterior, are never modified. The fantasy data is held here,
+        along with a Cholesky factor of the covariance matrix of the real and fantasy data, formed by extending the
+        factor of the real data (or of the previous fantasies) with rows for the new points. Adding :math:`k` fantasy
+        points to :math:`N` points costs :math:`O(N^2 k)` (see :func:`~bayesquad.maths_helpers.extend_cholesky`), and
+        removing them just drops the extended factor. While there are fantasies, the posterior is computed from these
+        arrays rather than by GPy.
+
+        Fantasies are also discarded whenever the GPy model changes, e.g. when real data is added or the
+        hyperparameters are optimised.
         """
         x, y = _validate_and_transform_for_gpy_update(x, y)
 
-        X = np.concatenate((self.X, x))
-        Y = np.concatenate((self.Y, y))
+        self._fantasy = self._extend_fantasy(x, y)
+
+        clear_last_value_caches(self)
+
+    def remove_fantasies(self):
+        """Discard all data added by :func:`~fantasise`."""
+        self._fantasy = None
+
+        clear_last_value_caches(self)
+
+    def _extend_fantasy(self, x: ndarray, y: ndarray) -> tuple:
+        """Return the posterior arrays (see :func:`~_posterior_arrays`) for the current data and fantasies, extended
+        with new fantasy data, followed by the targets of all of the data.
+
+        See :func:`~fantasise` for details."""
+        gpy_gp = self._gpy_gp
+
+        if not (isinstance(gpy_gp.inference_method, ExactGaussianInference)
+                and isinstance(gpy_gp.likelihood, GaussianLikelihood)
+                and gpy_gp.mean_function is None
+                and gpy_gp.normalizer is None):
+            raise NotImplementedError("Fantasies are only supported for exact GPs with a Gaussian likelihood and no "
+                                      "mean function or normaliser.")
+
+        X_D, ((woodbury_chol, _),), _, kernel = self._posterior_arrays()
+        Y_D = np.array(gpy_gp.Y) if self._fantasy is None else self._fantasy[4]
+
+        noise_variance = float(gpy_gp.likelihood.variance.values[0]) + _EXACT_INFERENCE_JITTER
+        woodbury_chol = extend_cholesky(cholesky=woodbury_chol, cross_covariance=kernel.K(X_D, x),
+                                        new_covariance=kernel.K(x) + noise_variance * np.eye(len(x)))
 
-        self.set_XY(X, Y)
+        X = np.concatenate((X_D, x))
+        Y = np.concatenate((Y_D, y))
+        woodbury_vector = dpotrs(woodbury_chol, Y, lower=1)[0][:, 0]
 
-    def _kernel_jacobian(self, x):
-        return kernel_gradients.jacobian(self.kern, x, self.X)
+        return X, ((woodbury_chol, 1.),), woodbury_vector, kernel, Y
 
-    def _kernel_hessian(self, x):
-        return kernel_gradients.hessian(self.kern, x, self.X)
+    def _posterior_arrays(self) -> Tuple[ndarray, Tuple[Tuple[ndarray, float], ...], ndarray,
+                                         Union[GPy.kern.Kern, KernelSnapshot]]:
+        """Return the arrays from which :func:`~posterior_derivatives` computes the posterior, including any fantasies.
 
-    def _diagonal_hessian(self, x):
-        return kernel_gradients.diagonal_hessian(self.kern, x)
+        These are the points through which the posterior is expressed (the data locations :math:`X_D`), the precision
+        factors, the (1D) woodbury vector of the posterior, and the kernel. The precision factors are pairs of a lower
+        Cholesky factor :math:`L` and a sign :math:`s`, such that :math:`K_D^{-1} = \\sum s (L L^T)^{-1}`. For an exact
+        GP, there is just one, the Cholesky factor held by the GPy posterior."""
+        if self._fantasy is not None:
+            return self._fantasy[:4]
+
+        return self._data_posterior_arrays()
+
+    def _data_posterior_arrays(self) -> Tuple[ndarray, Tuple[Tuple[ndarray, float], ...], ndarray,
+                                              Union[GPy.kern.Kern, KernelSnapshot]]:
+        """Return the arrays described in :func:`~_posterior_arrays` for the real data alone."""
+        woodbury_vector = np.atleast_1d(np.squeeze(self.posterior.woodbury_vector, axis=-1))
+
+        return self.X, ((self.posterior.woodbury_chol, 1.),), woodbury_vector, self.kern
+
+    def _predictive_values(self, mean: ndarray, variance: ndarray) -> Tuple[ndarray, ndarray]:
+        """Add the likelihood to the posterior mean and variance of the latent function, each of shape (num_points, 1).
+        """
+        return self.likelihood.predictive_values(mean, variance)
 
     # noinspection PyUnusedLocal
     # This is called with a keyword argument "which" by GPy when the underlying GP is updated. We allow this to be
@@ -261,11 +622,288 @@ class GP:
     def _clear_cache(self, *args, **kwargs):
         clear_last_value_caches(self)
 
+        self._fantasy = None
+
     @property
     def kernel(self) -> GPy.kern.Kern:
         return self._gpy_gp.kern
 
 
+class NumpyGP(GP):
+    """A GP whose posterior is computed from plain NumPy arrays, rather than through GPy.
+
+    For small numbers of data points, the overhead of GPy's parameter framework (parameter indexing, observer callbacks
+    and array copies) can exceed the cost of the linear algebra needed to evaluate the posterior. This class holds a
+    snapshot of the data locations, the Cholesky factor and woodbury vector of the posterior, the kernel hyperparameters
+    (see :class:`~bayesquad.kernel_gradients.KernelSnapshot`) and the likelihood variance as plain arrays, and computes
+    the posterior mean and variance and their derivatives from these alone.
+
+    The wrapped GPy GP still holds the data, and is still used to optimise the hyperparameters. The snapshot is taken
+    again (see :func:`~sync`) the first time the posterior is needed after the GPy GP has changed, so hyperparameter
+    optimisation and :func:`~update` work exactly as they do for :class:`~GP`.
+
+    Parameters
+    ----------
+    gpy_gp
+        The GPy GP to wrap. This must be an exact GP with a Gaussian likelihood and no mean function or normaliser, and
+        its kernel must be supported by :class:`~bayesquad.kernel_gradients.KernelSnapshot`.
+    hessian_memory_budget
+        See :class:`~GP`.
+
+    Raises
+    ------
+    NotImplementedError
+        If the GPy GP is not of a supported form.
+    """
+    def __init__(self, gpy_gp: GPy.core.gp.GP,
+                 hessian_memory_budget: int = kernel_gradients.DEFAULT_HESSIAN_MEMORY_BUDGET):
+        if not (isinstance(gpy_gp.inference_method, ExactGaussianInference)
+                and isinstance(gpy_gp.likelihood, GaussianLikelihood)
+                and gpy_gp.mean_function is None
+                and gpy_gp.normalizer is None):
+            raise NotImplementedError("Only exact GPs with a Gaussian likelihood and no mean function or normaliser "
+                                      "are supported.")
+
+        KernelSnapshot.from_kernel(gpy_gp.kern)
+
+        self._snapshot = None
+
+        super().__init__(gpy_gp, hessian_memory_budget)
+
+    def sync(self):
+        """Take a snapshot of the posterior of the wrapped GPy GP. This happens automatically when needed, but may be
+        called directly, e.g. if `update_model` has been disabled on the GPy GP."""
+        gpy_gp = self._gpy_gp
+        posterior = gpy_gp.posterior
+
+        self._snapshot = (np.array(gpy_gp.X),
+                          ((np.array(posterior.woodbury_chol, order='F'), 1.),),
+                          np.atleast_1d(np.squeeze(np.array(posterior.woodbury_vector), axis=-1)),
+                          KernelSnapshot.from_kernel(gpy_gp.kern),
+                          float(gpy_gp.likelihood.variance.values[0]))
+
+    @last_value_cache
+    @flexible_array_dimensions
+    def posterior_mean_and_variance(self, x: ndarray) -> Tuple[ndarray, ndarray]:
+        """Get the posterior mean and variance at a point, or a set of points.
+
+        See :func:`GP.posterior_mean_and_variance`. Unlike that method, no further arguments are passed to GPy."""
+        return self.posterior_derivatives(x, order=0)
+
+    @last_value_cache
+    @flexible_array_dimensions
+    def posterior_jacobians(self, x: ndarray) -> Tuple[ndarray, ndarray]:
+        """Get the jacobian of the posterior mean and the jacobian of the posterior variance.
+
+        See :func:`GP.posterior_jacobians`. Unlike that method, no further arguments are passed to GPy."""
+        _, _, mean_jacobian, variance_jacobian = self.posterior_derivatives(x, order=1)
+
+        return mean_jacobian, variance_jacobian
+
+    def _data_posterior_arrays(self) -> Tuple[ndarray, Tuple[Tuple[ndarray, float], ...], ndarray, KernelSnapshot]:
+        if self._snapshot is None:
+            self.sync()
+
+        return self._snapshot[:4]
+
+    def _predictive_values(self, mean: ndarray, variance: ndarray) -> Tuple[ndarray, ndarray]:
+        if self._snapshot is None:
+            self.sync()
+
+        return mean, variance + self._snapshot[4]
+
+    def _clear_cache(self, *args, **kwargs):
+        super()._clear_cache()
+
+        self._snapshot = None
+
+
+class SparseGP(GP):
+    """A GP whose posterior is approximated through a set of inducing points, for use with large amounts of data.
+
+    This wraps a GPy `SparseGP` using variational inference (the "VFE" approximation of Titsias), which holds the
+    data, the inducing points and the hyperparameters, and is used to optimise them. The posterior mean is a weighted
+    sum of kernels centred on the :math:`M` inducing points rather than on the :math:`N` data points, so every model
+    built on top of this (e.g. :class:`~bayesquad.quadrature.WarpedIntegrandModel`) works with the inducing points in
+    place of the data.
+
+    The posterior depends on the data only through the sums :math:`K_{ZX} K_{XZ}`, :math:`K_{ZX} Y`, :math:`Y^T Y` and
+    :math:`\\sum_i K(x_i, x_i)`, where :math:`Z` are the inducing points. These are computed once for the current
+    hyperparameters in :math:`O(N M^2)`, and then :func:`~update` adds new data to them, so adding :math:`k` points
+    costs :math:`O(k M^2 + M^3)` however much data there is already. They are recomputed when the hyperparameters or
+    the inducing points change.
+
+    Parameters
+    ----------
+    gpy_gp
+        The GPy sparse GP to wrap. This must use `VarDTC` inference with a Gaussian likelihood, certain inputs, and no
+        mean function or normaliser.
+    hessian_memory_budget
+        See :class:`~GP`.
+
+    Raises
+    ------
+    NotImplementedError
+        If the GPy GP is not of a supported form.
+
+    References
+    ----------
+    .. [1] Titsias, Michalis. "Variational learning of inducing variables in sparse Gaussian processes." Artificial
+       Intelligence and Statistics. 2009.
+    """
+    def __init__(self, gpy_gp: GPy.core.SparseGP,
+                 hessian_memory_budget: int = kernel_gradients.DEFAULT_HESSIAN_MEMORY_BUDGET):
+        if not (isinstance(gpy_gp, GPy.core.SparseGP)
+                and isinstance(gpy_gp.inference_method, VarDTC)
+                and isinstance(gpy_gp.likelihood, GaussianLikelihood)
+                and not gpy_gp.has_uncertain_inputs()
+                and gpy_gp.mean_function is None
+                and gpy_gp.normalizer is None):
+            raise NotImplementedError("Only sparse GPs using VarDTC inference with a Gaussian likelihood, certain "
+                                      "inputs and no mean function or normaliser are supported.")
+
+        self._data_statistics = None
+        self._precision_factors = None
+
+        super().__init__(gpy_gp, hessian_memory_budget)
+
+    def _can_extend_posterior(self) -> bool:
+        """Check whether the posterior of the GPy GP can be extended in place with new data."""
+        return self._gpy_gp.update_model() and isinstance(self._gpy_gp.X, ObsAr)
+
+    def _extend_posterior(self, X: ndarray, Y: ndarray):
+        """Replace the data of the GPy GP with `X` and `Y`, which extend its existing data with new data, by adding the
+        new data to the sums on which the posterior depends.
+
+        See :class:`~SparseGP` and :func:`~GP.update` for details."""
+        num_existing_data = len(self._gpy_gp.X)
+
+        statistics = self._add_to_statistics(self._statistics(), X[num_existing_data:], Y[num_existing_data:])
+
+        self._set_sparse_posterior(X, Y, statistics)
+
+    def _replace_values(self, Y: ndarray):
+        """Replace the values of the data held by the GPy GP, recomputing only the sums over the data which depend on
+        them, at a cost of :math:`O(N M)`.
+
+        See :func:`~GP.set_Y` for details."""
+        K_zz_x_x_z, _, _, K_diag_sum, num_data = self._statistics()
+
+        X = self._gpy_gp.X
+        K_zx_y = self.kern.K(self._gpy_gp.Z.values, X) @ Y
+
+        self._set_sparse_posterior(X, Y, (K_zz_x_x_z, K_zx_y, float(np.sum(Y ** 2)), K_diag_sum, num_data))
+
+    def _set_sparse_posterior(self, X: ndarray, Y: ndarray, statistics: Tuple[ndarray, ndarray, float, float, int]):
+        """Replace the data, posterior and log likelihood of the GPy GP directly, given the sums over the new data (see
+        :func:`~_statistics`), without triggering GPy's inference."""
+        gpy_gp = self._gpy_gp
+
+        gpy_gp.X = ObsAr(X)
+        gpy_gp.Y = ObsAr(Y)
+        gpy_gp.Y_normalized = gpy_gp.Y
+        gpy_gp.posterior, gpy_gp._log_marginal_likelihood, precision_factors = self._sparse_posterior(statistics)
+
+        # GPy's observers are not notified since no parameters have changed, so we need to clear the cache manually.
+        super()._clear_cache()
+
+        self._data_statistics = statistics
+        self._precision_factors = precision_factors
+
+    def _extend_fantasy(self, x: ndarray, y: ndarray) -> tuple:
+        """Return the posterior arrays (see :func:`~GP._posterior_arrays`) for the current data and fantasies, extended
+        with new fantasy data, followed by the sums over all of the data (see :func:`~_statistics`).
+
+        Rather than extending a Cholesky factor as :func:`~GP.fantasise` describes, the fantasy data is added to the
+        sums on which the posterior depends, which costs :math:`O(k M^2 + M^3)`."""
+        statistics = self._statistics() if self._fantasy is None else self._fantasy[4]
+        statistics = self._add_to_statistics(statistics, x, y)
+
+        posterior, _, precision_factors = self._sparse_posterior(statistics)
+        woodbury_vector = posterior.woodbury_vector[:, 0]
+
+        return self._gpy_gp.Z.values, precision_factors, woodbury_vector, self.kern, statistics
+
+    def _statistics(self) -> Tuple[ndarray, ndarray, float, float, int]:
+        """Return the sums :math:`K_{ZX} K_{XZ}`, :math:`K_{ZX} Y`, :math:`Y^T Y` and :math:`\\sum_i K(x_i, x_i)` over
+        the current data, followed by the number of data points, computing them if they are not already known for the
+        current hyperparameters."""
+        if self._data_statistics is None:
+            X, Y = self._gpy_gp.X.values, self._gpy_gp.Y.values
+            K_zx = self.kern.K(self._gpy_gp.Z.values, X)
+
+            self._data_statistics = (K_zx @ K_zx.T, K_zx @ Y, float(np.sum(Y ** 2)), float(np.sum(self.kern.Kdiag(X))),
+                                     len(X))
+
+        return self._data_statistics
+
+    def _add_to_statistics(self, statistics: Tuple[ndarray, ndarray, float, float, int], x: ndarray, y: ndarray) \
+            -> Tuple[ndarray, ndarray, float, float, int]:
+        """Return the sums returned by :func:`~_statistics`, with new data added to them."""
+        K_zz_x_x_z, K_zx_y, y_y, K_diag_sum, num_data = statistics
+
+        K_zx = self.kern.K(self._gpy_gp.Z.values, x)
+
+        return (K_zz_x_x_z + K_zx @ K_zx.T, K_zx_y + K_zx @ y, y_y + float(np.sum(y ** 2)),
+                K_diag_sum + float(np.sum(self.kern.Kdiag(x))), num_data + len(x))
+
+    def _sparse_posterior(self, statistics: Tuple[ndarray, ndarray, float, float, int]) \
+            -> Tuple[Posterior, float, Tuple[Tuple[ndarray, float], ...]]:
+        """Compute the GPy posterior, the log marginal likelihood bound and the precision factors (see
+        :func:`~GP._posterior_arrays`) from the sums over the data returned by :func:`~_statistics`.
+
+        This follows GPy's `VarDTC` inference, and costs :math:`O(M^3)`. Writing :math:`L_Z` for the Cholesky factor of
+        :math:`K_{ZZ}`, :math:`\\beta` for the inverse of the likelihood variance, and :math:`L_B` for the Cholesky
+        factor of :math:`B = I + \\beta L_Z^{-1} K_{ZX} K_{XZ} L_Z^{-T}`, the posterior variance subtracts
+        :math:`k_{*Z} (K_{ZZ}^{-1} - (L_Z L_B L_B^T L_Z^T)^{-1}) k_{Z*}`, so the precision factors are :math:`L_Z` and
+        :math:`L_Z L_B`, with opposite signs."""
+        K_zz_x_x_z, K_zx_y, y_y, K_diag_sum, num_data = statistics
+        num_inducing = len(K_zx_y)
+
+        precision = 1 / max(float(self.likelihood.variance.values[0]), _SPARSE_INFERENCE_JITTER)
+
+        K_zz = self.kern.K(self._gpy_gp.Z.values) + _SPARSE_INFERENCE_JITTER * np.eye(num_inducing)
+        L_z = jitchol(K_zz)
+
+        A = precision * backsub_both_sides(L_z, K_zz_x_x_z, transpose='right')
+        L_b = jitchol(np.eye(num_inducing) + A)
+
+        c = scipy.linalg.solve_triangular(
+            L_b, scipy.linalg.solve_triangular(L_z, precision * K_zx_y, lower=True), lower=True)
+        woodbury_vector = scipy.linalg.solve_triangular(
+            L_z, scipy.linalg.solve_triangular(L_b, c, lower=True, trans='T'), lower=True, trans='T')
+
+        B_inv, _ = dpotrs(L_b, np.eye(num_inducing), lower=1)
+        woodbury_inv = backsub_both_sides(L_z, np.eye(num_inducing) - B_inv)
+
+        log_marginal_likelihood = (-0.5 * num_data * (np.log(2 * np.pi) - np.log(precision))
+                                   - 0.5 * precision * y_y
+                                   - 0.5 * (precision * K_diag_sum - np.trace(A))
+                                   - np.sum(np.log(np.diag(L_b)))
+                                   + 0.5 * np.sum(c ** 2))
+
+        posterior = Posterior(woodbury_inv=woodbury_inv, woodbury_vector=woodbury_vector, K=K_zz, K_chol=L_z)
+
+        # GPy's triangular solvers expect Fortran-ordered factors.
+        precision_factors = ((np.asfortranarray(L_z), 1.), (np.asfortranarray(L_z @ L_b), -1.))
+
+        return posterior, log_marginal_likelihood, precision_factors
+
+    def _data_posterior_arrays(self) -> Tuple[ndarray, Tuple[Tuple[ndarray, float], ...], ndarray, GPy.kern.Kern]:
+        if self._precision_factors is None:
+            _, _, self._precision_factors = self._sparse_posterior(self._statistics())
+
+        woodbury_vector = np.atleast_1d(np.squeeze(self.posterior.woodbury_vector, axis=-1))
+
+        return self._gpy_gp.Z.values, self._precision_factors, woodbury_vector, self.kern
+
+    def _clear_cache(self, *args, **kwargs):
+        super()._clear_cache()
+
+        self._data_statistics = None
+        self._precision_factors = None
+
+
 class WarpedGP(ABC):
     """Represents a Gaussian Process where the output space has been warped.
 
@@ -278,10 +916,13 @@ class WarpedGP(ABC):
         Parameters
         ----------
         gp
-            Either a `GPy.core.gp.GP`, which will be wrapped in a `GP`, or a `GP`.
+            Either a `GPy.core.gp.GP`, which will be wrapped in a `GP` (or a `SparseGP`, if it is a GPy sparse GP), or a
+            `GP`.
         """
         if isinstance(gp, GP):
             self._gp = gp
+        elif isinstance(gp, GPy.core.SparseGP):
+            self._gp = SparseGP(gp)
         elif isinstance(gp, GPy.core.gp.GP):
             self._gp = GP(gp)
         else:
@@ -349,6 +990,27 @@ class WarpedGP(ABC):
             :math:`(j, k)`-th mixed partial derivative of the posterior variance at the :math:`i`-th point of `x`.
         """
 
+    @abstractmethod
+    def posterior_variance_derivatives(self, x: ndarray, order: int = 2) -> Tuple[ndarray, ...]:
+        """Get the posterior variance, along with its jacobian and hessian up to a given order.
+
+        Parameters
+        ----------
+        x
+            The point(s) at which to evaluate the posterior variance and its derivatives. A 2D array of shape
+            (num_points, num_dimensions), or a 1D array of shape (num_dimensions).
+        order
+            The highest order of derivative to compute. Must be 0, 1 or 2.
+
+        Returns
+        -------
+        tuple[ndarray, ...]
+            A tuple of length `order + 1`. The first element is the posterior variance, as returned by
+            :func:`~posterior_mean_and_variance`. If `order` is at least 1, the second element is the jacobian, as
+            returned by :func:`~posterior_variance_jacobian`. If `order` is 2, the third element is the hessian, as
+            returned by :func:`~posterior_variance_hessian`.
+        """
+
     @abstractmethod
     def update(self, x: ndarray, y: ndarray):
         """Add new data to the GP.
@@ -368,11 +1030,19 @@ class WarpedGP(ABC):
 
     @abstractmethod
     def fantasise(self, x, y):
-        """QQ"""
+        """Temporarily add data to the GP, until :func:`~remove_fantasies` is called.
+
+        Parameters
+        ----------
+        x
+            A 2D array of shape (num_points, num_dimensions), or a 1D array of shape (num_dimensions).
+        y
+            A 1D array of shape (num_points). If X is 1D, this may also be a 0D array or float.
+        """
 
     @abstractmethod
     def remove_fantasies(self):
-        """QQ"""
+        """Discard all data added by :func:`~fantasise`."""
 
 
 class WsabiLGP(WarpedGP):
@@ -394,16 +1064,11 @@ class WsabiLGP(WarpedGP):
         super().__init__(gp)
 
         self._alpha = 0.8 * min(*(gp.Y**2 / 2))
-        self._true_alpha = self._alpha
 
         # We need to keep track of the original values of y, since whenever alpha changes, we'll need to apply the new
-        # transform to the old data. We also keep track of the corresponding values of x separately here, since this
-        # simplifies some operations.
-        self._unwarped_Y = [gp.Y**2 / 2]
-        self._all_X = [gp.X]
-
-        self._fantasy_X = []
-        self._fantasy_Y = []
+        # transform to the old data. The locations of the data never need to be warped, so the underlying GP's copy of
+        # them is all we need.
+        self._unwarped_Y = GrowableArray(gp.Y**2 / 2)
 
     @flexible_array_dimensions
     def posterior_mean_and_variance(self, x: ndarray) -> Tuple[ndarray, ndarray]:
@@ -437,13 +1102,9 @@ class WsabiLGP(WarpedGP):
 
         we have :math:`V_i = m_i^2 C_i`.
         """
-        gp_mean, gp_variance = self._gp.posterior_mean_and_variance(x)
-
-        gp_mean_jacobian, gp_variance_jacobian = self._gp.posterior_jacobians(x)
+        _, variance_jacobian = self.posterior_variance_derivatives(x, order=1)
 
-        return jacobian_of_f_squared_times_g(
-            f=gp_mean, f_jacobian=gp_mean_jacobian,
-            g=gp_variance, g_jacobian=gp_variance_jacobian)
+        return variance_jacobian
 
     @flexible_array_dimensions
     def posterior_variance_hessian(self, x: ndarray) -> ndarray:
@@ -463,14 +1124,43 @@ class WsabiLGP(WarpedGP):
 
         we have :math:`V_i = m_i^2 C_i`.
         """
-        gp_mean, gp_variance = self._gp.posterior_mean_and_variance(x)
+        _, _, variance_hessian = self.posterior_variance_derivatives(x, order=2)
+
+        return variance_hessian
 
-        gp_mean_jacobian, gp_variance_jacobian = self._gp.posterior_jacobians(x)
-        gp_mean_hessian, gp_variance_hessian = self._gp.posterior_hessians(x)
+    @flexible_array_dimensions
+    def posterior_variance_derivatives(self, x: ndarray, order: int = 2) -> Tuple[ndarray, ...]:
+        """Get the posterior variance, along with its jacobian and hessian up to a given order.
+
+        Overrides :func:`~WarpedGP.posterior_variance_derivatives` - please see that method's documentation for further
+        details on arguments and return values.
+
+        Notes
+        -----
+        All required quantities for the underlying GP are obtained from a single call to
+        :func:`~GP.posterior_derivatives`. With the same notation as :func:`~posterior_variance_jacobian`, we have
+        :math:`V_i = m_i^2 C_i`.
+        """
+        gp_derivatives = self._gp.posterior_derivatives(x, order=order)
+        gp_mean, gp_variance = gp_derivatives[:2]
+
+        derivatives = [gp_variance * gp_mean ** 2]
+
+        if order >= 1:
+            gp_mean_jacobian, gp_variance_jacobian = gp_derivatives[2:4]
 
-        return hessian_of_f_squared_times_g(
-            f=gp_mean, f_jacobian=gp_mean_jacobian, f_hessian=gp_mean_hessian,
-            g=gp_variance, g_jacobian=gp_variance_jacobian, g_hessian=gp_variance_hessian)
+            derivatives.append(jacobian_of_f_squared_times_g(
+                f=gp_mean, f_jacobian=gp_mean_jacobian,
+                g=gp_variance, g_jacobian=gp_variance_jacobian))
+
+        if order >= 2:
+            gp_mean_hessian, gp_variance_hessian = gp_derivatives[4:6]
+
+            derivatives.append(hessian_of_f_squared_times_g(
+                f=gp_mean, f_jacobian=gp_mean_jacobian, f_hessian=gp_mean_hessian,
+                g=gp_variance, g_jacobian=gp_variance_jacobian, g_hessian=gp_variance_hessian))
+
+        return tuple(derivatives)
 
     def update(self, x: ndarray, y: ndarray):
         """Add new data to the GP. If necessary, this will also update the parameter alpha to a value consistent with
@@ -478,74 +1168,45 @@ class WsabiLGP(WarpedGP):
 
         Overrides :func:`~WarpedGP.update` - please see that method's documentation for further details on arguments and
         return values.
+
+        Notes
+        -----
+        If alpha is unchanged, the new data is warped and added to the underlying GP, which extends its posterior rather
+        than recomputing it (see :func:`~GP.update`). Otherwise, the existing data must be warped again, but its
+        locations are unchanged, so the underlying GP keeps the Cholesky factor of its covariance matrix (see
+        :func:`~GP.set_Y`), and the new data is then added as before.
         """
-        # Since we may need to directly modify the existing X and Y data on the underlying GP, we can't rely on the
-        # update method of `GP` to deal with all updates here, so we need to apply the same validation and
-        # transformation for dealing with the GPy data directly.
         x, y = _validate_and_transform_for_gpy_update(x, y)
 
-        self._all_X.append(x)
+        num_existing_data = len(self._unwarped_Y)
         self._unwarped_Y.append(y)
 
-        new_min = min(self._alpha, *(0.8 * y))
-
-        if new_min is not self._alpha:
-            self._update_alpha_and_reprocess_data(new_min)
-        else:
-            warped_y = self._warp(y)
-            self._gp.update(x, warped_y)
-
-    def fantasise(self, x, y):
-        x, y = _validate_and_transform_for_gpy_update(x, y)
+        new_alpha = min(self._alpha, 0.8 * np.min(y))
 
-        self._fantasy_X.append(x)
-        self._fantasy_Y.append(y)
+        if new_alpha < self._alpha:
+            self._alpha = new_alpha
+            self._gp.set_Y(self._warp(self._unwarped_Y.values[:num_existing_data]))
 
-        new_min = min(self._alpha, *(0.8 * y))
-
-        if new_min is not self._alpha:
-            self._fantasise_alpha_and_reprocess_data(new_min)
-        else:
-            warped_y = self._warp(y)
-            self._gp.update(x, warped_y)
+        self._gp.update(x, self._warp(y))
 
-    def _fantasise_alpha_and_reprocess_data(self, alpha: float):
-        self._alpha = alpha
-
-        warped_Y = [self._warp(y) for y in self._unwarped_Y] + [self._warp(y) for y in self._fantasy_Y]
-        all_warped_Y = np.concatenate(warped_Y)
+    def fantasise(self, x, y):
+        """Temporarily add data to the GP. See :func:`~GP.fantasise`.
 
-        all_X = np.concatenate(self._all_X + self._fantasy_X)
+        Unlike :func:`~update`, this never changes alpha, so the existing data never needs to be warped again, and the
+        fantasy is added to the underlying GP without modifying its posterior. Fantasy values below alpha (which the
+        square-root warping cannot represent) are treated as equal to alpha.
+        """
+        x, y = _validate_and_transform_for_gpy_update(x, y)
 
-        self._gp.set_XY(all_X, all_warped_Y)
+        self._gp.fantasise(x, self._warp(np.maximum(y, self._alpha)))
 
     def remove_fantasies(self):
-        self._alpha = self._true_alpha
-
-        warped_Y = [self._warp(y) for y in self._unwarped_Y]
-        all_warped_Y = np.concatenate(warped_Y)
-
-        all_X = np.concatenate(self._all_X)
-
-        self._gp.set_XY(all_X, all_warped_Y)
-
-        self._fantasy_X = []
-        self._fantasy_Y = []
+        """Discard all data added by :func:`~fantasise`."""
+        self._gp.remove_fantasies()
 
     def _warp(self, y: ndarray) -> ndarray:
         return np.sqrt(2 * (y - self._alpha))
 
-    def _update_alpha_and_reprocess_data(self, alpha: float):
-        self._alpha = alpha
-        self._true_alpha = alpha
-
-        warped_Y = [self._warp(y) for y in self._unwarped_Y]
-        all_warped_Y = np.concatenate(warped_Y)
-
-        all_X = np.concatenate(self._all_X)
-
-        self._gp.set_XY(all_X, all_warped_Y)
-
 
 def _validate_and_transform_for_gpy_update(x: ndarray, y: ndarray) -> Tuple[ndarray, ndarray]:
     """Ensure that x and y have the right dimensionality and size to be passed to `GPy.core.gp.GP.set_XY`."""
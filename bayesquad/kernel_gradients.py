@@ -1,12 +1,73 @@
 """Functions for computing the gradients of Gaussian Process kernels."""
 
+from typing import NamedTuple, Tuple, Union
+
 import numpy as np
 
 from GPy.kern.src.kern import Kern
 from GPy.kern.src.rbf import RBF
-from GPy.kern.src.stationary import Stationary
+from GPy.kern.src.stationary import Stationary, Matern32, Matern52
 from numpy import ndarray, newaxis
 
+# The default maximum size, in bytes, of each block of the kernel hessian computed by `hessian_contraction`.
+DEFAULT_HESSIAN_MEMORY_BUDGET = 64 * 2 ** 20
+
+_SUPPORTED_KERNELS = (RBF, Matern32, Matern52)
+
+
+class KernelSnapshot(NamedTuple):
+    """The type and hyperparameters of a supported GPy kernel, held as plain values.
+
+    Reading hyperparameters from a GPy kernel, or evaluating it, goes through GPy's parameter framework, which can cost
+    more than the computation itself for small numbers of points. A snapshot evaluates the same kernel directly with
+    NumPy. Every function in this module accepts either a GPy kernel or a snapshot, and converts the former to the
+    latter once per call.
+
+    The supported kernels are :class:`GPy.kern.src.rbf.RBF`, :class:`GPy.kern.src.stationary.Matern32` and
+    :class:`GPy.kern.src.stationary.Matern52`.
+    """
+    kernel_type: type
+    variance: float
+    lengthscale: ndarray
+
+    @classmethod
+    def from_kernel(cls, kernel: Union[Kern, "KernelSnapshot"]) -> "KernelSnapshot":
+        """Take a snapshot of the current hyperparameters of a kernel. If given a snapshot, return it unchanged.
+
+        Raises
+        ------
+        NotImplementedError
+            If the provided kernel type is not supported.
+        """
+        if isinstance(kernel, KernelSnapshot):
+            return kernel
+
+        for kernel_type in _SUPPORTED_KERNELS:
+            if isinstance(kernel, kernel_type):
+                return cls(kernel_type, float(kernel.variance.values[0]), np.array(kernel.lengthscale.values))
+
+        raise NotImplementedError
+
+    def K(self, X: ndarray, X2: ndarray = None) -> ndarray:
+        """Evaluate the kernel at all pairs from two sets of points, as :func:`GPy.kern.Kern.K` does."""
+        if X2 is None:
+            X2 = X
+
+        scaled_differences = (X[:, newaxis, :] - X2[newaxis, :, :]) / self.lengthscale
+        scaled_distances = np.sqrt(np.einsum('ijk,ijk->ij', scaled_differences, scaled_differences, optimize=True))
+
+        if self.kernel_type is RBF:
+            return self.variance * np.exp(-scaled_distances ** 2 / 2)
+        elif self.kernel_type is Matern32:
+            return self.variance * (1 + np.sqrt(3) * scaled_distances) * np.exp(-np.sqrt(3) * scaled_distances)
+        else:
+            return self.variance * (1 + np.sqrt(5) * scaled_distances + 5 / 3 * scaled_distances ** 2) \
+                * np.exp(-np.sqrt(5) * scaled_distances)
+
+    def Kdiag(self, X: ndarray) -> ndarray:
+        """Evaluate the kernel at each point paired with itself, as :func:`GPy.kern.Kern.Kdiag` does."""
+        return np.full(len(X), self.variance)
+
 
 def jacobian(kernel: Kern, variable_points: ndarray, fixed_points: ndarray) -> ndarray:
     """Return the jacobian of a kernel evaluated at all pairs from two sets of points.
@@ -22,6 +83,9 @@ def jacobian(kernel: Kern, variable_points: ndarray, fixed_points: ndarray) -> n
     kernel
         The kernel to be differentiated. Currently supported kernels are:
             - :class:`GPy.kern.src.rbf.RBF`
+            - :class:`GPy.kern.src.stationary.Matern32`
+            - :class:`GPy.kern.src.stationary.Matern52`
+        Each of these may have either a single lengthscale or one lengthscale per dimension (ARD).
     variable_points
         A 2D array of points, with shape (num_variable_points, num_dimensions).
     fixed_points
@@ -39,16 +103,9 @@ def jacobian(kernel: Kern, variable_points: ndarray, fixed_points: ndarray) -> n
     NotImplementedError
         If the provided kernel type is not supported. See the parameters list for a list of supported kernels.
     """
-    if isinstance(kernel, RBF):
-        lengthscale = kernel.lengthscale.values[0]
-        k = kernel.K(variable_points, fixed_points)
+    _, kernel_jacobian = derivatives(kernel, variable_points, fixed_points, order=1)
 
-        # The (i, j, k)-th element of this is the k-th component of X_i - D_j.
-        differences = variable_points[:, newaxis, :] - fixed_points[newaxis, :, :]
-
-        return -k[:, :, newaxis] * differences / (lengthscale ** 2)
-    else:
-        raise NotImplementedError
+    return kernel_jacobian
 
 
 def hessian(kernel: Kern, variable_points: ndarray, fixed_points: ndarray):
@@ -65,6 +122,9 @@ def hessian(kernel: Kern, variable_points: ndarray, fixed_points: ndarray):
     kernel
         The kernel to be differentiated. Currently supported kernels are:
             - :class:`GPy.kern.src.rbf.RBF`
+            - :class:`GPy.kern.src.stationary.Matern32`
+            - :class:`GPy.kern.src.stationary.Matern52`
+        Each of these may have either a single lengthscale or one lengthscale per dimension (ARD).
     fixed_points
         A 2D array of points, with shape (num_variable_points, num_dimensions).
     variable_points
@@ -82,25 +142,223 @@ def hessian(kernel: Kern, variable_points: ndarray, fixed_points: ndarray):
     NotImplementedError
         If the provided kernel type is not supported. See the parameters list for a list of supported kernels.
     """
-    if isinstance(kernel, RBF):
-        lengthscale = kernel.lengthscale.values[0]
-        k = kernel.K(variable_points, fixed_points)
+    _, _, kernel_hessian = derivatives(kernel, variable_points, fixed_points, order=2)
+
+    return kernel_hessian
+
+
+def hessian_contraction(kernel: Kern, variable_points: ndarray, fixed_points: ndarray, weights: ndarray,
+                        memory_budget: int = DEFAULT_HESSIAN_MEMORY_BUDGET) -> ndarray:
+    """Return weighted sums of the hessian of a kernel over a set of fixed points, without storing the full hessian.
+
+    Given a kernel, two sets :math:`X, D` of points and weights :math:`w`, this function will evaluate
+    :math:`\\sum_j w_{ijm} H_{ijkl}`, where :math:`H` is the hessian returned by :func:`~hessian`. The sum is
+    accumulated over blocks of :math:`D`, so that the 4D hessian tensor is never held in memory in full.
+
+    Parameters
+    ----------
+    kernel
+        The kernel to be differentiated. Currently supported kernels are those supported by :func:`~hessian`.
+    variable_points
+        A 2D array of points, with shape (num_variable_points, num_dimensions).
+    fixed_points
+        A 2D array of points, with shape (num_fixed_points, num_dimensions).
+    weights
+        A 3D array of shape (num_variable_points, num_fixed_points, num_weights). Each slice along the last axis is a
+        separate set of weights.
+    memory_budget
+        The maximum size, in bytes, of each block of the hessian tensor. At least one fixed point is always included in
+        each block, regardless of this value.
+
+    Returns
+    -------
+    ndarray
+        A 4D array of shape (num_variable_points, num_weights, num_dimensions, num_dimensions), whose (i, m, k, l)-th
+        element is the sum over :math:`j` of the (i, j, m)-th weight multiplied by the (k, l)-th mixed partial
+        derivative of the kernel evaluated at the i-th point of :math:`X` and the j-th point of :math:`D`.
+
+    Raises
+    ------
+    NotImplementedError
+        If the provided kernel type is not supported. See the parameters list for a list of supported kernels.
+    """
+    kernel = KernelSnapshot.from_kernel(kernel)
+
+    num_variable_points, num_dimensions = variable_points.shape
+    num_fixed_points = len(fixed_points)
+    num_weights = weights.shape[-1]
+
+    bytes_per_fixed_point = num_variable_points * num_dimensions ** 2 * np.dtype(float).itemsize
+    block_size = max(1, memory_budget // bytes_per_fixed_point)
+
+    contraction = np.zeros((num_variable_points, num_weights, num_dimensions, num_dimensions))
+
+    for block_start in range(0, num_fixed_points, block_size):
+        block = slice(block_start, block_start + block_size)
+
+        _, _, kernel_hessian = derivatives(kernel, variable_points, fixed_points[block], order=2)
+        contraction += np.einsum('ijkl,ijm->imkl', kernel_hessian, weights[:, block, :], optimize=True)
+
+    return contraction
+
+
+def derivatives(kernel: Kern, variable_points: ndarray, fixed_points: ndarray, order: int = 2) -> Tuple[ndarray, ...]:
+    """Return the values of a kernel at all pairs from two sets of points, along with its derivatives up to a given
+    order.
+
+    This computes the same quantities as :func:`~jacobian` and :func:`~hessian`, but shares the work common to each
+    (the kernel matrix itself and the differences between points) rather than repeating it.
+
+    Parameters
+    ----------
+    kernel
+        The kernel to be differentiated. Currently supported kernels are:
+            - :class:`GPy.kern.src.rbf.RBF`
+            - :class:`GPy.kern.src.stationary.Matern32`
+            - :class:`GPy.kern.src.stationary.Matern52`
+        Each of these may have either a single lengthscale or one lengthscale per dimension (ARD).
+    variable_points
+        A 2D array of points, with shape (num_variable_points, num_dimensions).
+    fixed_points
+        A 2D array of points, with shape (num_fixed_points, num_dimensions).
+    order
+        The highest order of derivative to compute. Must be 0, 1 or 2.
+
+    Returns
+    -------
+    tuple[ndarray, ...]
+        A tuple of length `order + 1`. The first element is the kernel matrix, of shape
+        (num_variable_points, num_fixed_points). If `order` is at least 1, the second element is the jacobian, as
+        returned by :func:`~jacobian`. If `order` is 2, the third element is the hessian, as returned by
+        :func:`~hessian`.
+
+    Raises
+    ------
+    ValueError
+        If `order` is not 0, 1 or 2.
+    NotImplementedError
+        If the provided kernel type is not supported. See the parameters list for a list of supported kernels.
+    """
+    if order not in (0, 1, 2):
+        raise ValueError("Derivatives of order {} are not supported. Order must be 0, 1 or 2.".format(order))
+
+    kernel = KernelSnapshot.from_kernel(kernel)
+
+    k = kernel.K(variable_points, fixed_points)
+
+    if order == 0:
+        return k,
+
+    # This has either a single element, or one element per dimension if the kernel is ARD. In either case, it
+    # broadcasts against the last axis of the arrays below, which plays the role of the diagonal matrix of squared
+    # lengthscales.
+    lengthscale_squared = kernel.lengthscale ** 2
+
+    # The (i, j, k)-th element of this is the k-th component of X_i - D_j (i.e. (X_i - D_j)_k).
+    differences = variable_points[:, newaxis, :] - fixed_points[newaxis, :, :]
+
+    # The (i, j, k)-th element of this is (X_i - D_j)_k / l_k^2, where l_k is the lengthscale in dimension k.
+    scaled_differences = differences / lengthscale_squared
+
+    jacobian_factor, hessian_factor = _radial_derivative_factors(kernel, k, differences, scaled_differences)
+
+    kernel_jacobian = jacobian_factor[:, :, newaxis] * scaled_differences
+
+    if order == 1:
+        return k, kernel_jacobian
+
+    _, num_dimensions = variable_points.shape
+
+    # The (i, j, k, l)-th element of this is (X_i - D_j)_k * (X_i - D_j)_l / (l_k^2 l_l^2). This can be viewed as a
+    # matrix of matrices, whose (i, j)-th matrix is the outer product of the scaled (X_i - D_j) with itself.
+    outer_products_of_differences = np.einsum('ijk,ijl->ijkl', scaled_differences, scaled_differences, optimize=True)
+
+    inverse_lengthscale_squared = np.diag(np.broadcast_to(1 / lengthscale_squared, num_dimensions))
+
+    kernel_hessian = np.einsum('ij,ijkl->ijkl', hessian_factor, outer_products_of_differences, optimize=True) \
+        + np.einsum('ij,kl->ijkl', jacobian_factor, inverse_lengthscale_squared, optimize=True)
+
+    return k, kernel_jacobian, kernel_hessian
+
+
+def _radial_derivative_factors(kernel: KernelSnapshot, k: ndarray, differences: ndarray,
+                               scaled_differences: ndarray) -> Tuple[ndarray, ndarray]:
+    """Return the scalar factors from which the jacobian and hessian of a supported stationary kernel are built.
 
-        _, num_dimensions = variable_points.shape
+    Notes
+    -----
+    Each supported kernel is a function :math:`k(r)` of the scaled distance :math:`r = \\sqrt{\\sum_k (x - d)_k^2 /
+    l_k^2}`. Writing :math:`s = \\Lambda^{-1} (x - d)` for the scaled differences, where :math:`\\Lambda` is the
+    diagonal matrix of squared lengthscales, the jacobian and hessian with respect to :math:`x` take the forms
 
-        # The (i, j, k)-th element of this is the k-th component of X_i - D_j (i.e. (X_i - D_j)_k).
-        differences = variable_points[:, newaxis, :] - fixed_points[newaxis, :, :]
+    .. math::
 
-        # The (i, j, k, l)-th element of this is (X_i - D_j)_k * (X_i - D_j)_l. This can be viewed as a matrix of
-        # matrices, whose (i, j)-th matrix is the outer product of (X_i - D_j) with itself.
-        outer_products_of_differences = np.einsum('ijk,ijl->ijkl', differences, differences, optimize=True)
+        J & = & a(r) s \\\\
+        H & = & b(r) s s^T + a(r) \\Lambda^{-1}
 
-        transformed_outer_products = (outer_products_of_differences / lengthscale ** 2) - np.eye(num_dimensions)
+    where :math:`a(r) = k'(r) / r` and :math:`b(r) = a'(r) / r`. With :math:`\\sigma^2` the kernel variance, these are
 
-        # Now multiply the (i, j)-th transformed outer product by K(X_i, D_j).
-        product = np.einsum('ij,ijkl->ijkl', k, transformed_outer_products, optimize=True)
+        - RBF: :math:`a = -k`, :math:`b = k`
+        - Matern 3/2: :math:`a = -3 \\sigma^2 e^{-\\sqrt{3} r}`,
+          :math:`b = 3 \\sqrt{3} \\sigma^2 e^{-\\sqrt{3} r} / r`
+        - Matern 5/2: :math:`a = -\\frac{5}{3} \\sigma^2 (1 + \\sqrt{5} r) e^{-\\sqrt{5} r}`,
+          :math:`b = \\frac{25}{3} \\sigma^2 e^{-\\sqrt{5} r}`
 
-        return product / (lengthscale ** 2)
+    The Matern 3/2 kernel is not twice differentiable at :math:`r = 0`. Since :math:`s s^T / r` tends to zero there, we
+    take :math:`b = 0` at :math:`r = 0`.
+
+    Returns
+    -------
+    jacobian_factor
+        A 2D array of shape (num_variable_points, num_fixed_points), containing :math:`a(r)` for each pair of points.
+    hessian_factor
+        A 2D array of shape (num_variable_points, num_fixed_points), containing :math:`b(r)` for each pair of points.
+    """
+    if kernel.kernel_type is RBF:
+        return -k, k
+
+    variance = kernel.variance
+    scaled_distances = np.sqrt(np.einsum('ijk,ijk->ij', differences, scaled_differences, optimize=True))
+
+    if kernel.kernel_type is Matern32:
+        exponential = variance * np.exp(-np.sqrt(3) * scaled_distances)
+
+        jacobian_factor = -3 * exponential
+        hessian_factor = np.divide(3 * np.sqrt(3) * exponential, scaled_distances,
+                                   out=np.zeros_like(scaled_distances), where=scaled_distances > 0)
+    elif kernel.kernel_type is Matern52:
+        exponential = variance * np.exp(-np.sqrt(5) * scaled_distances)
+
+        jacobian_factor = -5 / 3 * (1 + np.sqrt(5) * scaled_distances) * exponential
+        hessian_factor = 25 / 3 * exponential
+    else:
+        raise NotImplementedError
+
+    return jacobian_factor, hessian_factor
+
+
+def diagonal_jacobian(kernel: Kern, x: ndarray):
+    """Return the jacobian of a kernel considered as a function of one variable by constraining both inputs to be equal.
+
+    Given a kernel :math:`K` and a set of points :math:`X`, this function will evaluate the jacobian of :math:`K(x, x)`
+    at each point :math:`x` of :math:`X`.
+
+    Parameters
+    ----------
+    kernel
+        The kernel to be differentiated. Currently supported kernels are:
+            - All subclasses of :class:`GPy.kern.src.rbf.Stationary`
+            - :class:`~KernelSnapshot`
+    x
+        A 2D array of points, with shape (num_points, num_dimensions).
+
+    Returns
+    -------
+    ndarray
+        A 2D array of shape (num_points, num_dimensions).
+    """
+    if isinstance(kernel, (Stationary, KernelSnapshot)):
+        return np.zeros_like(x, dtype=float)
     else:
         raise NotImplementedError
 
@@ -116,6 +374,7 @@ def diagonal_hessian(kernel: Kern, x: ndarray):
     kernel
         The kernel to be differentiated. Currently supported kernels are:
             - All subclasses of :class:`GPy.kern.src.rbf.Stationary`
+            - :class:`~KernelSnapshot`
     x
         A 2D array of points, with shape (num_points, num_dimensions).
 
@@ -124,7 +383,7 @@ def diagonal_hessian(kernel: Kern, x: ndarray):
     ndarray
         A 3D array of shape (num_points, num_dimensions, num_dimensions).
     """
-    if isinstance(kernel, Stationary):
+    if isinstance(kernel, (Stationary, KernelSnapshot)):
         num_points, num_dimensions = x.shape
 
         return np.zeros((num_points, num_dimensions, num_dimensions))
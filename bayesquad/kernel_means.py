@@ -0,0 +1,210 @@
+"""Functions for integrating Gaussian Process kernels against a prior."""
+
+from typing import Tuple, Union
+
+import numpy as np
+import scipy.special
+import scipy.stats
+from GPy.kern.src.kern import Kern
+from GPy.kern.src.rbf import RBF
+from GPy.kern.src.stationary import Matern32, Matern52
+from numpy import ndarray, newaxis
+
+from .priors import Gaussian
+from ratio_extension.prior_1d import Gaussian1D
+
+# The default number of points used to integrate a kernel numerically, where no closed form is available.
+DEFAULT_NUM_QUADRATURE_POINTS = 2 ** 12
+
+# For each Matern kernel, the coefficients c_n such that k(r) = variance * sum_n c_n (a r)^n exp(-a r), and a itself.
+_MATERN_POLYNOMIAL_COEFFICIENTS = {Matern32: (1., 1., 0.), Matern52: (1., 1., 1 / 3)}
+_MATERN_RATES = {Matern32: np.sqrt(3), Matern52: np.sqrt(5)}
+
+
+def kernel_mean(kernel: Kern, prior: Union[Gaussian, Gaussian1D], points: ndarray,
+                variance: float = None, lengthscale: Union[float, ndarray] = None,
+                num_quadrature_points: int = DEFAULT_NUM_QUADRATURE_POINTS) -> ndarray:
+    """Return the integral of a kernel against a prior, with the second argument of the kernel fixed at each of a set of
+    points.
+
+    Given a kernel :math:`K`, a prior :math:`\\pi` and a set of points :math:`X`, this function will evaluate
+    :math:`\\int K(x, X_i) \\pi(x) dx` for each point :math:`X_i`.
+
+    Parameters
+    ----------
+    kernel
+        The kernel to be integrated. Currently supported kernels are:
+            - :class:`GPy.kern.src.rbf.RBF`
+            - :class:`GPy.kern.src.stationary.Matern32`
+            - :class:`GPy.kern.src.stationary.Matern52`
+        Each of these may have either a single lengthscale or one lengthscale per dimension (ARD).
+    prior
+        The prior to integrate against.
+    points
+        A 2D array of shape (num_points, num_dimensions).
+    variance
+        The variance of the kernel. If not given, the current variance of `kernel` is used.
+    lengthscale
+        The lengthscale(s) of the kernel. If not given, the current lengthscale(s) of `kernel` are used.
+    num_quadrature_points
+        The number of points used to integrate the kernel numerically. This is only used for Matern kernels in more
+        than one dimension - all other integrals are computed in closed form.
+
+    Returns
+    -------
+    ndarray
+        A 1D array of shape (num_points).
+
+    Raises
+    ------
+    NotImplementedError
+        If the provided kernel type is not supported. See the parameters list for a list of supported kernels.
+
+    Notes
+    -----
+    For the RBF kernel with variance :math:`h` and diagonal matrix of squared lengthscales :math:`\\Lambda`, and a
+    Gaussian prior with mean :math:`\\mu` and covariance :math:`\\Sigma`, the integral is
+    :math:`h |2 \\pi \\Lambda|^{1/2} \\mathcal{N}(X_i; \\mu, \\Sigma + \\Lambda)`.
+
+    A Matern kernel in one dimension has the form :math:`h p(|t|) e^{-\\lambda |t|}`, where :math:`t = x - X_i` and
+    :math:`p` is a polynomial. We split the integral at :math:`X_i`, and on either side the product of the exponential
+    with the Gaussian prior is another (unnormalised) Gaussian, so each half is a combination of moments of a truncated
+    Gaussian.
+
+    Matern kernels in more than one dimension do not factorise across dimensions, so we instead use quasi-Monte Carlo
+    integration, with a scrambled Sobol sequence mapped through the prior. The sequence is seeded identically on every
+    call, so that repeated calls with the same arguments give the same result.
+    """
+    mean, covariance = _gaussian_parameters(prior)
+
+    return _gaussian_kernel_mean(kernel, mean, covariance, points, variance, lengthscale, num_quadrature_points)
+
+
+def kernel_double_integral(kernel: Kern, prior: Union[Gaussian, Gaussian1D],
+                           variance: float = None, lengthscale: Union[float, ndarray] = None,
+                           num_quadrature_points: int = DEFAULT_NUM_QUADRATURE_POINTS) -> float:
+    """Return the integral of a kernel against a prior in both of its arguments.
+
+    Given a kernel :math:`K` and a prior :math:`\\pi`, this function will evaluate
+    :math:`\\int \\int K(x, x') \\pi(x) \\pi(x') dx dx'`.
+
+    Parameters
+    ----------
+    kernel, prior, variance, lengthscale, num_quadrature_points
+        See :func:`~kernel_mean`.
+
+    Returns
+    -------
+    float
+        The value of the integral.
+
+    Raises
+    ------
+    NotImplementedError
+        If the provided kernel type is not supported. See :func:`~kernel_mean` for a list of supported kernels.
+
+    Notes
+    -----
+    All supported kernels are stationary, so the integrand depends only on :math:`x - x'`. If :math:`x` and :math:`x'`
+    are independently distributed as :math:`\\mathcal{N}(\\mu, \\Sigma)`, then :math:`x - x'` is distributed as
+    :math:`\\mathcal{N}(0, 2 \\Sigma)`, so the double integral is the kernel mean at the origin under this
+    distribution.
+    """
+    mean, covariance = _gaussian_parameters(prior)
+    origin = np.zeros((1, len(mean)))
+
+    return _gaussian_kernel_mean(kernel, np.zeros_like(mean), 2 * covariance, origin, variance, lengthscale,
+                                 num_quadrature_points)[0]
+
+
+def _gaussian_kernel_mean(kernel: Kern, mean: ndarray, covariance: ndarray, points: ndarray, variance: float,
+                          lengthscale: Union[float, ndarray], num_quadrature_points: int) -> ndarray:
+    """Integrate a kernel against a Gaussian with the given mean and covariance. See :func:`~kernel_mean`."""
+    num_points, num_dimensions = points.shape
+
+    variance = kernel.variance.values[0] if variance is None else variance
+    lengthscale = kernel.lengthscale.values if lengthscale is None else lengthscale
+    lengthscale = np.broadcast_to(lengthscale, (num_dimensions,))
+
+    if isinstance(kernel, RBF):
+        kernel_normalisation = (2 * np.pi) ** (num_dimensions / 2) * np.prod(lengthscale)
+
+        return variance * kernel_normalisation * np.atleast_1d(
+            scipy.stats.multivariate_normal.pdf(points, mean=mean, cov=covariance + np.diag(lengthscale ** 2)))
+    elif isinstance(kernel, (Matern32, Matern52)) and num_dimensions == 1:
+        return variance * _matern_kernel_mean_1d(type(kernel), mean[0], np.sqrt(covariance[0, 0]), lengthscale[0],
+                                                 points[:, 0])
+    elif isinstance(kernel, (Matern32, Matern52)):
+        samples = _quasi_random_gaussian_samples(mean, covariance, num_quadrature_points)
+
+        # The (i, j)-th element of this is the scaled distance between the i-th sample and the j-th point.
+        scaled_differences = (samples[:, newaxis, :] - points[newaxis, :, :]) / lengthscale
+        scaled_distances = np.linalg.norm(scaled_differences, axis=-1)
+
+        return variance * np.mean(_matern_correlation(type(kernel), scaled_distances), axis=0)
+    else:
+        raise NotImplementedError
+
+
+def _gaussian_parameters(prior: Union[Gaussian, Gaussian1D]) -> Tuple[ndarray, ndarray]:
+    """Return the mean and covariance of a Gaussian prior as 1D and 2D arrays respectively."""
+    if isinstance(prior, Gaussian1D):
+        return np.reshape(prior.matrix_mean, 1), np.reshape(prior.matrix_variance, (1, 1))
+    elif isinstance(prior, Gaussian):
+        num_dimensions = np.size(prior.mean)
+        return np.reshape(prior.mean, num_dimensions), np.reshape(prior.covariance, (num_dimensions, num_dimensions))
+    else:
+        raise NotImplementedError
+
+
+def _matern_correlation(kernel_type: type, scaled_distances: ndarray) -> ndarray:
+    """Evaluate a Matern kernel with unit variance at the given scaled distances."""
+    rate = _MATERN_RATES[kernel_type]
+    coefficients = _MATERN_POLYNOMIAL_COEFFICIENTS[kernel_type]
+
+    return np.polynomial.polynomial.polyval(rate * scaled_distances, coefficients) * np.exp(-rate * scaled_distances)
+
+
+def _matern_kernel_mean_1d(kernel_type: type, prior_mean: float, prior_standard_deviation: float, lengthscale: float,
+                           points: ndarray) -> ndarray:
+    """Integrate a Matern kernel with unit variance against a 1D Gaussian prior, in closed form.
+
+    See :func:`~kernel_mean` for details."""
+    rate = _MATERN_RATES[kernel_type] / lengthscale
+    coefficients = np.array(_MATERN_POLYNOMIAL_COEFFICIENTS[kernel_type]) * rate ** np.arange(3)
+
+    s = prior_standard_deviation
+
+    result = np.zeros_like(points, dtype=float)
+
+    # The mean of the distance from each point, restricted to either side of the point, under the prior.
+    for m in (prior_mean - points, points - prior_mean):
+        # Multiplying the prior by exp(-rate * t) shifts its mean to m - rate * s^2, and scales it by a factor of
+        # exp(-rate * m + rate^2 s^2 / 2). The product of this factor with the density of the shifted Gaussian at zero
+        # is the density of the original Gaussian at zero, which we use to avoid overflow.
+        shifted_m = m - rate * s ** 2
+        z = shifted_m / s
+
+        cdf_term = np.exp(-rate * m + (rate * s) ** 2 / 2 + scipy.special.log_ndtr(z))
+        pdf_term = scipy.stats.norm.pdf(m / s)
+
+        # The moments E[t^n 1{t > 0}] for n = 0, 1, 2, where t has the shifted Gaussian distribution.
+        zeroth_moment = cdf_term
+        first_moment = shifted_m * cdf_term + s * pdf_term
+        second_moment = (shifted_m ** 2 + s ** 2) * cdf_term + shifted_m * s * pdf_term
+
+        result += coefficients[0] * zeroth_moment + coefficients[1] * first_moment + coefficients[2] * second_moment
+
+    return result
+
+
+def _quasi_random_gaussian_samples(mean: ndarray, covariance: ndarray, num_samples: int) -> ndarray:
+    """Return a fixed set of quasi-random points which are distributed as a Gaussian with the given parameters."""
+    num_dimensions = len(mean)
+
+    sobol = scipy.stats.qmc.Sobol(num_dimensions, scramble=True, seed=0)
+    uniform_samples = sobol.random_base2(int(np.ceil(np.log2(num_samples))))
+
+    standard_normal_samples = scipy.special.ndtri(uniform_samples)
+
+    return mean + standard_normal_samples @ np.linalg.cholesky(covariance).T
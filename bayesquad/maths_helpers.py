@@ -1,5 +1,8 @@
 """A home for complicated mathematical operations which are used multiple times in this package."""
 
+import numpy as np
+import scipy.linalg
+from GPy.util.linalg import jitchol
 from numpy import ndarray, newaxis
 
 
@@ -116,3 +119,52 @@ def hessian_of_f_squared_times_g(*,
         + g_hessian * f ** 2
 
     return hessian
+
+
+def extend_cholesky(*,
+        cholesky: ndarray, cross_covariance: ndarray, new_covariance: ndarray) -> ndarray:
+    """Given the Cholesky factor of a matrix, return the Cholesky factor of the matrix extended by new rows and columns.
+
+    Parameters
+    ----------
+    cholesky
+        A 2D array of shape (num_points, num_points). The lower triangular Cholesky factor :math:`L` of a matrix
+        :math:`A`.
+    cross_covariance
+        A 2D array :math:`B` of shape (num_points, num_new_points), holding the new columns of the extended matrix.
+    new_covariance
+        A 2D array :math:`C` of shape (num_new_points, num_new_points), holding the new diagonal block of the extended
+        matrix.
+
+    Returns
+    -------
+    ndarray
+        A 2D array of shape (num_points + num_new_points, num_points + num_new_points). This is the lower triangular
+        Cholesky factor of the extended matrix.
+
+    Notes
+    -----
+    The extended matrix and its Cholesky factor are as follows:
+
+    .. math::
+
+        \\begin{pmatrix} A & B \\\\ B^T & C \\end{pmatrix} =
+        \\begin{pmatrix} L & 0 \\\\ S^T & M \\end{pmatrix}
+        \\begin{pmatrix} L^T & S \\\\ 0 & M^T \\end{pmatrix}
+
+    where :math:`S = L^{-1} B` and :math:`M` is the Cholesky factor of :math:`C - S^T S`. Computing :math:`S` requires
+    a single triangular solve, so the cost is :math:`O(N^2 k)` for :math:`N` existing and :math:`k` new points, rather
+    than the :math:`O((N + k)^3)` cost of factorising the extended matrix from scratch.
+    """
+    num_points, num_new_points = cross_covariance.shape
+
+    new_columns = scipy.linalg.solve_triangular(cholesky, cross_covariance, lower=True)
+    schur_complement_cholesky = jitchol(new_covariance - new_columns.T @ new_columns)
+
+    # The LAPACK wrappers in GPy expect Fortran-ordered arrays, and will copy (and complain about) anything else.
+    extended_cholesky = np.zeros((num_points + num_new_points, num_points + num_new_points), order='F')
+    extended_cholesky[:num_points, :num_points] = cholesky
+    extended_cholesky[num_points:, :num_points] = new_columns.T
+    extended_cholesky[num_points:, num_points:] = schur_complement_cholesky
+
+    return extended_cholesky
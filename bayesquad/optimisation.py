@@ -1,37 +1,39 @@
-"""Utility functions wrapping a scipy optimizer."""
+"""Utility functions for multi-start optimisation of vectorised functions."""
 
-from functools import wraps
-from typing import Tuple, Callable, List
+import os
+from concurrent.futures import Executor
+from functools import update_wrapper
+from typing import Tuple, Callable, List, Union
 
 import numpy as np
 import scipy.optimize
-from numpy import ndarray
+from numpy import ndarray, newaxis
 
 DEFAULT_GTOL = 1e-2
 
+# The number of previous steps used to approximate the inverse hessian in each L-BFGS optimisation.
+DEFAULT_HISTORY_SIZE = 10
+
+# Parameters of the backtracking line search used by the L-BFGS optimisations.
+_ARMIJO_CONSTANT = 1e-4
+_MAX_BACKTRACKING_STEPS = 30
+
 DEFAULT_MINIMIZER_KWARGS = {'method': 'BFGS',
                             'jac': True,
                             'options': {'gtol': DEFAULT_GTOL}}
 
 
-def multi_start_maximise(objective_function: Callable,
-                         initial_points: List[ndarray], **kwargs) -> Tuple[ndarray, float]:
+def multi_start_maximise(objective_function: Callable, initial_points: Union[List[ndarray], ndarray],
+                         gtol: float = DEFAULT_GTOL, maxiter: int = None, history_size: int = DEFAULT_HISTORY_SIZE,
+                         executor: Executor = None, num_shards: int = None) -> Tuple[ndarray, float]:
     """Run multi-start maximisation of the given objective function.
 
-    Warnings
-    --------
-    This is a hack to take advantage of fast vectorised computation and avoid expensive python loops. There may be some
-    issues with this method!
-
-    The objective function provided here must be a vectorised function. We take advantage of the fast computation of
-    vectorised functions to view a multi-start optimisation as a single pass of a higher-dimensional optimisation,
-    rather than several passes of a low-dimensional optimisation (which would require an expensive python loop). We
-    simply concatenate all the points where the function is to be evaluated into a single high-dimensional vector, give
-    the function value as the sum of all the individual function values, and give the jacobian as the concatenation of
-    all the individual jacobians. In this way we can essentially perform many optimisations in parallel. Note that
-    (among other issues) there is an issue here with the stopping condition: we can only consider all optimisations
-    together, so even if most have come very close to an optimum, the process will continue as long as one is far away.
-    However, this does seem to perform well in practice.
+    The objective function provided here must be a vectorised function. Rather than looping over the initial points in
+    python, we run an independent L-BFGS optimisation from each initial point, with the state of every optimisation
+    held in stacked arrays, so that each iteration makes a single vectorised call to the objective function for all
+    starts together. Each start is dropped from the set of active starts as soon as it converges (or its line search
+    fails), so the objective function is never evaluated at points which have already converged, and the cost of each
+    iteration shrinks as starts finish.
 
     Parameters
     ----------
@@ -39,9 +41,20 @@ def multi_start_maximise(objective_function: Callable,
         Function to be maximised. Must return both the function value and the jacobian. Must also accept a 2D array of
         points, returning a 1D array and a 2D array for the function values and jacobians respectively.
     initial_points
-        A list of arrays, each of shape (num_dimensions).
-    **kwargs
-        Keyword arguments will be included in the 'options' dict passed to the underlying scipy optimiser.
+        A list of arrays, each of shape (num_dimensions), or a 2D array of shape (num_points, num_dimensions).
+    gtol
+        Each optimisation is considered converged once the infinity norm of its jacobian is less than this value.
+    maxiter
+        The maximum number of iterations of each optimisation. Defaults to 200 times the number of dimensions.
+    history_size
+        The number of previous steps used by each optimisation to approximate the inverse hessian.
+    executor
+        If given, the initial points are split into shards, and the shards are optimised in parallel by submitting them
+        to this executor. In this case `objective_function` must be picklable. Each shard seeds numpy's global random
+        state with a seed drawn from the calling process's random state before it is optimised, so results are
+        reproducible regardless of which worker runs which shard.
+    num_shards
+        The number of shards to split the initial points into when using an executor. Defaults to the number of CPUs.
 
     Returns
     -------
@@ -49,63 +62,35 @@ def multi_start_maximise(objective_function: Callable,
         The location of the found maximum.
     float
         The value of the objective function at the found maximum.
-    """
-    minimizer_kwargs = DEFAULT_MINIMIZER_KWARGS.copy()
-    minimizer_kwargs['options'] = {**minimizer_kwargs['options'], **kwargs}  # This merges the two dicts.
 
-    initial_point = np.concatenate(initial_points)
-    num_initial_points = len(initial_points)
-    num_dims = len(initial_points[0])
+    Raises
+    ------
+    FloatingPointError
+        If the objective function returns NaN or infinity at any of the initial points.
 
-    gtol = minimizer_kwargs['options']['gtol']
-
-    optimisation_terminated = np.full(num_initial_points, False)
-    located_optima = np.zeros((num_initial_points, num_dims))
-    located_optimal_values = np.full(num_initial_points, np.nan)
-
-    def function_to_minimise(x, *inner_args, **inner_kwargs):
-        nonlocal optimisation_terminated
-
-        x = np.reshape(x, (num_initial_points, num_dims))
-
-        value, jacobian = objective_function(x, *inner_args, **inner_kwargs)
-
-        jacobian_norms = np.linalg.norm(jacobian, axis=1, ord=np.inf)
-        new_optimum_found = np.logical_and(jacobian_norms < gtol,
-                                           np.logical_not(optimisation_terminated))
-
-        new_optima_indices = _indices_where(new_optimum_found)
-
-        located_optima[new_optima_indices] = x[new_optima_indices]
-        located_optimal_values[new_optima_indices] = value[new_optima_indices]
-
-        optimisation_terminated = np.logical_or(optimisation_terminated,
-                                                (jacobian_norms < gtol))
-        terminated_indices = _indices_where(optimisation_terminated)
-
-        value[terminated_indices] = located_optimal_values[terminated_indices]
-
-        dummy_jacobian = np.zeros(num_dims)
-        jacobian[terminated_indices] = dummy_jacobian
-
-        combined_value, combined_jacobian = -value.sum(), -jacobian.ravel()
-
-        if not np.isfinite(combined_value) or not np.all(np.isfinite(combined_jacobian)):
-            raise FloatingPointError("Objective function for multi-start optimisation returned NaN or infinity.")
+    Notes
+    -----
+    The memory required to store the state of the optimisations is :math:`O(S d m)` for :math:`S` starts in :math:`d`
+    dimensions with a history of size :math:`m`, rather than the :math:`O((S d)^2)` needed to optimise all starts as a
+    single concatenated problem.
+    """
+    initial_points = np.array(initial_points, dtype=float)
+    num_dims = initial_points.shape[1]
 
-        return combined_value, combined_jacobian
+    if maxiter is None:
+        maxiter = 200 * num_dims
 
-    maximum = scipy.optimize.minimize(function_to_minimise, initial_point, **minimizer_kwargs)
-    maxima = maximum.x.reshape(num_initial_points, num_dims)
+    if executor is not None:
+        return _maximise_shards_in_parallel(objective_function, initial_points, executor, num_shards,
+                                            gtol=gtol, maxiter=maxiter, history_size=history_size)
 
-    failed_indices = _indices_where(np.isnan(located_optimal_values))
-    located_optima[failed_indices] = maxima[failed_indices]
+    minima, minimal_values = _batched_lbfgs_minimise(_NegatedObjective(objective_function), initial_points, gtol=gtol,
+                                                     maxiter=maxiter, history_size=history_size)
 
-    values, _ = objective_function(located_optima)
-    max_index = np.argmax(values)
+    max_index = np.argmin(minimal_values)
 
-    optimal_x = maxima[max_index, :]
-    optimal_y = values[max_index]
+    optimal_x = minima[max_index, :]
+    optimal_y = -minimal_values[max_index]
 
     return optimal_x, optimal_y
 
@@ -154,7 +139,7 @@ def multi_start_maximise_slow(objective_function: Callable,
 
 
 def multi_start_maximise_log(objective_function: Callable,
-                             initial_points: List[ndarray], **kwargs) -> Tuple[ndarray, float]:
+                             initial_points: Union[List[ndarray], ndarray], **kwargs) -> Tuple[ndarray, float]:
     """Maximise the given objective function in log space. This may be significantly easier for functions with a high
     dynamic range.
 
@@ -163,11 +148,35 @@ def multi_start_maximise_log(objective_function: Callable,
     :func:`~multi_start_maximise` : `multi_start_maximise_log` is a thin wrapper around this function. See this function
     for further details on parameters and return values.
     """
-    @wraps(objective_function)
-    def log_objective_function(x, *inner_args, **inner_kwargs):
+    optimal_x, optimal_value = multi_start_maximise(_LogObjective(objective_function), initial_points, **kwargs)
+
+    return optimal_x, np.exp(optimal_value)
+
+
+class _NegatedObjective:
+    """The negation of a vectorised objective function, with outputs of consistent shape for any number of points."""
+
+    def __init__(self, objective_function: Callable):
+        self._objective_function = objective_function
+
+    def __call__(self, x):
+        value, jacobian = self._objective_function(x)
+
+        # The objective function may squeeze its outputs when it is evaluated at a single point.
+        return -np.reshape(value, len(x)), -np.reshape(jacobian, x.shape)
+
+
+class _LogObjective:
+    """The log of a vectorised objective function. This is a class rather than a closure so that it can be pickled."""
+
+    def __init__(self, objective_function: Callable):
+        self._objective_function = objective_function
+        update_wrapper(self, objective_function, updated=())
+
+    def __call__(self, x, *inner_args, **inner_kwargs):
         import numpy.ma as ma
 
-        value, jacobian = objective_function(x, *inner_args, **inner_kwargs)
+        value, jacobian = self._objective_function(x, *inner_args, **inner_kwargs)
         masked_value = ma.masked_equal(value, 0)
 
         log_value = ma.log(masked_value)
@@ -181,9 +190,206 @@ def multi_start_maximise_log(objective_function: Callable,
 
         return log_value, log_jacobian
 
-    optimal_x, optimal_value = multi_start_maximise(log_objective_function, initial_points, **kwargs)
 
-    return optimal_x, np.exp(optimal_value)
+def _maximise_shards_in_parallel(objective_function: Callable, initial_points: ndarray, executor: Executor,
+                                 num_shards: int, **kwargs) -> Tuple[ndarray, float]:
+    """Split the initial points into shards, maximise each shard on the given executor, and return the best result."""
+    if num_shards is None:
+        num_shards = os.cpu_count()
+
+    shards = np.array_split(initial_points, min(num_shards, len(initial_points)))
+    seeds = np.random.randint(np.iinfo(np.int32).max, size=len(shards))
+
+    futures = [executor.submit(_maximise_shard, objective_function, shard, seed, **kwargs)
+               for shard, seed in zip(shards, seeds)]
+
+    shard_maxima = [future.result() for future in futures]
+    maxima_x, maxima_y = zip(*shard_maxima)
+
+    max_index = np.argmax(maxima_y)
+
+    return maxima_x[max_index], maxima_y[max_index]
+
+
+def _maximise_shard(objective_function: Callable, shard: ndarray, seed: int, **kwargs) -> Tuple[ndarray, float]:
+    """Run multi-start maximisation over a single shard of initial points. This is run in a worker process."""
+    np.random.seed(seed)
+
+    return multi_start_maximise(objective_function, shard, **kwargs)
+
+
+def _batched_lbfgs_minimise(function: Callable, initial_points: ndarray, gtol: float, maxiter: int,
+                            history_size: int) -> Tuple[ndarray, ndarray]:
+    """Minimise a vectorised function from each of a set of initial points, using independent L-BFGS optimisations.
+
+    Parameters
+    ----------
+    function
+        Function to be minimised. Must accept a 2D array of shape (num_points, num_dimensions), returning a 1D array
+        and a 2D array for the function values and jacobians respectively.
+    initial_points
+        A 2D array of shape (num_starts, num_dimensions).
+    gtol, maxiter, history_size
+        See :func:`~multi_start_maximise`.
+
+    Returns
+    -------
+    minima : ndarray
+        A 2D array of shape (num_starts, num_dimensions), containing the final point of each optimisation.
+    minimal_values : ndarray
+        A 1D array of shape (num_starts), containing the value of the function at each of `minima`.
+    """
+    num_starts, num_dims = initial_points.shape
+
+    x = initial_points.copy()
+    value, jacobian = function(x)
+
+    if not np.all(np.isfinite(value)) or not np.all(np.isfinite(jacobian)):
+        raise FloatingPointError("Objective function for multi-start optimisation returned NaN or infinity.")
+
+    # The most recent steps and changes in jacobian of each optimisation, with the newest in the last position. Entries
+    # with rho equal to zero are unused, and have no effect on the search direction.
+    step_history = np.zeros((num_starts, history_size, num_dims))
+    jacobian_change_history = np.zeros((num_starts, history_size, num_dims))
+    rho_history = np.zeros((num_starts, history_size))
+
+    active = np.linalg.norm(jacobian, axis=1, ord=np.inf) >= gtol
+
+    for _ in range(maxiter):
+        active_indices = _indices_where(active)[0]
+
+        if active_indices.size == 0:
+            break
+
+        active_x = x[active_indices]
+        active_value = value[active_indices]
+        active_jacobian = jacobian[active_indices]
+
+        direction = _lbfgs_direction(active_jacobian, step_history[active_indices],
+                                     jacobian_change_history[active_indices], rho_history[active_indices])
+        slope = np.sum(active_jacobian * direction, axis=1)
+
+        # If the approximate inverse hessian has failed to give a descent direction, fall back to steepest descent.
+        not_descending = slope >= 0
+        if np.any(not_descending):
+            reset_indices = active_indices[not_descending]
+            rho_history[reset_indices] = 0
+
+            direction[not_descending] = (-active_jacobian[not_descending] /
+                                         np.linalg.norm(active_jacobian[not_descending], axis=1, keepdims=True))
+            slope[not_descending] = np.sum(active_jacobian[not_descending] * direction[not_descending], axis=1)
+
+        new_x, new_value, new_jacobian, line_search_succeeded = _batched_backtracking_line_search(
+            function, active_x, active_value, direction, slope)
+
+        succeeded_indices = active_indices[line_search_succeeded]
+
+        _update_lbfgs_history(step_history, jacobian_change_history, rho_history, succeeded_indices,
+                              steps=new_x[line_search_succeeded] - active_x[line_search_succeeded],
+                              jacobian_changes=(new_jacobian[line_search_succeeded] -
+                                                active_jacobian[line_search_succeeded]))
+
+        x[succeeded_indices] = new_x[line_search_succeeded]
+        value[succeeded_indices] = new_value[line_search_succeeded]
+        jacobian[succeeded_indices] = new_jacobian[line_search_succeeded]
+
+        # Starts whose line search failed cannot make further progress, so are treated as terminated.
+        active[active_indices[~line_search_succeeded]] = False
+        active[succeeded_indices] = np.linalg.norm(jacobian[succeeded_indices], axis=1, ord=np.inf) >= gtol
+
+    return x, value
+
+
+def _lbfgs_direction(jacobian: ndarray, step_history: ndarray, jacobian_change_history: ndarray,
+                     rho_history: ndarray) -> ndarray:
+    """Compute the L-BFGS search direction for each of a set of optimisations, using the two-loop recursion."""
+    history_size = rho_history.shape[1]
+
+    q = jacobian.copy()
+    alpha = np.zeros_like(rho_history)
+
+    for i in reversed(range(history_size)):
+        alpha[:, i] = rho_history[:, i] * np.sum(step_history[:, i] * q, axis=1)
+        q -= alpha[:, i, newaxis] * jacobian_change_history[:, i]
+
+    # Scale the initial inverse hessian approximation using the most recent step, or so that the first step of an
+    # optimisation with no history has unit length.
+    newest_rho = rho_history[:, -1]
+    newest_change_squared = np.sum(jacobian_change_history[:, -1] ** 2, axis=1)
+    has_history = newest_rho > 0
+
+    gamma = np.empty(len(jacobian))
+    gamma[has_history] = 1 / (newest_rho[has_history] * newest_change_squared[has_history])
+    gamma[~has_history] = 1 / np.maximum(np.linalg.norm(jacobian[~has_history], axis=1), np.finfo(float).tiny)
+
+    r = gamma[:, newaxis] * q
+
+    for i in range(history_size):
+        beta = rho_history[:, i] * np.sum(jacobian_change_history[:, i] * r, axis=1)
+        r += step_history[:, i] * (alpha[:, i] - beta)[:, newaxis]
+
+    return -r
+
+
+def _batched_backtracking_line_search(function: Callable, x: ndarray, value: ndarray, direction: ndarray,
+                                      slope: ndarray) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+    """Find a step length satisfying the Armijo condition along the given direction for each of a set of points.
+
+    Only the points whose line search has not yet succeeded are evaluated at each backtracking step. Returns the new
+    points, their function values and jacobians, and a boolean array recording which line searches succeeded."""
+    num_points = len(x)
+
+    new_x = x.copy()
+    new_value = value.copy()
+    new_jacobian = np.zeros_like(x)
+    succeeded = np.full(num_points, False)
+
+    step_length = np.ones(num_points)
+    pending = np.arange(num_points)
+
+    for _ in range(_MAX_BACKTRACKING_STEPS):
+        trial_x = x[pending] + step_length[pending, newaxis] * direction[pending]
+        trial_value, trial_jacobian = function(trial_x)
+
+        sufficient_decrease = np.logical_and.reduce((
+            np.isfinite(trial_value),
+            np.all(np.isfinite(trial_jacobian), axis=1),
+            trial_value <= value[pending] + _ARMIJO_CONSTANT * step_length[pending] * slope[pending]))
+
+        accepted = pending[sufficient_decrease]
+        new_x[accepted] = trial_x[sufficient_decrease]
+        new_value[accepted] = trial_value[sufficient_decrease]
+        new_jacobian[accepted] = trial_jacobian[sufficient_decrease]
+        succeeded[accepted] = True
+
+        pending = pending[~sufficient_decrease]
+
+        if pending.size == 0:
+            break
+
+        step_length[pending] /= 2
+
+    return new_x, new_value, new_jacobian, succeeded
+
+
+def _update_lbfgs_history(step_history: ndarray, jacobian_change_history: ndarray, rho_history: ndarray,
+                          indices: ndarray, steps: ndarray, jacobian_changes: ndarray):
+    """Append the latest step and change in jacobian to the history of each of the given optimisations, in place.
+
+    Pairs which do not satisfy the curvature condition would make the inverse hessian approximation indefinite, so are
+    discarded."""
+    curvature = np.sum(steps * jacobian_changes, axis=1)
+    valid = curvature > 1e-10 * np.sum(jacobian_changes ** 2, axis=1)
+
+    indices = indices[valid]
+
+    step_history[indices] = np.roll(step_history[indices], -1, axis=1)
+    jacobian_change_history[indices] = np.roll(jacobian_change_history[indices], -1, axis=1)
+    rho_history[indices] = np.roll(rho_history[indices], -1, axis=1)
+
+    step_history[indices, -1] = steps[valid]
+    jacobian_change_history[indices, -1] = jacobian_changes[valid]
+    rho_history[indices, -1] = 1 / curvature[valid]
 
 
 def _indices_where(array: ndarray) -> Tuple:
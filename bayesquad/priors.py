@@ -9,10 +9,21 @@ from numpy import ndarray, newaxis
 
 from ._util import validate_dimensions
 
+SOBOL = "Sobol"
+HALTON = "Halton"
+
 
 class Prior(ABC):
     """A prior, providing methods for sampling, and for pointwise evaluation of the pdf and its derivatives."""
 
+    @property
+    def dimensions(self) -> int:
+        """The number of dimensions of the space on which the prior is defined.
+
+        By default, this is the size of a single sample from the prior. Subclasses should override this where the
+        dimensionality is known without sampling."""
+        return np.size(self.sample())
+
     @abstractmethod
     def gradient(self, x: ndarray) -> Tuple[ndarray, ndarray]:
         """Compute the jacobian and hessian of the prior's pdf at the given set of points.
@@ -32,14 +43,84 @@ class Prior(ABC):
         """
 
     @abstractmethod
-    def sample(self) -> ndarray:
-        """Sample a point from the prior.
+    def sample(self, num_points: int = None) -> ndarray:
+        """Sample a point, or a set of points, from the prior.
+
+        Parameters
+        ----------
+        num_points
+            The number of points to sample. If not given, a single point is sampled.
+
+        Returns
+        -------
+        ndarray
+            A 2D array of shape (num_points, num_dimensions), or a 1D array of shape (num_dimensions) if `num_points`
+            was not given.
+        """
+
+    def sample_low_discrepancy(self, num_points: int, sequence: str = SOBOL) -> ndarray:
+        """Generate a set of points which are distributed according to the prior, but which cover it more evenly than
+        independent samples would, by mapping a randomly scrambled low-discrepancy sequence through the prior.
+
+        The scrambling is seeded from numpy's global random state, so results are reproducible if that is seeded.
+
+        Parameters
+        ----------
+        num_points
+            The number of points to generate.
+        sequence
+            The low-discrepancy sequence to use. Currently supported sequences are:
+                - "Sobol"
+                - "Halton"
 
         Returns
         -------
         ndarray
-            A sample from the prior, as a 1D array of shape (num_dimensions).
+            A 2D array of shape (num_points, num_dimensions).
+
+        Raises
+        ------
+        ValueError
+            If `num_points` is less than 1.
+        NotImplementedError
+            If the sequence is not supported, or the prior does not support mapping points from the unit hypercube.
         """
+        if num_points < 1:
+            raise ValueError("Expected at least 1 point, but got {}.".format(num_points))
+
+        seed = np.random.randint(np.iinfo(np.int32).max)
+
+        if sequence == SOBOL:
+            # Sobol sequences are only balanced when their length is a power of two, so we take the first points of the
+            # shortest such sequence.
+            sobol = scipy.stats.qmc.Sobol(self.dimensions, seed=seed)
+            uniform_points = sobol.random_base2(int(np.ceil(np.log2(num_points))))[:num_points]
+        elif sequence == HALTON:
+            uniform_points = scipy.stats.qmc.Halton(self.dimensions, seed=seed).random(num_points)
+        else:
+            raise NotImplementedError("{} is not a supported low-discrepancy sequence.".format(sequence))
+
+        return self._from_unit_hypercube(uniform_points)
+
+    def _from_unit_hypercube(self, uniform_points: ndarray) -> ndarray:
+        """Map points which are uniformly distributed on the unit hypercube to points distributed according to the
+        prior. Both input and output are 2D arrays of shape (num_points, num_dimensions)."""
+        raise NotImplementedError
+
+    def log_pdf(self, x: ndarray) -> ndarray:
+        """Evaluate the log of the prior's pdf at the given set of points.
+
+        Parameters
+        ----------
+        x
+            An array of shape (num_points, num_dimensions).
+
+        Returns
+        -------
+        ndarray
+            A 1D array of shape (num_points).
+        """
+        return np.log(self(x))
 
     @abstractmethod
     def __call__(self, x: ndarray) -> ndarray:
@@ -83,10 +164,27 @@ class Gaussian(Prior):
 
         self._dimensions = np.size(mean)
         self._multivariate_normal = scipy.stats.multivariate_normal(mean=mean, cov=covariance)
+        self._covariance_cholesky = np.linalg.cholesky(np.reshape(covariance, (self._dimensions, self._dimensions)))
+
+    @property
+    def dimensions(self) -> int:
+        """See :func:`~Prior.dimensions`"""
+        return self._dimensions
 
-    def sample(self) -> ndarray:
+    def sample(self, num_points: int = None) -> ndarray:
         """See :func:`~Prior.sample`"""
-        return np.atleast_1d(self._multivariate_normal.rvs())
+        if num_points is None:
+            return self.sample(1)[0]
+
+        standard_normal_samples = np.random.standard_normal((num_points, self._dimensions))
+
+        return self._from_standard_normal(standard_normal_samples)
+
+    def _from_unit_hypercube(self, uniform_points: ndarray) -> ndarray:
+        return self._from_standard_normal(scipy.stats.norm.ppf(uniform_points))
+
+    def _from_standard_normal(self, standard_normal_points: ndarray) -> ndarray:
+        return np.reshape(self.mean, self._dimensions) + standard_normal_points @ self._covariance_cholesky.T
 
     def gradient(self, x: ndarray) -> Tuple[ndarray, ndarray]:
         """See :func:`~Prior.gradient`"""
@@ -104,6 +202,11 @@ class Gaussian(Prior):
 
         return jacobian, hessian
 
+    def log_pdf(self, x: ndarray) -> ndarray:
+        """See :func:`~Prior.log_pdf`"""
+        validate_dimensions(x, self._dimensions)
+        return np.atleast_1d(self._multivariate_normal.logpdf(x))
+
     def __call__(self, x: ndarray) -> ndarray:
         """See :func:`~Prior.__call__`"""
         validate_dimensions(x, self._dimensions)
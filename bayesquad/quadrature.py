@@ -6,25 +6,34 @@ from typing import Tuple, Union
 
 import numpy as np
 from GPy.kern import Kern, RBF
+from GPy.kern.src.stationary import Matern32, Matern52
 # from multimethod import multimethod
 from numpy import ndarray, newaxis
 
+from ._cache import last_value_cache, IncrementalDataCache
 from .decorators import flexible_array_dimensions
-from .gps import WarpedGP, WsabiLGP, GP
+from .gps import WarpedGP, WsabiLGP, GP, SparseGP
+from .kernel_means import kernel_mean, kernel_double_integral
 from .maths_helpers import jacobian_of_f_squared_times_g, hessian_of_f_squared_times_g
 from .priors import Gaussian, Prior
 from ratio_extension.prior_1d import Gaussian1D
 from abc import abstractmethod
-from scipy.stats import multivariate_normal, norm
-from scipy.linalg import cho_solve, cho_factor
+from scipy.linalg import cho_solve, cho_factor, solve_triangular
 from GPy.util.linalg import jitchol
 
+# The default maximum size, in bytes, of each block of the N x N interaction matrix used to compute the WSABI-L
+# integral.
+DEFAULT_INTEGRAL_MEMORY_BUDGET = 64 * 2 ** 20
+
 
 class IntegrandModel:
     """
     Added a base class to accommodate both the WSABI and vanilla Bayesian quadrature methods.
     Addition by Xingchen Wan - 11 Nov 2018
     """
+    # The kernels for which the mean of the integral can be computed.
+    _supported_kernels = (RBF,)
+
     def __init__(self, gp, prior: Prior):
         self.gp = gp
         self.prior = prior
@@ -57,7 +66,7 @@ class IntegrandModel:
 
         return mean, variance
 
-    @abstractmethod
+    @flexible_array_dimensions
     def posterior_variance_jacobian(self, x: ndarray) -> ndarray:
         """Get the jacobian of the posterior variance of the product of warped GP and prior at a point or set of points.
 
@@ -79,9 +88,11 @@ class IntegrandModel:
         Writing :math:`\\pi(x)` for the prior, and :math:`V(x)` for the posterior variance, the posterior variance of
         the product is :math:`\\pi(x)^2 V(x)`.
         """
-        pass
+        _, variance_jacobian = self.posterior_variance_derivatives(x, order=1)
 
-    @abstractmethod
+        return variance_jacobian
+
+    @flexible_array_dimensions
     def posterior_variance_hessian(self, x: ndarray) -> ndarray:
         """Get the hessian of the posterior variance of the product of warped GP and prior at a point, or set of points.
 
@@ -103,7 +114,65 @@ class IntegrandModel:
         Writing :math:`\\pi(x)` for the prior, and :math:`V(x)` for the posterior variance, the posterior variance of
         the product is :math:`\\pi(x)^2 V(x)`.
         """
-        pass
+        _, _, variance_hessian = self.posterior_variance_derivatives(x, order=2)
+
+        return variance_hessian
+
+    @flexible_array_dimensions
+    def posterior_variance_derivatives(self, x: ndarray, order: int = 2) -> Tuple[ndarray, ...]:
+        """Get the posterior variance of the product of warped GP and prior, along with its jacobian and hessian up to a
+        given order.
+
+        This is equivalent to calling :func:`~posterior_mean_and_variance`, :func:`~posterior_variance_jacobian` and
+        :func:`~posterior_variance_hessian` in turn, but the posterior of the GP is only evaluated once.
+
+        Parameters
+        ----------
+        x
+            The point(s) at which to evaluate the posterior variance and its derivatives. A 2D array of shape
+            (num_points, num_dimensions), or a 1D array of shape (num_dimensions).
+        order
+            The highest order of derivative to compute. Must be 0, 1 or 2.
+
+        Returns
+        -------
+        tuple[ndarray, ...]
+            A tuple of length `order + 1`. The first element is the posterior variance, as returned by
+            :func:`~posterior_mean_and_variance`. If `order` is at least 1, the second element is the jacobian, as
+            returned by :func:`~posterior_variance_jacobian`. If `order` is 2, the third element is the hessian, as
+            returned by :func:`~posterior_variance_hessian`.
+        """
+        gp_variance_derivatives = self._gp_variance_derivatives(x, order)
+        gp_variance = gp_variance_derivatives[0]
+
+        prior = self.prior(x)
+
+        derivatives = [gp_variance * prior ** 2]
+
+        if order >= 1:
+            prior_jacobian, prior_hessian = self.prior.gradient(x)
+            gp_variance_jacobian = gp_variance_derivatives[1]
+
+            derivatives.append(jacobian_of_f_squared_times_g(
+                f=prior, f_jacobian=prior_jacobian,
+                g=gp_variance, g_jacobian=gp_variance_jacobian))
+
+        if order >= 2:
+            gp_variance_hessian = gp_variance_derivatives[2]
+
+            derivatives.append(hessian_of_f_squared_times_g(
+                f=prior, f_jacobian=prior_jacobian, f_hessian=prior_hessian,
+                g=gp_variance, g_jacobian=gp_variance_jacobian, g_hessian=gp_variance_hessian))
+
+        return tuple(derivatives)
+
+    @abstractmethod
+    def _gp_variance_derivatives(self, x: ndarray, order: int) -> Tuple[ndarray, ...]:
+        """Get the posterior variance of the GP, along with its jacobian and hessian up to the given order.
+
+        `x` will always be a 2D array. The return value should be as described in
+        :func:`~posterior_variance_derivatives`, but for the GP alone rather than its product with the prior.
+        """
 
     def update(self, x: ndarray, y: ndarray):
         """Add new data to the model.
@@ -124,16 +193,13 @@ class IntegrandModel:
 
     def integral_mean(self, log_transform=False) -> float:
         """Compute the mean of the integral of the function under this model."""
-        if isinstance(self.prior, Gaussian) and isinstance(self.gp.kernel, RBF):
-            return self._compute_mean(self.prior, self.gp, self.gp.kernel, log_transform=log_transform)
-        elif isinstance(self.prior, Gaussian1D) and isinstance(self.gp.kernel, RBF):
+        if isinstance(self.prior, (Gaussian, Gaussian1D)) and isinstance(self.gp.kernel, self._supported_kernels):
             return self._compute_mean(self.prior, self.gp, self.gp.kernel, log_transform=log_transform)
         else:
             raise NotImplementedError()
 
-    @staticmethod
     @abstractmethod
-    def _compute_mean(prior, gp, kernel, log_transform=False) -> float: pass
+    def _compute_mean(self, prior, gp, kernel, log_transform=False) -> float: pass
 
     def fantasise(self, x, y):
         self.gp.fantasise(x, y)
@@ -148,53 +214,78 @@ class IntegrandModel:
             x = x.reshape(-1, 1)
         K_xx = kernel.K(x)
         K_xx_cho = jitchol(K_xx)
-        cholesky_inv = np.linalg.inv(K_xx_cho)
-        K_xx_inv = cholesky_inv.T @ cholesky_inv
+        K_xx_inv = cho_solve((K_xx_cho, True), np.eye(len(x)))
         return K_xx, K_xx_inv
 
 
 class WarpedIntegrandModel(IntegrandModel):
     """Represents the product of a warped Gaussian Process and a prior.
 
-    Typically, this product is the function that we're interested in integrating."""
+    Typically, this product is the function that we're interested in integrating.
+
+    Parameters
+    ----------
+    warped_gp
+        The warped GP modelling the integrand.
+    prior
+        The prior against which the integrand is integrated.
+    integral_memory_budget
+        The maximum size, in bytes, of each block of the interaction matrix held in memory while computing the mean of
+        the integral. See :func:`~_compute_mean`.
+    """
 
-    def __init__(self, warped_gp: WarpedGP, prior: Prior):
+    def __init__(self, warped_gp: WarpedGP, prior: Prior,
+                 integral_memory_budget: int = DEFAULT_INTEGRAL_MEMORY_BUDGET):
         super(WarpedIntegrandModel, self).__init__(warped_gp, prior)
+        self.integral_memory_budget = integral_memory_budget
 
-    @flexible_array_dimensions
-    def posterior_variance_jacobian(self, x: ndarray) -> ndarray:
-        _, gp_variance = self.gp.posterior_mean_and_variance(x)
-        gp_variance_jacobian = self.gp.posterior_variance_jacobian(x)
+        self._interaction_cache = IncrementalDataCache(symmetric_matrix=True)
 
-        prior = self.prior(x)
-        prior_jacobian, _ = self.prior.gradient(x)
-        return jacobian_of_f_squared_times_g(
-            f=prior, f_jacobian=prior_jacobian,
-            g=gp_variance, g_jacobian=gp_variance_jacobian)
+    def _gp_variance_derivatives(self, x: ndarray, order: int) -> Tuple[ndarray, ...]:
+        return self.gp.posterior_variance_derivatives(x, order=order)
 
-    @flexible_array_dimensions
-    def posterior_variance_hessian(self, x: ndarray) -> ndarray:
-        _, gp_variance = self.gp.posterior_mean_and_variance(x)
-        gp_variance_jacobian = self.gp.posterior_variance_jacobian(x)
-        gp_variance_hessian = self.gp.posterior_variance_hessian(x)
-
-        prior = self.prior(x)
-        prior_jacobian, prior_hessian = self.prior.gradient(x)
+    def _compute_mean(self, prior: Union[Gaussian, Gaussian1D], gp: WarpedGP, kernel: RBF,
+                      log_transform=False):
+        """Compute the mean of the integral for a WSABI-L GP with a squared exponential kernel against a Gaussian prior.
 
-        return hessian_of_f_squared_times_g(
-            f=prior, f_jacobian=prior_jacobian, f_hessian=prior_hessian,
-            g=gp_variance, g_jacobian=gp_variance_jacobian, g_hessian=gp_variance_hessian)
+        The kernel may have a separate lengthscale for each dimension (i.e. `ARD=True`). Writing :math:`\\Lambda` for
+        the diagonal matrix of squared lengthscales, every occurrence of the squared lengthscale in the isotropic case
+        is replaced by :math:`\\Lambda`, which is applied elementwise along the last axis of each array.
 
-    @staticmethod
-    def _compute_mean(prior: Union[Gaussian, Gaussian1D], gp: WarpedGP, kernel: RBF,
-                      log_transform=False):
+        Notes
+        -----
+        The mean is :math:`\\alpha + \\frac{1}{2} A^T (K \\circ L) A`, where :math:`A` is the Woodbury vector of the
+        underlying GP and the :math:`N \\times N` interaction matrix :math:`K \\circ L` comes from integrating the
+        product of two kernels and the prior. Expanding the quadratic forms in its exponent, every term which mixes
+        :math:`x_i` and :math:`x_j` other than :math:`v_i^T v_j` cancels, where :math:`v_i = R^{-1} (\\Lambda^{-1} x_i +
+        \\Sigma^{-1} \\mu / 2)` and :math:`R` is the Cholesky factor of :math:`C = \\Sigma^{-1} + 2 \\Lambda^{-1}`. So
+        the log of each element of the interaction matrix is :math:`a_i + a_j + v_i^T v_j` plus a constant, and no
+        :math:`N \\times N \\times d` arrays are needed.
+
+        If the whole interaction matrix fits within `integral_memory_budget`, it is cached, and when data is appended to
+        the GP without the kernel hyperparameters or prior changing, only the rows and columns for the new data are
+        computed. Otherwise, we accumulate the quadratic form over blocks of rows of the interaction matrix, so that at
+        most `integral_memory_budget` bytes of it are held in memory at once. In either case, the Cholesky factors of
+        :math:`C` and of the prior covariance are cached, and only recomputed when the kernel lengthscales or the prior
+        change.
+
+        If the underlying GP is a :class:`~bayesquad.gps.SparseGP`, its posterior mean is a weighted sum of kernels
+        centred on the inducing points, so :math:`x_i` are the inducing points and :math:`A` is the corresponding
+        Woodbury vector. The cost is then independent of the amount of data.
+        """
         dimensions = gp.dimensions
 
         alpha = gp._alpha
-        kernel_lengthscale = kernel.lengthscale.values[0]
+        kernel_lengthscale = np.broadcast_to(kernel.lengthscale.values, (dimensions,))
         kernel_variance = kernel.variance.values[0]
 
-        X_D = gp._gp.X
+        # The diagonal of the inverse of the matrix of squared lengthscales.
+        inverse_lengthscale_squared = 1 / kernel_lengthscale ** 2
+
+        # The points on which the kernels making up the posterior mean are centred - for an exact GP, these are the data
+        # (including any fantasies).
+        X_D, _, A, _ = gp._gp._posterior_arrays()
+        A = A[:, newaxis]
 
         if log_transform:
             raise NotImplementedError()
@@ -208,32 +299,64 @@ class WarpedIntegrandModel(IntegrandModel):
             sigma = prior.covariance
             sigma_inv = prior.precision
 
-        nu = (X_D[:, newaxis, :] + X_D[newaxis, :, :]) / 2
-        A = gp._gp.posterior.woodbury_vector
+        mu = np.reshape(mu, dimensions)
+        sigma = np.reshape(sigma, (dimensions, dimensions))
+        sigma_inv = np.reshape(sigma_inv, (dimensions, dimensions))
 
-        L = np.exp(
-            -(np.linalg.norm(X_D[:, newaxis, :] - X_D[newaxis, :, :], axis=2) ** 2) / (4 * kernel_lengthscale ** 2))
-        L = kernel_variance ** 2 * L
-        L = np.linalg.det(2 * np.pi * sigma) ** (-1 / 2) * L
+        sigma_cholesky = self._cholesky(sigma)
+        C_cholesky = self._cholesky(sigma_inv + 2 * np.diag(inverse_lengthscale_squared))
 
-        C = sigma_inv + 2 * np.eye(dimensions) / kernel_lengthscale ** 2
+        sigma_inv_mu = cho_solve((sigma_cholesky, True), mu)
 
-        C_inv = np.linalg.inv(C)
-        if dimensions == 1:
-            gamma_part = 2 * nu / kernel_lengthscale ** 2 + (sigma_inv @ mu)[newaxis, :]
-        else:
-            gamma_part = 2 * nu / kernel_lengthscale ** 2 + (sigma_inv @ mu)[newaxis: newaxis, :]
-        gamma = np.einsum('kl,ijl->ijk', C_inv, gamma_part)
+        log_det_sigma = 2 * np.sum(np.log(np.diag(sigma_cholesky)))
+        log_det_C = 2 * np.sum(np.log(np.diag(C_cholesky)))
+
+        # This gathers the kernel variance, the normalising constants of the prior and of the Gaussian integral over
+        # C, the term of the exponent depending only on the prior, and the factor of 1/2 in front of the quadratic form.
+        log_constant = (2 * np.log(kernel_variance) - (dimensions * np.log(2 * np.pi) + log_det_sigma) / 2
+                        - mu @ sigma_inv_mu / 2 + (dimensions * np.log(2 * np.pi) - log_det_C) / 2 - np.log(2))
 
-        k_1 = 2 * np.einsum('ijk,ijk->ij', nu, nu) / kernel_lengthscale ** 2
-        k_2 = mu.T @ sigma_inv @ mu
-        k_3 = np.einsum('ijk,kl,ijl->ij', gamma, C, gamma)
+        def interaction_factors(x):
+            scaled_x = x * inverse_lengthscale_squared
+            v = solve_triangular(C_cholesky, (scaled_x + sigma_inv_mu / 2).T, lower=True).T
+            a = (np.sum(v ** 2, axis=1) - np.sum(x * scaled_x, axis=1)) / 2
 
-        k = k_1 + k_2 - k_3
+            return v, a
 
-        K = np.exp(-k / 2)
+        def interaction(row_factors, column_factors):
+            (row_v, row_a), (column_v, column_a) = row_factors, column_factors
+            return np.exp(row_a[:, newaxis] + column_a[newaxis, :] + row_v @ column_v.T + log_constant)
 
-        return alpha + (np.linalg.det(2 * np.pi * np.linalg.inv(C)) ** 0.5) / 2 * (A.T @ (K * L) @ A), None, None
+        num_data = len(X_D)
+
+        if 8 * num_data ** 2 <= self.integral_memory_budget:
+            # The whole interaction matrix fits within the memory budget, so we keep it, and only compute the rows and
+            # columns for new data next time.
+            parameters = (kernel.param_array, mu, sigma)
+            interaction_matrix = self._interaction_cache.get(
+                X_D, parameters, lambda rows, columns: interaction(interaction_factors(rows),
+                                                                   interaction_factors(columns)))
+
+            return alpha + A.T @ interaction_matrix @ A, None, None
+
+        v, a = interaction_factors(X_D)
+
+        # Each block holds its exponent and the interaction matrix, each of 8 bytes per element.
+        block_size = max(1, self.integral_memory_budget // (2 * 8 * num_data))
+
+        quadratic_form = 0.
+        for block_start in range(0, num_data, block_size):
+            block = slice(block_start, block_start + block_size)
+
+            quadratic_form += A[block].T @ interaction((v[block], a[block]), (v, a)) @ A
+
+        return alpha + quadratic_form, None, None
+
+    @last_value_cache
+    def _cholesky(self, matrix: ndarray) -> ndarray:
+        """Compute the lower Cholesky factor of a matrix. This is cached, since the matrices passed here only change
+        when the prior or the kernel lengthscales do."""
+        return np.linalg.cholesky(matrix)
 
 
 class OriginalIntegrandModel(IntegrandModel):
@@ -243,104 +366,132 @@ class OriginalIntegrandModel(IntegrandModel):
 
     Addition by Xingchen Wan - 11 Nov 2018
     """
+    _supported_kernels = (RBF, Matern32, Matern52)
+
     def __init__(self, gp: GP, prior: Prior):
         super(OriginalIntegrandModel, self).__init__(gp=gp, prior=prior)
 
-    @flexible_array_dimensions
-    def posterior_variance_jacobian(self, x: ndarray) -> ndarray:
-        _, gp_variance = self.gp.posterior_mean_and_variance(x)
-        _, gp_variance_jacobian = self.gp.posterior_jacobians(x)
+        self._n_s_cache = IncrementalDataCache()
 
-        prior = self.prior(x)
-        prior_jacobian, _ = self.prior.gradient(x)
-        return jacobian_of_f_squared_times_g(
-            f=prior, f_jacobian=prior_jacobian,
-            g=gp_variance, g_jacobian=gp_variance_jacobian)
+    def _gp_variance_derivatives(self, x: ndarray, order: int) -> Tuple[ndarray, ...]:
+        # The derivatives of the GP are returned as (mean, variance, mean jacobian, variance jacobian, ...).
+        return self.gp.posterior_derivatives(x, order=order)[1::2]
 
-    @flexible_array_dimensions
-    def posterior_variance_hessian(self, x: ndarray) -> ndarray:
-        _, gp_variance = self.gp.posterior_mean_and_variance(x)
-        _, gp_variance_jacobian = self.gp.posterior_jacobians(x)
-        _, gp_variance_hessian = self.gp.posterior_hessians(x)
-
-        prior = self.prior(x)
-        prior_jacobian, prior_hessian = self.prior.gradient(x)
-
-        return hessian_of_f_squared_times_g(
-            f=prior, f_jacobian=prior_jacobian, f_hessian=prior_hessian,
-            g=gp_variance, g_jacobian=gp_variance_jacobian, g_hessian=gp_variance_hessian)
-
-    @staticmethod
-    def _compute_mean(prior: Union[Gaussian, Gaussian1D], gp: GP, kernel: RBF,
+    def _compute_mean(self, prior: Union[Gaussian, Gaussian1D], gp: GP, kernel: Union[RBF, Matern32, Matern52],
                       X_D: np.ndarray=None, Y_D: Union[np.ndarray, int]=None,
                       log_transform=False):
         """
         Compute the mean (i.e. expectation) of the integral
         :param prior: Prior
         :param gp: GP
-        :param kernel: type of kernel - for now only the RBF kernel is supported
+        :param kernel: type of kernel - the RBF, Matern32 and Matern52 kernels are supported
         :param X_D: Query points - if this argument is not supplied the evaluated points of the Gaussian process will
         be used
         :param Y_D: The functional value at X_D. Note that -1 is a special value. If Y_D is -1 is supplied, we are
-        not interested in finding out the integral expectation but rather only interested in finding the inverse of the
-        covariance matrix and value of vector n_s
-        :return: mean: mean value of the integral, K_xx_inv: inverse of the full covariance matrix,n_s: the vector
-        defined in Equation 7.1.7 in Mike's DPhil dissertation
+        not interested in finding out the integral expectation but rather only interested in finding the Cholesky factor
+        of the covariance matrix and value of vector n_s
+        :return: mean: mean value of the integral, K_xx_cho: lower Cholesky factor of the full covariance matrix (None
+        for a sparse GP), n_s: the vector defined in Equation 7.1.7 in Mike's DPhil dissertation
+
+        When neither X_D nor Y_D is supplied, the mean is that of the GP's own posterior, as used by integral_variance.
+        The posterior mean is a weighted sum of kernels centred on the data (including any fantasies), or on the M
+        inducing points for a SparseGP, so the mean of the integral is the inner product of n_s at those points with
+        the Woodbury vector of the posterior. n_s is cached, and when data is appended to the GP without the kernel
+        hyperparameters or prior changing, only its elements for the new data are computed, so this costs O(N) (or
+        O(M) for a SparseGP) once n_s is cached. The Cholesky factor returned is that held by the GP posterior, whose
+        covariance matrix includes the likelihood noise.
+
+        When X_D is supplied, the function values Y_D are treated as noise-free, and the covariance matrix is
+        factorised from scratch.
         """
-        from GPy.util.linalg import jitchol
-        # w, h are the lengthscale and variance of the RBF kernel - see Equation 7.1.4 in Mike's DPhil Dissertation
+        if X_D is None and Y_D is None:
+            X_D, precision_factors, woodbury_vector, _ = gp._posterior_arrays()
+            n_s = self._cached_n_s(prior, kernel, X_D, log_transform)
+            K_xx_cho = None if isinstance(gp, SparseGP) else precision_factors[0][0]
+            return n_s @ woodbury_vector[:, newaxis], K_xx_cho, n_s
 
-        if log_transform is True:
-            w = np.exp(kernel.lengthscale.values[0])
-            h = np.exp(kernel.variance.values[0])
-        else:
-            w = kernel.lengthscale.values[0]
-            h = kernel.variance.values[0]
-
-        print("kerLengthScale: ", kernel.lengthscale.values[0], 'kerVar: ', kernel.variance.values[0])
-        print("w: ", w, "h: ", h)
         if X_D is None:
             X_D = gp._gpy_gp.X
         if Y_D is None:
             Y_D = gp._gpy_gp.Y
-        n, d = X_D.shape
-        # n: number of samples, d: dimensionality of each sample
-        print("X_D: ", X_D, "Y_D: ", Y_D)
 
-        if isinstance(prior, Gaussian1D):
-            mu = prior.matrix_mean
-            sigma = prior.matrix_variance
-        else:
-            mu = prior.mean
-            sigma = prior.covariance
+        # w, h are the lengthscale and variance of the kernel - see Equation 7.1.4 in Mike's DPhil Dissertation
+        w, h = self._kernel_scales(kernel, log_transform)
 
-        # Defined in Equations 7.1.7
-        n_s = np.zeros((n, ))
+        n_s = kernel_mean(kernel, prior, X_D, variance=h, lengthscale=w)
+        K_xx_cho = jitchol(kernel.K(X_D))
 
-        if d == 1:
-            W = float(sigma) + w ** 2
-            mu = np.asscalar(mu)
-            for i in range(n):
-                n_s[i] = h * norm.pdf(X_D[i, :], loc=mu, scale=np.sqrt(W))
-        else:
-            w = np.array([w]*d)
-            W = sigma
-            W_2 = 2 * sigma
-            for i in range(d):
-                W[i, i] += w[i] ** 2
-                W_2[i, i] += w[i] ** 2
-            for i in range(n):
-                n_s[i] = h * multivariate_normal.pdf(X_D[i, :], mean=mu, cov=W)
-        K_xx = kernel.K(X_D)
-        # Find the inverse of K_xx matrix via Cholesky decomposition (with jitter)
-        K_xx_cho = jitchol(K_xx,)
-        choleksy_inverse = np.linalg.inv(K_xx_cho)
-        K_xx_inv = choleksy_inverse.T @ choleksy_inverse
         if isinstance(Y_D, int) and Y_D == -1:
-            return np.nan, K_xx_inv, n_s
+            return np.nan, K_xx_cho, n_s
         else:
-            mean = n_s.T @ K_xx_inv @ Y_D
-            return mean, K_xx_inv, n_s
+            mean = n_s.T @ cho_solve((K_xx_cho, True), Y_D)
+            return mean, K_xx_cho, n_s
+
+    def integral_variance(self, log_transform=False) -> float:
+        """Compute the variance of the integral of the function under this model.
+
+        This is the integral of the prior kernel against the prior in both arguments, less the reduction in variance due
+        to the data, :math:`n_s^T K^{-1} n_s`, where :math:`n_s` is the vector defined in Equation 7.1.7 in Mike's DPhil
+        dissertation, and :math:`K` is the covariance matrix of the data (including noise). Both :math:`n_s` and the
+        double integral are cached, so that this only costs one triangular solve against the Cholesky factor held by
+        the GP posterior. For a sparse GP, :math:`n_s` is taken at the inducing points, and :math:`K^{-1}` is replaced
+        by the difference of inverses described in :func:`~bayesquad.gps.SparseGP._sparse_posterior`.
+
+        Unlike :meth:`~sample_histogram`, the result is exact, and its cost does not depend on the dimension of the
+        domain.
+        """
+        if not (isinstance(self.prior, (Gaussian, Gaussian1D)) and isinstance(self.gp.kernel, self._supported_kernels)):
+            raise NotImplementedError()
+
+        kernel = self.gp.kernel
+        X_D, precision_factors, _, _ = self.gp._posterior_arrays()
+        w, h = self._kernel_scales(kernel, log_transform)
+
+        prior_covariance = self.prior.matrix_variance if isinstance(self.prior, Gaussian1D) else self.prior.covariance
+        double_integral_parameters = np.concatenate((np.atleast_1d(h), np.broadcast_to(w, X_D.shape[1]),
+                                                     np.ravel(prior_covariance)))
+        prior_variance = self._kernel_double_integral(double_integral_parameters)
+
+        n_s = self._cached_n_s(self.prior, kernel, X_D, log_transform)
+
+        variance_reduction = 0.
+        for cholesky, sign in precision_factors:
+            L_inv_n_s = solve_triangular(cholesky, n_s, lower=True)
+            variance_reduction += sign * L_inv_n_s @ L_inv_n_s
+
+        return prior_variance - variance_reduction
+
+    @staticmethod
+    def _kernel_scales(kernel: Kern, log_transform: bool) -> Tuple[ndarray, float]:
+        """Return the lengthscale(s) and variance of the kernel, which are stored as logs if `log_transform` is True."""
+        if log_transform is True:
+            return np.exp(kernel.lengthscale.values), np.exp(kernel.variance.values[0])
+        else:
+            return kernel.lengthscale.values, kernel.variance.values[0]
+
+    def _cached_n_s(self, prior: Union[Gaussian, Gaussian1D], kernel: Kern, X_D: ndarray,
+                    log_transform: bool) -> ndarray:
+        """Return the vector n_s for the given data, computing only the elements for data which is not yet cached."""
+        w, h = self._kernel_scales(kernel, log_transform)
+
+        # Defined in Equations 7.1.7, generalised to any kernel supported by kernel_mean.
+        def compute_n_s(x):
+            return kernel_mean(kernel, prior, x, variance=h, lengthscale=w)
+
+        prior_covariance = prior.matrix_variance if isinstance(prior, Gaussian1D) else prior.covariance
+        parameters = (kernel.param_array, np.array(log_transform), np.asarray(prior.mean), np.asarray(prior_covariance))
+
+        return self._n_s_cache.get(X_D, parameters, compute_n_s)
+
+    @last_value_cache
+    def _kernel_double_integral(self, parameters: ndarray) -> float:
+        """Integrate the kernel against the prior in both arguments. `parameters` holds the kernel variance, followed by
+        one lengthscale per dimension and then the flattened prior covariance, so that the cache is invalidated whenever
+        any of these change."""
+        num_dimensions = self.gp._gpy_gp.X.shape[1]
+
+        return kernel_double_integral(self.gp.kernel, self.prior, variance=parameters[0],
+                                      lengthscale=parameters[1:num_dimensions + 1])
 
     def sample_histogram(self, x: np.ndarray, sample_count=50,):
         assert x.ndim <= 2
@@ -353,10 +504,11 @@ class OriginalIntegrandModel(IntegrandModel):
             # print(ys.shape)
         assert ys.shape == (n, d, sample_count)
         res = np.zeros((sample_count, ))
-        _, K_xx_inv, n_s = self._compute_mean(prior=self.prior, gp=self.gp, kernel=self.gp.kernel, X_D=x, Y_D=-1)
-        # Find the inverse of K_xx matrix via Cholesky decomposition (with jitter)
+        _, K_xx_cho, n_s = self._compute_mean(prior=self.prior, gp=self.gp, kernel=self.gp.kernel, X_D=x, Y_D=-1)
+        # The weights K_xx^-1 n_s are shared by every sample, so are found with a single Cholesky solve.
+        weights = cho_solve((K_xx_cho, True), n_s)
         for j in range(ys.shape[2]):
-            res[j] = n_s.T @ K_xx_inv @ ys[:, :, j]
+            res[j] = weights @ ys[:, :, j]
         return res, ys
 
 
@@ -0,0 +1,143 @@
+# Streaming estimators and convergence diagnostics for Markov chain Monte Carlo
+
+import numpy as np
+from typing import Sequence
+
+# The number of batch means kept for each chain. Once this many batches are complete, adjacent batches are merged in
+# pairs and the batch size is doubled, so that the memory and per-step cost stay constant however long the chain runs.
+DEFAULT_MAX_BATCHES = 64
+
+
+class ChainStatistics:
+    """
+    Running statistics of a scalar quantity evaluated along one or more Markov chains which are stepped in lockstep.
+
+    The mean and variance of each chain are accumulated with Welford's algorithm. The Monte Carlo standard error of the
+    pooled mean is estimated by the method of batch means: each chain is split into consecutive batches, and the
+    spread of the batch means (which are approximately independent once batches are longer than the autocorrelation
+    time) gives the variance of the chain mean. The effective sample size is the ratio of the variance of the quantity
+    to the squared standard error, and the potential scale reduction factor (R-hat) of Gelman and Rubin compares the
+    spread within and between chains.
+
+    Every update costs O(num_chains), and all state is held in arrays preallocated on construction.
+    """
+    def __init__(self, num_chains: int = 1, max_batches: int = DEFAULT_MAX_BATCHES):
+        """
+        :param num_chains: number of chains, each of which contributes one value per update
+        :param max_batches: number of batch means kept per chain - must be even
+        """
+        assert max_batches >= 2 and max_batches % 2 == 0
+        self.num_chains = num_chains
+        self.max_batches = max_batches
+
+        self.count = 0
+        self._means = np.zeros(num_chains)
+        self._sums_of_squares = np.zeros(num_chains)
+
+        self.batch_size = 1
+        self.num_batches = 0
+        self._batch_means = np.zeros((num_chains, max_batches))
+        self._current_batch_sums = np.zeros(num_chains)
+        self._current_batch_count = 0
+
+    def update(self, y: np.ndarray):
+        """
+        Add the next value of each chain
+        :param y: array of shape (num_chains)
+        """
+        y = np.reshape(y, self.num_chains)
+
+        self.count += 1
+        delta = y - self._means
+        self._means += delta / self.count
+        self._sums_of_squares += delta * (y - self._means)
+
+        self._current_batch_sums += y
+        self._current_batch_count += 1
+        if self._current_batch_count == self.batch_size:
+            self._batch_means[:, self.num_batches] = self._current_batch_sums / self.batch_size
+            self.num_batches += 1
+            self._current_batch_sums[:] = 0.
+            self._current_batch_count = 0
+            if self.num_batches == self.max_batches:
+                self._consolidate_batches()
+
+    def _consolidate_batches(self):
+        """Merge adjacent pairs of batches, halving the number of batches and doubling the batch size"""
+        half = self.max_batches // 2
+        self._batch_means[:, :half] = (self._batch_means[:, 0::2] + self._batch_means[:, 1::2]) / 2
+        self.num_batches = half
+        self.batch_size *= 2
+
+    @property
+    def chain_means(self) -> np.ndarray:
+        """The mean of each chain, as an array of shape (num_chains)"""
+        return self._means.copy()
+
+    @property
+    def chain_variances(self) -> np.ndarray:
+        """The sample variance of each chain, as an array of shape (num_chains)"""
+        if self.count < 2:
+            return np.full(self.num_chains, np.nan)
+        return self._sums_of_squares / (self.count - 1)
+
+    @property
+    def mean(self) -> float:
+        """The mean over all values of all chains"""
+        return np.mean(self._means) if self.count else np.nan
+
+    @property
+    def variance(self) -> float:
+        """The sample variance over all values of all chains"""
+        total_count = self.count * self.num_chains
+        if total_count < 2:
+            return np.nan
+        between_chains = self.count * np.sum((self._means - np.mean(self._means)) ** 2)
+        return (np.sum(self._sums_of_squares) + between_chains) / (total_count - 1)
+
+    @property
+    def standard_error(self) -> float:
+        """The batch means estimate of the Monte Carlo standard error of the pooled mean"""
+        if self.num_batches < 2:
+            return np.nan
+        batch_means = self._batch_means[:, :self.num_batches]
+        batch_variance = np.var(batch_means, axis=1, ddof=1)
+        # Each chain mean has variance batch_variance / num_batches, and the pooled mean averages num_chains of them
+        return np.sqrt(np.mean(batch_variance) / (self.num_batches * self.num_chains))
+
+    @property
+    def effective_sample_size(self) -> float:
+        """The number of independent samples which would give the same standard error as the chains"""
+        return self.variance / self.standard_error ** 2
+
+    @property
+    def r_hat(self) -> float:
+        """The potential scale reduction factor of Gelman and Rubin, which approaches 1 as the chains converge"""
+        if self.num_chains < 2 or self.count < 2:
+            return np.nan
+        n = self.count
+        within_chains = np.mean(self.chain_variances)
+        between_chains = n * np.var(self._means, ddof=1)
+        pooled_variance = (n - 1) / n * within_chains + between_chains / n
+        return np.sqrt(pooled_variance / within_chains)
+
+    @classmethod
+    def concatenate(cls, statistics: Sequence["ChainStatistics"]) -> "ChainStatistics":
+        """
+        Combine the statistics of independent sets of chains which have been run for the same number of steps into the
+        statistics of all of the chains together
+        :param statistics: the statistics of each set of chains
+        :return: the combined statistics
+        """
+        first = statistics[0]
+        assert all(each.count == first.count and each.max_batches == first.max_batches for each in statistics), \
+            "Only statistics of chains of the same length can be combined!"
+
+        combined = cls(sum(each.num_chains for each in statistics), first.max_batches)
+        combined.count = first.count
+        combined.batch_size = first.batch_size
+        combined.num_batches = first.num_batches
+        combined._current_batch_count = first._current_batch_count
+        for name in ("_means", "_sums_of_squares", "_batch_means", "_current_batch_sums"):
+            setattr(combined, name, np.concatenate([getattr(each, name) for each in statistics]))
+        return combined
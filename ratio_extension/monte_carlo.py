@@ -1,7 +1,10 @@
 # Xingchen Wan | xingchen.wan@st-annes.ox.ac.uk 2018
 # An implementation of Monte Carlo Quadrature (Slice Sampling)
 
+import os
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from ratio_extension.chain_statistics import ChainStatistics
 from ratio_extension.naive_quadratures import NaiveMethods
 from ratio_extension.test_functions import TrueFunctions
 from bayesquad.priors import Prior
@@ -21,11 +24,13 @@ class MonteCarlo(NaiveMethods):
         self.options = self._unpack_options(**options)
         self.sample_count = self.options['num_batches']
         self.widths = self.options['width']
+        self.num_chains = self.options['num_chains']
         self.iterations = 0
         self.results = np.zeros(self.options['num_batches'])
-        # Set up a container for all the samples
-        self.selected_points = np.zeros((self.sample_count, self.dim))
-        self.evaluated_points = []
+        # Set up a container for all the samples - at each step, one sample is drawn from each chain
+        self.selected_points = np.zeros((self.sample_count, self.num_chains, self.dim))
+        self.evaluated_points = np.zeros((self.sample_count, self.num_chains))
+        self.statistics = ChainStatistics(self.num_chains)
 
     def _batch_iterate(self, x: np.ndarray = None,):
         """
@@ -33,139 +38,201 @@ class MonteCarlo(NaiveMethods):
         $
         p(\phi|z_d) = \frac{r(\phi)p(\phi)}{\int r(\phi)p(\phi)d\phi}
         $
-        :param x: query point
-        :return:
+        for each of a number of independent chains. The chains step in lockstep, so that each evaluation of the prior
+        and r is made on a batch of points (one per chain which is still stepping out or shrinking its slice) rather
+        than on a single point.
+        :param x: current point of each chain, as an array of shape (num_chains, dim)
+        :return: the next point of each chain, as an array of shape (num_chains, dim)
         """
-        perm = range(self.dim)
-        np.random.shuffle(perm)
+        x = np.array(x, dtype=float).reshape(-1, self.dim)
+        num_chains = x.shape[0]
         log_prob = self._eval_fns_log(x, self.p, self.r)
-        x_l = x.copy()
-        x_r = x.copy()
-        x_prime = x.copy()
-        for dd in perm:
-            log_prob_perturbed = log_prob + np.log(np.random.rand())
+        for dd in np.random.permutation(self.dim):
             # Perturb by log probability of the last likelihood by a random number in the range of (0, 1)
-            rdm = np.random.rand()
-            x_l[dd] = x[dd] - rdm * self.widths[dd]
-            x_r[dd] = x[dd] + (1-rdm) * self.widths[dd]
+            log_prob_perturbed = log_prob + np.log(np.random.rand(num_chains))
+            rdm = np.random.rand(num_chains)
+            x_l = x[:, dd] - rdm * self.widths[dd]
+            x_r = x[:, dd] + (1 - rdm) * self.widths[dd]
             if self.options['step_out']:
-                while self._eval_fns_log(x_l, self.p, self.r) > log_prob_perturbed:
-                    x_l[dd] -= self.widths[dd]
-                while self._eval_fns_log(x_r, self.p, self.r) > log_prob_perturbed:
-                    x_r[dd] += self.widths[dd]
-            while True:
-                x_prime[dd] = np.random.rand() * (x_r[dd] - x_l[dd]) + x_l[dd]
-                log_prob_x_prime = self._eval_fns_log(x_prime, self.p, self.r)
-                if log_prob_x_prime > log_prob_perturbed:
-                    break
-                else:
-                    if x_prime[dd] > x[dd]:
-                        x_r[dd] = x_prime[dd]
-                    elif x_prime[dd] < x[dd]:
-                        x_l[dd] = x_prime[dd]
-                    else:
-                        raise RuntimeError("Invalid shrinkage!")
-            x[dd] = x_prime[dd]
-            x_l[dd] = x_prime[dd]
-            x_r[dd] = x_prime[dd]
+                for bound, step in ((x_l, -self.widths[dd]), (x_r, self.widths[dd])):
+                    # Only the chains whose bound is still inside the slice are evaluated and stepped out
+                    stepping = np.arange(num_chains)
+                    while stepping.size:
+                        inside = self._eval_fns_log(self._replace_coordinate(x[stepping], dd, bound[stepping]),
+                                                    self.p, self.r) > log_prob_perturbed[stepping]
+                        stepping = stepping[inside]
+                        bound[stepping] += step
 
+            x_prime = x[:, dd].copy()
+            shrinking = np.arange(num_chains)
+            while shrinking.size:
+                proposal = np.random.rand(shrinking.size) * (x_r[shrinking] - x_l[shrinking]) + x_l[shrinking]
+                log_prob_proposal = self._eval_fns_log(self._replace_coordinate(x[shrinking], dd, proposal),
+                                                       self.p, self.r)
+                accepted = log_prob_proposal > log_prob_perturbed[shrinking]
+
+                x_prime[shrinking[accepted]] = proposal[accepted]
+                log_prob[shrinking[accepted]] = log_prob_proposal[accepted]
+
+                # Shrink the slice of each rejected chain towards its current point
+                rejected, proposal = shrinking[~accepted], proposal[~accepted]
+                above = proposal > x[rejected, dd]
+                x_r[rejected[above]] = proposal[above]
+                x_l[rejected[~above]] = proposal[~above]
+                shrinking = rejected
+            x[:, dd] = x_prime
+
+        return x
+
+    @staticmethod
+    def _replace_coordinate(x: np.ndarray, dd: int, values: np.ndarray) -> np.ndarray:
+        """
+        Return a copy of the points x with the dd-th coordinate of each replaced by the corresponding element of values
+        """
+        x = x.copy()
+        x[:, dd] = values
         return x
 
     @staticmethod
-    def _eval_fns_log(x: np.ndarray, prior: Prior, *funcs: TrueFunctions) -> float:
+    def _eval_fns_log(x: np.ndarray, prior: Prior, *funcs: TrueFunctions) -> np.ndarray:
         """
         Evaluate the log(g(\phi)) where g is:
         $
         g = \prod f(\phi) p(\phi)
         $
         at x.
-        :param x: query point for function evaluation
+        :param x: query points for function evaluation, as an array of shape (num_points, dim)
         :param prior: p(\phi)
         :param funcs: one or more functions in term of x
-        :return: result
+        :return: result, as an array of shape (num_points)
         """
-        res = 0.
+        res = prior.log_pdf(x)
         for each_func in funcs:
-            res += each_func.log_sample(x)
-        res += np.log(prior(x))
+            res = res + each_func.log_sample(x)
         return res
 
+    def iterate(self):
+        """
+        Run the slice sampler, updating a streaming estimate of the integral ratio after every step. The running mean,
+        variance and standard error of q(\phi) over the draws made after burn-in are kept in self.statistics, so each
+        step costs the same however many draws have been made.
+        :return: a generator which yields, after each step, the index of the step, the current estimate of the integral
+        ratio and its Monte Carlo standard error (both NaN until enough draws have been made after burn-in)
+        """
+        self.statistics = ChainStatistics(self.num_chains)
+        x = self.options['initial_point']
+        for i in range(self.options['num_batches']):
+            # Draw a sample from the parameter posterior for each chain
+            x = self._batch_iterate(x)
+            self.selected_points[i] = x
+
+            # Evaluate q(\phi) at the drawn points and add to the bag of evaluated points
+            y = self.q.sample(x)
+            self.evaluated_points[i] = y
+            if i >= self.options['burn_in']:
+                self.statistics.update(y)
+
+            yield i, self.statistics.mean, self.statistics.standard_error
+
     def quadrature(self) -> float:
         """
         The quadrature process models the numerator and denominator separately, and hence there are two sample acquisi-
         tion processes and so the random numbers generated in the numerator and denominator in each step are different
         from each other. At each step, the volume by evaluating the maximum and minimum value of the samples acquired
         across all dimensions is also computed which is used to approximate the integral value.
+
+        If the option target_standard_error is set, sampling stops as soon as the standard error of the estimate falls
+        below it (once enough draws have been made for the standard error to be reliable), and the results of any
+        remaining steps are NaN.
         :return: float - the final evaluated integral ratio at the last evaluation step
         """
-        x = self.options['initial_point']
-        for i in range(self.options['num_batches']):
-            # Draw a sample from the parameter posterior
-            x_prime = self._batch_iterate(x)
-            self.selected_points[i, :] = x_prime.copy()
-
-            # Evaluate q(\phi) at the drawn point and add to the bag of evaluated points
-            y = self.q.sample(x_prime)
-            self.evaluated_points.append(y)
-
-            x = x_prime
-            # vol = self._find_volume()
-            integral_mean = np.sum(self.evaluated_points) / i
-            if i >= self.options['burn_in']:
-                self.results[i] = integral_mean
-                if i % self.options['display_step'] == 1:
-                    print("Iteration " + str(i) + ": " + str(self.results[i]))
-                    print('Integral Mean: '+ str(integral_mean))
-                    if self.options['plot_iterations']:
-                        self.draw_samples(i)
-                        plt.show()
-            else:
-                self.results[i] = np.nan
+        self.results[:] = np.nan
+        for i, integral_mean, standard_error in self.iterate():
+            if i < self.options['burn_in']:
+                continue
+            self.results[i] = integral_mean
+            if i % self.options['display_step'] == 1:
+                print("Iteration " + str(i) + ": " + str(self.results[i]))
+                print('Integral Mean: ' + str(integral_mean) + ' Standard Error: ' + str(standard_error) +
+                      ' Effective Sample Size: ' + str(self.statistics.effective_sample_size))
+                if self.options['plot_iterations']:
+                    self.draw_samples(i)
+                    plt.show()
+            target_standard_error = self.options['target_standard_error']
+            # The batch means standard error is only trusted once batches hold more than one draw per chain
+            if target_standard_error is not None and self.statistics.batch_size > 1 \
+                    and standard_error <= target_standard_error:
+                break
 
         plt.show()
-        return self.results[-1]
+        return self.results[i]
 
-    def _find_volume(self,) -> tuple:
+    def parallel_quadrature(self, num_workers: int = None) -> float:
         """
-        Compute the volume (or the higher dimensional equivalent for volume) for the Monte Carlo integration
-        :return: volume
+        Run independent sets of chains in a pool of worker processes, and pool their draws into a single estimate of the
+        integral ratio. Each worker runs num_chains chains for num_batches steps (stopping early at the target standard
+        error is not supported here), from initial points drawn independently from the prior and with its own random
+        seed. Only the running statistics of each worker's chains are sent back, and these are combined into
+        self.statistics, from which the pooled standard error, effective sample size and R-hat are reported.
+        :param num_workers: number of worker processes - defaults to the number of CPUs
+        :return: float - the pooled estimate of the integral ratio
         """
-        vol = 1
-        if len(self.selected_points) == 0:
-            return 0, 0
-        for i in range(self.dim):
-            slice = self.selected_points[:, i]
-            vol *= max(slice) - min(slice)
-        # print(vol_num, vol_den)
-        return vol
+        if num_workers is None:
+            num_workers = os.cpu_count()
+
+        num_chains = num_workers * self.num_chains
+        initial_points = np.reshape(self.p.sample(num_chains), (num_workers, self.num_chains, self.dim))
+        seeds = np.random.randint(np.iinfo(np.int32).max, size=num_workers)
+        options = dict(self.options, target_standard_error=None, plot_iterations=False)
+
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(_run_chains, self.r, self.q, self.p, self.true_prediction_integral,
+                                       self.true_evidence_integral, dict(options, initial_point=points), seed)
+                       for points, seed in zip(initial_points, seeds)]
+            self.statistics = ChainStatistics.concatenate([future.result() for future in futures])
+
+        print('Integral Mean: ' + str(self.statistics.mean) +
+              ' Standard Error: ' + str(self.statistics.standard_error) +
+              ' Effective Sample Size: ' + str(self.statistics.effective_sample_size) +
+              ' R-hat: ' + str(self.statistics.r_hat))
+        return self.statistics.mean
 
     def _unpack_options(self,
                         num_batches: int = 1000,
                         width: Union[float, np.ndarray] = 0.5,
                         step_out: bool = True,
                         initial_point: np.ndarray = None,
+                        num_chains: int = 1,
                         plot_iterations: bool = False,
                         display_step: int = 10,
                         burn_in: int = None,
+                        target_standard_error: float = None,
                         ) -> dict:
         """
         Unpack optional keyword arguments supplied
         :param num_batches: Number of samples in the Monte Carlo method
         :param width: the size of "jump" between successive steps of MCMC
         :param step_out: as per Neal's paper (2003) on improving slice sampling
-        :param initial_point: Initial sampling point of the method. Default value is the origin in the d-dimensional
-        space where d is the dimensionality of the input space
+        :param initial_point: Initial sampling point of the method - either a single point shared by every chain, or an
+        array of shape (num_chains, d) with one point per chain. Default value is the origin in the d-dimensional space
+        where d is the dimensionality of the input space for a single chain, or independent draws from the prior for
+        multiple chains
+        :param num_chains: number of independent slice sampling chains, which are stepped simultaneously
         :param plot_iterations: whether to enable the visualisation of the sample acquisition process
         :param burn_in: number of initial samples to be discarded
+        :param target_standard_error: the Monte Carlo standard error at which sampling stops early - by default, all
+        num_batches steps are run
         :return: dictionary for use of the object
         """
         if initial_point is not None:
-            assert initial_point.ndim == 1
-            assert initial_point.shape[0] == self.dim
-        else:
+            assert initial_point.ndim in (1, 2)
+            assert initial_point.shape[-1] == self.dim
+            initial_point = np.broadcast_to(initial_point, (num_chains, self.dim)).copy()
+        elif num_chains == 1:
             initial_point = np.array([[0.]*self.dim])
-        if isinstance(width, float):
-            width = np.array([width])
+        else:
+            initial_point = np.reshape(self.p.sample(num_chains), (num_chains, self.dim))
+        width = np.broadcast_to(width, (self.dim,))
         if burn_in is None:
             burn_in = min(50, int(num_batches * 0.1))
         return {
@@ -173,9 +240,11 @@ class MonteCarlo(NaiveMethods):
             'width': width,
             'step_out': step_out,
             'initial_point': initial_point,
+            'num_chains': num_chains,
             'plot_iterations': plot_iterations,
             'display_step': display_step,
-            'burn_in': burn_in
+            'burn_in': burn_in,
+            'target_standard_error': target_standard_error,
         }
 
     def initialise_gp(self):
@@ -185,18 +254,32 @@ class MonteCarlo(NaiveMethods):
         """Visualise the sample acquisition process in the Monte Carlo Sampler"""
         if i <= 2:
             return
-        selected_pts = self.selected_points[:i+1, :]
+        # Samples from all chains are plotted together, in the order in which they were drawn
+        selected_pts = self.selected_points[:i+1].reshape(-1, self.dim)
+        evaluated_pts = np.ravel(self.evaluated_points[:i+1])
+        recent = self.options['display_step'] * self.num_chains
         plt.subplot(311)
         plt.title("Parameter posterior")
         self.plot_parameter_posterior()
-        sns.distplot(self.selected_points[:i+1, :], kde=True)
+        sns.distplot(selected_pts, kde=True)
         plt.subplot(312)
         self.q.plot((-5, 0.1, 5))
-        plt.plot(selected_pts[:-self.options['display_step'], 0], self.evaluated_points[:-self.options['display_step']],
-                 'x', color='grey',)
-        plt.plot(selected_pts[-self.options['display_step']:, 0], self.evaluated_points[-self.options['display_step']:],
-                 'x', color='red')
+        plt.plot(selected_pts[:-recent, 0], evaluated_pts[:-recent], 'x', color='grey',)
+        plt.plot(selected_pts[-recent:, 0], evaluated_pts[-recent:], 'x', color='red')
         plt.title("Draws from Posterior")
         plt.subplot(313)
-        plt.plot(selected_pts[:i+1, 0], "x--")
-        plt.title('Selected Samples')
\ No newline at end of file
+        plt.plot(self.selected_points[:i+1, :, 0], "x--")
+        plt.title('Selected Samples')
+
+
+def _run_chains(r: TrueFunctions, q: TrueFunctions, p: Prior,
+                true_prediction_integral: float, true_evidence_integral: float, options: dict,
+                seed: int) -> ChainStatistics:
+    """
+    Run a set of slice sampling chains to completion and return their statistics. This is run in a worker process.
+    """
+    np.random.seed(seed)
+    sampler = MonteCarlo(r, q, p, true_prediction_integral, true_evidence_integral, **options)
+    for _ in sampler.iterate():
+        pass
+    return sampler.statistics
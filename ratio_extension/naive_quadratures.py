@@ -5,6 +5,7 @@ from bayesquad.quadrature import WarpedIntegrandModel, OriginalIntegrandModel
 from bayesquad.batch_selection import select_batch
 from bayesquad.gps import WsabiLGP, GP
 from bayesquad.priors import Prior
+from bayesquad._util import GrowableArray
 from ratio_extension.test_functions import TrueFunctions
 import numpy as np
 import GPy
@@ -85,8 +86,10 @@ class NaiveMethods(ABC):
     def plot_samples(self,):
         if len(self.selected_points) == 0:
             raise ValueError('Quadrature has not been run yet!')
-        plt.plot(self.selected_points, self.evaluated_den_points, 'x', color='b', label='Evaluated $r(\phi)$')
-        plt.plot(self.selected_points, self.evaluated_num_points, 'x', color='r', label='Evaluated $r(\phi)q(\phi)$')
+        plt.plot(self.selected_points.values, self.evaluated_den_points.values, 'x', color='b',
+                 label='Evaluated $r(\phi)$')
+        plt.plot(self.selected_points.values, self.evaluated_num_points.values, 'x', color='r',
+                 label='Evaluated $r(\phi)q(\phi)$')
         plt.legend()
 
     @abstractmethod
@@ -153,28 +156,29 @@ class NaiveWSABI(NaiveMethods):
         self.results = [np.nan] * self.options["num_batches"]
         self.initialise_gp()
 
-        self.selected_points = np.zeros((self.options['num_batches'], self.dim))
-        self.evaluated_den_points = np.zeros(self.options['num_batches'])
-        self.evaluated_num_points = self.evaluated_den_points.copy()
+        # Each batch adds batch_size points, so the evaluations are held in growable arrays
+        self.selected_points = GrowableArray(np.empty((0, self.dim)))
+        self.evaluated_den_points = GrowableArray(np.empty(0))
+        self.evaluated_num_points = GrowableArray(np.empty(0))
 
     def _batch_iterate(self,):
         # Active sampling by minimising the variance of the *integrand*, and then update the corresponding Gaussian
         # Process
         batch_phi = select_batch(self.model_den, self.options['batch_size'], "Kriging Believer")
-        self.selected_points[self.step_count, :] = batch_phi
+        self.selected_points.append(batch_phi)
 
         r_sample = self.r.sample(batch_phi)
         # p_sample = self.p(np.array(batch_phi))
         q_sample = self.q.sample(batch_phi)
 
         batch_y_den = r_sample
-        self.evaluated_den_points[self.step_count] = batch_y_den
+        self.evaluated_den_points.append(batch_y_den)
         # batch_y_den = np.sqrt(r_sample)
         self.model_den.update(batch_phi, batch_y_den)
         self.gpy_gp_den.optimize()
         # batch_y_num = np.sqrt(r_sample * self.q.sample(batch_phi))
         batch_y_num = batch_y_den * q_sample
-        self.evaluated_num_points[self.step_count] = batch_y_num
+        self.evaluated_num_points.append(batch_y_num)
         self.model_num.update(batch_phi, batch_y_num)
         self.gpy_gp_num.optimize()
 
@@ -238,9 +242,9 @@ class NaiveWSABI(NaiveMethods):
         posterior_den = np.squeeze(self.gpy_gp_den.posterior_samples_f(test_locations, size=sample_count), axis=1)
         posterior_num = np.squeeze(self.gpy_gp_num.posterior_samples_f(test_locations, size=sample_count), axis=1)
         #print(posterior_den)
-        selected_pts = self.selected_points[:self.step_count+1]
-        evaluated_den_points = self.evaluated_den_points[:self.step_count + 1]
-        evaluated_num_points = self.evaluated_num_points[:self.step_count + 1]
+        selected_pts = self.selected_points.values
+        evaluated_den_points = self.evaluated_den_points.values
+        evaluated_num_points = self.evaluated_num_points.values
 
         plt.subplot(211)
         plt.plot(test_locations, posterior_den)
@@ -271,9 +275,10 @@ class NaiveBQ(NaiveMethods):
         self.initialise_gp()
         self.results = [np.nan] * self.options["num_batches"]
 
-        self.selected_points = np.zeros((self.options['num_batches'], self.dim))
-        self.evaluated_den_points = np.zeros(self.options['num_batches'])
-        self.evaluated_num_points = self.evaluated_den_points.copy()
+        # Each batch adds batch_size points, so the evaluations are held in growable arrays
+        self.selected_points = GrowableArray(np.empty((0, self.dim)))
+        self.evaluated_den_points = GrowableArray(np.empty(0))
+        self.evaluated_num_points = GrowableArray(np.empty(0))
 
     def initialise_gp(self):
         init_x = np.zeros((self.dim,))
@@ -314,15 +319,15 @@ class NaiveBQ(NaiveMethods):
 
     def _batch_iterate(self,):
         batch_phi = select_batch(self.model_den, self.options['batch_size'], 'Kriging Believer')
-        self.selected_points[self.step_count, :] = batch_phi
+        self.selected_points.append(batch_phi)
         batch_y_den = self.r.sample(batch_phi)
         batch_y_num = batch_y_den * self.q.sample(batch_phi)
         self.model_den.update(batch_phi, batch_y_den)
         self.model_num.update(batch_phi, batch_y_num)
         self.gpy_gp_num.optimize()
         self.gpy_gp_den.optimize()
-        self.evaluated_den_points[self.step_count] = batch_y_den
-        self.evaluated_num_points[self.step_count] = batch_y_num
+        self.evaluated_den_points.append(batch_y_den)
+        self.evaluated_num_points.append(batch_y_num)
         num_integral_mean, _, _ = self.model_num.integral_mean()
         den_integral_mean, _, _ = self.model_den.integral_mean()
         if self.step_count % self.options['display_step'] == 1:
@@ -342,9 +347,9 @@ class NaiveBQ(NaiveMethods):
         numerator_samples = np.squeeze(numerator_samples)
         denominator_samples = np.squeeze(denominator_samples)
 
-        selected_pts = self.selected_points[:self.step_count]
-        evaluated_den_points = self.evaluated_den_points[:self.step_count]
-        evaluated_num_points = self.evaluated_num_points[:self.step_count]
+        selected_pts = self.selected_points.values
+        evaluated_den_points = self.evaluated_den_points.values
+        evaluated_num_points = self.evaluated_num_points.values
 
         #print(selected_pts)
         plt.subplot(211)
@@ -3,9 +3,10 @@
 # file.
 
 from bayesquad.priors import Prior
+from bayesquad._util import validate_dimensions
 from scipy.stats import norm
 import numpy as np
-from typing import Union
+from typing import Tuple, Union
 
 
 class Gaussian1D(Prior):
@@ -20,25 +21,36 @@ class Gaussian1D(Prior):
         self.matrix_mean = np.array([[mean]])
         self.matrix_precision = np.array([[1./variance]])
 
-    def sample(self,) -> np.ndarray:
-        res = norm.rvs(loc=self.mean, scale=np.sqrt(self.variance))
-        return np.array([res])
+        self._standard_deviation = np.sqrt(variance)
+        self._log_normalisation = -0.5 * np.log(2 * np.pi * variance)
 
-    def gradient(self, x: Union[float, list, np.ndarray]):
+    @property
+    def dimensions(self) -> int:
+        return 1
 
-        def _get_derivs(x, mean, var):
-            first_deriv = -(x - mean) / np.sqrt(2*np.pi) / (var ** 1.5) * \
-                      np.exp(-((x - mean) ** 2) / (2 * var))
-            second_deriv = 1 / (np.sqrt(2 * np.pi) * var * 2.5) * ((x - mean) ** 2 - var) * \
-                      np.exp(-((x - mean) ** 2) / (2 * var))
-            return first_deriv, second_deriv
+    def sample(self, num_points: int = None) -> np.ndarray:
+        if num_points is None:
+            return self.sample(1)[0]
+        return self.mean + self._standard_deviation * np.random.standard_normal((num_points, 1))
+
+    def _from_unit_hypercube(self, uniform_points: np.ndarray) -> np.ndarray:
+        return norm.ppf(uniform_points, loc=self.mean, scale=self._standard_deviation)
+
+    def gradient(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        validate_dimensions(x, 1)
+
+        pdf = self(x)[:, np.newaxis]
+        scaled_difference = (x - self.mean) * self.precision
+
+        jacobian = -pdf * scaled_difference
+        hessian = (pdf * (scaled_difference ** 2 - self.precision))[:, :, np.newaxis]
 
-        x = np.asarray(x)
-        assert x.ndim == 2
-        derivs = np.array([_get_derivs(x[i], self.mean, self.variance) for i in range(x.shape[0])])
-        jacobian = derivs[:, 0]
-        hessian = derivs[:, 1].reshape(x.shape[0], 1, 1)
         return jacobian, hessian
 
+    def log_pdf(self, x: Union[np.ndarray, list]) -> np.ndarray:
+        # For compatibility with older code, we also accept a list of points or a 1D array here.
+        x = np.reshape(np.asarray(x, dtype=float), -1)
+        return self._log_normalisation - 0.5 * (x - self.mean) ** 2 * self.precision
+
     def __call__(self, x: Union[np.ndarray, list]) -> np.ndarray:
-        return np.array([norm.pdf(np.asscalar(each_x), loc=self.mean, scale=self.variance) for each_x in x])
+        return np.exp(self.log_pdf(x))
@@ -10,6 +10,7 @@ import matplotlib.pyplot as plt
 from typing import Union
 from bayesquad.priors import Prior
 from scipy.integrate import quad
+from scipy.special import logsumexp
 
 
 class TrueFunctions:
@@ -57,18 +58,16 @@ class ProductOfGaussianMixture(TrueFunctions):
         self.gauss_mixtures = gauss_mixtures
         self.gauss_mixtures_count = len(gauss_mixtures)
 
-    def sample(self, x: Union[np.ndarray, float, list]):
-        x = self._sample_test(x)
-        if x.ndim <= 1:
-            y_s = np.array([each_mixture.sample(x) for each_mixture in self.gauss_mixtures])
-            print(y_s)
-            return np.prod(y_s)
-        else:
-            y_s = []
-            for j in range(x.shape[0]):
-                y_s.append([each_mixture.sample(x[j]) for each_mixture in self.gauss_mixtures])
-            y_s = np.asarray(y_s)
-            return np.prod(y_s, axis=1)
+    def sample(self, x: Union[np.ndarray, float, list]) -> np.ndarray:
+        """
+        Evaluate the product of the mixtures at one or more query points
+        :param x: the coordinate(s) of the query point(s) - see GaussMixture.sample
+        :return: a 1D array of the value of the function at each query point
+        """
+        return np.prod([each_mixture.sample(x) for each_mixture in self.gauss_mixtures], axis=0)
+
+    def log_sample(self, x: Union[np.ndarray, float, list]) -> np.ndarray:
+        return np.sum([each_mixture.log_sample(x) for each_mixture in self.gauss_mixtures], axis=0)
 
 
 class GaussMixture(TrueFunctions):
@@ -96,47 +95,72 @@ class GaussMixture(TrueFunctions):
         assert self.means.shape[0] == self.covs.shape[0], "Mean and Covariance List mismatch!"
         assert self.means.shape[0] == self.weights.shape[0]
         assert self.weights.ndim <= 1, "Weight vector must be a 1D array!"
+        self._precompute_components()
+
+    def _precompute_components(self):
+        """
+        Precompute the quantities needed to evaluate every Gaussian in the mixture at once: the means as a
+        (mixture_count, dimensions) array, the inverses of the Cholesky factors of the covariance matrices as a
+        (mixture_count, dimensions, dimensions) array, and the log normalising constant of each Gaussian
+        """
+        d = self.dimensions
+        self._component_means = np.reshape(self.means, (self.mixture_count, d)).astype(float)
+        covariances = np.reshape(self.covs, (self.mixture_count, d, d)).astype(float)
+        cholesky_factors = np.linalg.cholesky(covariances)
+        self._inverse_cholesky_factors = np.linalg.inv(cholesky_factors)
+        self._log_normalisers = -0.5 * d * np.log(2 * np.pi) - \
+            np.sum(np.log(np.diagonal(cholesky_factors, axis1=1, axis2=2)), axis=1)
+
+    def _component_log_pdfs(self, x: Union[np.ndarray, float, list]) -> np.ndarray:
+        """
+        Evaluate the log pdf of each Gaussian in the mixture at each query point
+        :param x: the coordinate(s) of the query point(s) - see sample
+        :return: an array of shape (num_points, mixture_count)
+        """
+        x = self._sample_test(x)
+        # In 1D, a 1D array is a list of query points, whereas in higher dimensions it is a single query point
+        x = np.reshape(x, (-1, self.dimensions))
+
+        differences = x[:, np.newaxis, :] - self._component_means[np.newaxis, :, :]
+        whitened_differences = np.einsum('kij,nkj->nki', self._inverse_cholesky_factors, differences, optimize=True)
+        return self._log_normalisers - 0.5 * np.sum(whitened_differences ** 2, axis=-1)
 
     def sample(self, x: Union[np.ndarray, float, list], ):
         """
         Sample from the true function either with one query point or a list of points
         :param x: the coordinate(s) of the query point(s)
-        :return: the value of the true function evaluated at the query point(s)
+        :return: the value of the true function evaluated at the query point(s), as a 1D array
         """
-        x = self._sample_test(x)
-        if x.ndim <= 1:
-            y = 0
-            for i in range(self.mixture_count):
-                if self.dimensions == 1:
-                    y += self.weights[i] * self.one_d_normal(x, self.means[i], self.covs[i])
-                else:
-                    y += self.weights[i] * self.multi_d_gauss(x, self.means[i], self.covs[i])
-        else:
-            x = np.squeeze(x, axis=1)
-            y = np.zeros((x.shape[0], ))
-            for i in range(self.mixture_count):
-                if self.dimensions == 1:
-                    y += self.weights[i] * self.one_d_normal(x, self.means[i], self.covs[i])
-                else:
-                    y += self.weights[i] * self.multi_d_gauss(x, self.means[i], self.covs[i])
-        return y
+        return np.exp(self._component_log_pdfs(x)) @ self.weights
+
+    def log_sample(self, x: Union[np.ndarray, float, list]) -> np.ndarray:
+        """
+        Evaluate the log of the true function, using the log-sum-exp trick so that points far from every component do
+        not underflow to log(0). The log is undefined (NaN) where mixtures with negative weights are negative
+        :param x: the coordinate(s) of the query point(s)
+        :return: the log of the value of the true function evaluated at the query point(s), as a 1D array
+        """
+        log_y, sign = logsumexp(self._component_log_pdfs(x), b=self.weights, axis=1, return_sign=True)
+        return np.where(sign > 0, log_y, np.nan)
 
     @staticmethod
     def one_d_normal(x: np.ndarray, mean, var) -> np.ndarray:
         assert x.ndim == 1
-        return np.array([norm.pdf(x[i], mean, var) for i in range(x.shape[0])])
+        return norm.pdf(x, mean, np.sqrt(var))
 
     @staticmethod
     def multi_d_gauss(x: np.ndarray, mean, cov) -> np.ndarray:
         assert x.ndim == 2
-        return np.array([multivariate_normal.pdf(x[i], mean=mean, cov=cov) for i in range(x.shape[0])])
+        return np.atleast_1d(multivariate_normal.pdf(x, mean=mean, cov=cov))
 
     def add_gaussian(self, means: Union[np.ndarray, float], var: Union[np.ndarray, float], weight: Union[np.ndarray, float]):
         assert means.shape == self.means.shape[1:]
         assert var.shape == self.covs.shape[1:]
-        self.means = np.append(self.means, means)
-        self.covs = np.append(self.covs, var)
+        self.means = np.append(self.means, [means], axis=0)
+        self.covs = np.append(self.covs, [var], axis=0)
         self.weights = np.append(self.weights, weight)
+        self.mixture_count = len(self.means)
+        self._precompute_components()
 
     def _rebase_weight(self):
         self.weights = self.weights / np.sum(self.weights)
@@ -252,11 +276,11 @@ def gauss_product(mean1: Union[np.ndarray, float], mean2: Union[np.ndarray, floa
 def approx_integrals(p: Prior, q: TrueFunctions, r: TrueFunctions) -> tuple:
     def pr(x: float) -> float:
         x = np.array([[x]])
-        return np.asscalar(p(x) * r.sample(x))
+        return (p(x) * r.sample(x)).item()
 
     def pqr(x: float) -> float:
         x = np.array([[x]])
-        return np.asscalar(p(x) * q.sample(x) * r.sample(x))
+        return (p(x) * q.sample(x) * r.sample(x)).item()
 
     integral_pr = quad(pr, -10, 10, )
     integral_pqr = quad(pqr, -10, 10, )
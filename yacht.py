@@ -7,12 +7,17 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import GPy
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from GPy.inference.latent_function_inference.var_dtc import VarDTC
+from GPy.util.linalg import jitchol
 from IPython.display import display
+from scipy.linalg import solve_triangular
 from typing import Union
 from bayesquad.priors import Gaussian
 from bayesquad.quadrature import OriginalIntegrandModel
 from bayesquad.batch_selection import select_batch, LOCAL_PENALISATION
-from bayesquad.gps import GP
+from bayesquad.gps import GP, SparseGP
 
 
 # Some global settings
@@ -25,6 +30,12 @@ col_headers = ['Longitudinal position of buoyancy centre',
                'Froude Number',
                'Residuary Resistance Per Unit Weight of Displacement']
 kernel = 'rbf'
+# Number of Gram matrices held in memory at once when evaluating a batch of log-likelihoods - each takes 8N^2 bytes
+likelihood_batch_size = 64
+# Size in bytes above which the pairwise squared differences of the inputs are memory-mapped rather than held in memory
+squared_differences_memory_limit = 2 ** 30
+# Jitter added to the diagonal of the Gram matrix by GPy's exact inference, which we match
+gpy_jitter = 1e-8
 
 
 class GPRegression:
@@ -34,6 +45,10 @@ class GPRegression:
         self.dimensions = self.X.shape[1]
         self.kernel_option = kernel
         self.model = self.init_gp_model()
+        # Squared difference between each pair of inputs in each dimension, of shape (d, N, N), computed only once since
+        # only the lengthscales (and not the inputs) change between likelihood evaluations
+        self._squared_differences_file = None
+        self.squared_differences = self._compute_squared_differences()
 
     @staticmethod
     def load_data(plot_graph=False):
@@ -71,6 +86,27 @@ class GPRegression:
         m = GPy.models.GPRegression(self.X, self.Y, ker)
         return m
 
+    def _compute_squared_differences(self) -> np.ndarray:
+        """
+        Compute the squared difference between each pair of inputs in each dimension. If this would take more than
+        squared_differences_memory_limit bytes, it is held in a memory-mapped temporary file instead of in memory. The
+        file is named and kept open for the lifetime of the model, so that worker processes can map it themselves.
+        :return: array of shape (d, N, N)
+        """
+        num_data = self.X.shape[0]
+        shape = (self.dimensions, num_data, num_data)
+        if np.prod(shape) * np.dtype(float).itemsize > squared_differences_memory_limit:
+            self._squared_differences_file = tempfile.NamedTemporaryFile()
+            res = np.memmap(self._squared_differences_file.name, dtype=float, mode='w+', shape=shape)
+        else:
+            res = np.empty(shape)
+        # Fill in one dimension at a time, so that no temporary of the full size is needed
+        for j in range(self.dimensions):
+            res[j] = (self.X[:, j, np.newaxis] - self.X[np.newaxis, :, j]) ** 2
+        if isinstance(res, np.memmap):
+            res.flush()
+        return res
+
     # ------------ Compute the marginal log-likelihood of the model -------- #
     def log_sample(self, x: Union[np.ndarray, float, list]) -> float:
         """
@@ -80,17 +116,51 @@ class GPRegression:
         noise parameter
         The length of the parameter array must be exactly 2 more than the dimensionality of the data
         :return: the log-likelihood of the model evaluated.
-        """
 
-        # Transform to exponentiated space
-        x = np.asarray(np.exp(x)).reshape(-1)
-        # display(self.model)
-        assert len(x) == self.dimensions + 2
+        The log-likelihood is computed from the cached squared differences of the inputs (see batch_log_sample), so the
+        parameters of self.model are left unchanged.
+        """
+        x = np.asarray(x, dtype=float).reshape(-1)
         # 2 extra dimensions to accommodate the Gaussian noise and model variance parameter of the RBF kernel
-        self.model.rbf.variance = x[0]
-        self.model.rbf.lengthscale = x[1:-1]
-        self.model.Gaussian_noise.variance = x[-1]
-        return self.model.log_likelihood()
+        assert len(x) == self.dimensions + 2
+        return self.batch_log_sample(x)[0]
+
+    def batch_log_sample(self, x: np.ndarray, executor: ProcessPoolExecutor = None,
+                         num_chunks: int = 1) -> np.ndarray:
+        """
+        Compute the log-likelihoods of a batch of parameter arrays. Unlike log_sample, this does not touch the GPy
+        model: the Gram matrix for each parameter array is built directly from the precomputed squared differences of
+        the inputs, and the log-likelihood is computed from its Cholesky factor, so there is no parameter update
+        overhead.
+        :param x: array of shape (m, d+2). Each row is a parameter array in log space, ordered as in log_sample
+        :param executor: if given, a pool created by likelihood_executor, between whose workers the batch is split
+        :param num_chunks: number of evenly sized chunks into which the batch is split when an executor is given -
+        typically the number of workers, since each chunk only costs one small message to and from its worker
+        :return: array of shape (m) of the log-likelihoods of the model evaluated at each parameter array
+        """
+        if self.kernel_option != 'rbf':
+            raise NotImplementedError()
+        x = np.asarray(x, dtype=float).reshape(-1, self.dimensions + 2)
+        if executor is None:
+            return rbf_log_likelihoods(self.squared_differences, self.Y, x)
+
+        return np.concatenate(list(executor.map(_worker_rbf_log_likelihoods, np.array_split(x, num_chunks))))
+
+    def likelihood_executor(self, num_workers: int) -> ProcessPoolExecutor:
+        """
+        Create a pool of worker processes for batch_log_sample. The squared differences of the inputs and the outputs
+        are sent to each worker once, when it starts, rather than with every batch. If the squared differences are
+        memory-mapped, only the path of their file is sent, and each worker maps the file read-only, so that no worker
+        holds a copy of them in memory.
+        :param num_workers: number of worker processes
+        :return: the pool, which should be shut down (e.g. by using it as a context manager) once it is no longer needed
+        """
+        if isinstance(self.squared_differences, np.memmap):
+            initargs = (self.squared_differences.filename, self.Y, self.squared_differences.shape)
+        else:
+            initargs = (self.squared_differences, self.Y)
+        return ProcessPoolExecutor(max_workers=num_workers, initializer=_initialise_likelihood_worker,
+                                   initargs=initargs)
 
     def sample(self, x: Union[np.ndarray, float, list]) -> float:
         """
@@ -114,6 +184,61 @@ class GPRegression:
         return res
 
 
+def rbf_log_likelihoods(squared_differences: np.ndarray, Y: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """
+    Compute the marginal log-likelihood of a GP regression model with an ARD RBF kernel and Gaussian noise for each of a
+    batch of parameter arrays, in the same way as GPy's exact inference.
+    :param squared_differences: array of shape (d, N, N) of the squared difference between each pair of inputs in each
+    dimension
+    :param Y: array of shape (N, 1) of outputs
+    :param x: array of shape (m, d+2) of parameter arrays in log space, ordered as in GPRegression.log_sample
+    :return: array of shape (m) of log-likelihoods
+    """
+    params = np.exp(x)
+    variances, lengthscales, noise_variances = params[:, 0], params[:, 1:-1], params[:, -1]
+    num_data = Y.shape[0]
+    diagonal = np.arange(num_data)
+
+    res = np.zeros(len(params))
+    for start in range(0, len(params), likelihood_batch_size):
+        batch = slice(start, start + likelihood_batch_size)
+        # The Gram matrices of the whole batch, of shape (batch_size, N, N), each being one weighted sum plus exp
+        inverse_squared_lengthscales = 1. / lengthscales[batch] ** 2
+        scaled_distances = np.tensordot(inverse_squared_lengthscales, squared_differences, axes=1)
+        K = variances[batch, np.newaxis, np.newaxis] * np.exp(-0.5 * scaled_distances)
+        K[:, diagonal, diagonal] += (noise_variances[batch] + gpy_jitter)[:, np.newaxis]
+
+        for i, K_i in enumerate(K):
+            L = jitchol(K_i)
+            whitened_Y = solve_triangular(L, Y, lower=True)
+            res[start + i] = -0.5 * Y.size * np.log(2 * np.pi) - Y.shape[1] * np.sum(np.log(np.diag(L))) \
+                - 0.5 * np.sum(whitened_Y ** 2)
+    return res
+
+
+# The squared differences of the inputs and the outputs held by a worker process of GPRegression.likelihood_executor
+_worker_squared_differences = None
+_worker_Y = None
+
+
+def _initialise_likelihood_worker(squared_differences: Union[np.ndarray, str], Y: np.ndarray, shape: tuple = None):
+    """
+    :param squared_differences: the squared differences of the inputs, or the path of a file holding them
+    :param Y: the outputs
+    :param shape: the shape of the squared differences, if they are given as a path
+    """
+    global _worker_squared_differences, _worker_Y
+
+    if isinstance(squared_differences, str):
+        squared_differences = np.memmap(squared_differences, dtype=float, mode='r', shape=shape)
+    _worker_squared_differences = squared_differences
+    _worker_Y = Y
+
+
+def _worker_rbf_log_likelihoods(x: np.ndarray) -> np.ndarray:
+    return rbf_log_likelihoods(_worker_squared_differences, _worker_Y, x)
+
+
 class GPLikelihood:
     """
     Likelihood Computation of a GP Regression
@@ -150,30 +275,43 @@ class GPLikelihood:
         prior_cov = self.options['prior_variance']
         budget = self.options['smc_budget']
 
-        mc_samples = np.zeros((budget, self.gpr.dimensions+2))
-        mc_int = np.zeros((budget, ))
+        # Draw all the samples from the prior distribution in log space up front
+        log_mc_samples = np.random.multivariate_normal(mean=prior_mean, cov=prior_cov, size=budget)
+        mc_samples = np.exp(log_mc_samples)
         mc_out = np.zeros((budget, ))
         log_mc_int = np.zeros((budget, ))
-
-        for i in range(budget):
-            # Draw a sample from the prior distribution
-            mc_samples[i, :] = np.exp(np.random.multivariate_normal(mean=prior_mean, cov=prior_cov))
-            # Evaluate the sample query point on the likelihood function
-            mc_out[i] = self.gpr.log_sample(mc_samples[i, :])
-            mc_max = np.max(mc_out[:i+1])
-            mc_int[i] = np.mean(np.exp(mc_out[:i+1] - mc_max))
-            log_mc_int[i] = np.log(mc_int[i]) + mc_max
-
-            if i % 10 == 0:
-                self.plot_iterations(i, mc_samples, mc_out)
-                print("Step", str(i))
-                if display_noise:
-                    pass
-                else:
-                    print('samples', mc_samples[i, :])
-                    print("Current estimate of Log-evidence: ", log_mc_int[i])
-                    plt.plot(log_mc_int[:i])
-                plt.show()
+        log_sum = -np.inf
+
+        num_workers = self.options['num_workers']
+        evaluate_up_front = num_workers is not None and num_workers > 1
+        if evaluate_up_front:
+            # Evaluate the whole budget in one chunk per worker, so that the pool is started and the data sent to the
+            # workers only once, and each worker then evaluates its chunk in blocks of likelihood_batch_size
+            with self.gpr.likelihood_executor(num_workers) as executor:
+                mc_out = self.gpr.batch_log_sample(log_mc_samples, executor=executor, num_chunks=num_workers)
+
+        for start in range(0, budget, likelihood_batch_size):
+            batch = slice(start, start + likelihood_batch_size)
+            if not evaluate_up_front:
+                # Evaluate the sample query points on the likelihood function as a batch
+                mc_out[batch] = self.gpr.batch_log_sample(log_mc_samples[batch])
+            # Running log of the sum of the likelihoods, and hence log of their mean
+            log_sums = np.logaddexp.accumulate(np.append(log_sum, mc_out[batch]))[1:]
+            log_sum = log_sums[-1]
+            log_mc_int[batch] = log_sums - np.log(np.arange(start + 1, start + len(log_sums) + 1))
+
+            for i in range(start, start + len(log_sums)):
+                if i % 10 == 0:
+                    self.plot_iterations(i, mc_samples, mc_out)
+                    print("Step", str(i))
+                    if display_noise:
+                        pass
+                    else:
+                        print('samples', mc_samples[i, :])
+                        print("Current estimate of Log-evidence: ", log_mc_int[i])
+                        plt.plot(log_mc_int[:i])
+                    plt.show()
+        mc_int = np.exp(log_mc_int - np.maximum.accumulate(mc_out))
         self.smc_samples = log_mc_int
         return mc_int[-1], log_mc_int[-1]
 
@@ -211,8 +349,15 @@ class GPLikelihood:
         # Initial guess for the GP for BQ
         lik = GPy.likelihoods.Gaussian(variance=1e-10)
         prior = Gaussian(mean=prior_mean.reshape(-1), covariance=prior_cov)
-        gpy_gp = GPy.core.GP(initial_x, initial_y, kernel=kern, likelihood=lik)
-        gp = GP(gpy_gp)
+        if self.options['naive_bq_num_inducing'] is None:
+            gpy_gp = GPy.core.GP(initial_x, initial_y, kernel=kern, likelihood=lik)
+            gp = GP(gpy_gp)
+        else:
+            # Sparse GP with inducing points spread over the prior, so that each step costs O(NM^2) rather than O(N^3)
+            inducing_points = prior.sample_low_discrepancy(self.options['naive_bq_num_inducing'])
+            gpy_gp = GPy.core.SparseGP(initial_x, initial_y, inducing_points, kernel=kern, likelihood=lik,
+                                       inference_method=VarDTC())
+            gp = SparseGP(gpy_gp)
         model = OriginalIntegrandModel(gp=gp, prior=prior)
         for i in range(1, self.options['naive_bq_budget']):
             # Do active sampling
@@ -260,7 +405,9 @@ class GPLikelihood:
                         naive_bq_budget: int = 1000,
                         naive_bq_kern_lengthscale: float = 2.,
                         naive_bq_kern_variance: float = 2.,
+                        naive_bq_num_inducing: int = None,
                         wsabi_bq_budget: int = 1000,
+                        num_workers: int = None,
                         ) -> dict:
         """
         Unpack kwargs
@@ -269,6 +416,10 @@ class GPLikelihood:
         :param max_optimisation_restart: number of restarts of the MLE optimisation to avoid the likelihood function
         being trapped in local minima
         :param prior_mean and prior_variance: Prior mean and variance in log-space of the likelihood function
+        :param naive_bq_num_inducing: number of inducing points of a sparse GP used for naive Bayesian Quadrature - by
+        default, an exact GP is used, whose cost grows cubically with the number of samples
+        :param num_workers: number of worker processes used to evaluate batches of likelihoods - by default, batches
+        are evaluated in this process
         :return: a dictionary for the use of the object
         """
         if self.gpr.dimensions > 1 and isinstance(prior_variance, float) and isinstance(prior_mean, float):
@@ -288,7 +439,9 @@ class GPLikelihood:
             'naive_bq_budget': naive_bq_budget,
             'naive_bq_kern_lengthscale': naive_bq_kern_lengthscale,
             'naive_bq_kern_variance': naive_bq_kern_variance,
+            'naive_bq_num_inducing': naive_bq_num_inducing,
             'wsabi_bq_budget': wsabi_bq_budget,
+            'num_workers': num_workers,
         }
 
     # ---------------------------- Utility functions ------------------------ #